@@ -24,6 +24,14 @@ def create_app():
     app = Flask(__name__)
     app.config.from_object('app.config.Config')
 
+    # 🗜️ Кодек сжатия вложений проверяем при запуске, а не на первой загрузке файла
+    from app.compression import check_codec
+    check_codec(app.config['ATTACHMENT_COMPRESSION'])
+
+    # 📎 Файлы из формы пишутся сразу в UPLOAD_FOLDER, с подсчётом SHA-256 на лету
+    from app.uploads import UploadRequest
+    app.request_class = UploadRequest
+
     # 🔐 Проверка блокировки
     from flask_login import current_user, logout_user
     from flask import redirect, url_for, flash
@@ -90,6 +98,17 @@ def create_app():
         }
         return icons.get(ext, '📁')
     
+    @app.template_filter('filesize')
+    def filesize(size_bytes):
+        if size_bytes is None:
+            return ''
+        if size_bytes < 1024:
+            return f'{size_bytes} Б'
+        for unit in ('КБ', 'МБ', 'ГБ'):
+            size_bytes /= 1024
+            if size_bytes < 1024 or unit == 'ГБ':
+                return f'{size_bytes:.1f} {unit}'.replace('.', ',')
+
     @app.template_filter('prepend_dot')
     def prepend_dot(values):
         return ','.join(f'.{ext}' for ext in values)
@@ -101,12 +120,28 @@ def create_app():
     from app.routes.incoming import incoming_bp
     from app.routes.my_letters import my_letters_bp
     from app.routes.admin import admin_bp
+    from app.routes.search import search_bp
+    from app.routes.exports import exports_bp
 
     app.register_blueprint(auth_bp,    url_prefix='/auth')
     app.register_blueprint(outgoing_bp, url_prefix='/outgoing')
     app.register_blueprint(incoming_bp, url_prefix='/incoming')
     app.register_blueprint(my_letters_bp, url_prefix='/letters')
     app.register_blueprint(admin_bp,    url_prefix='/admin')
+    app.register_blueprint(search_bp,   url_prefix='/search')
+    app.register_blueprint(exports_bp,  url_prefix='/exports')
+
+    # Команды flask <...> для обслуживания
+    from app.commands import register_commands
+    register_commands(app)
+
+    # 🧹 Просроченные выгрузки удаляются по таймеру, даже если новых никто не запускает.
+    # Таймер заводит первый запрос: командам flask <...> он не нужен
+    from app.jobs import start_cleanup_timer
+
+    @app.before_request
+    def ensure_cleanup_timer():
+        start_cleanup_timer(app)
 
     return app
 
@@ -0,0 +1,110 @@
+import os
+import zipfile
+
+from flask import current_app
+from sqlalchemy import and_
+
+from app.compression import open_stored
+from app.exports import streaming_response
+from app.models import Attachment
+from app.uploads import CHUNK_SIZE
+
+
+# Уже сжатые форматы кладём как есть — повторное сжатие только тратит CPU
+STORED_EXTENSIONS = {'pdf', 'docx', 'xlsx', 'rar', 'zip', '7z', 'jpg', 'jpeg', 'png', 'gif'}
+
+
+class ZipSink:
+    """
+    Приёмник без seek: zipfile пишет сюда (с дескрипторами данных после каждого файла),
+    а генератор архива сразу забирает накопленные байты.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def attachment_rows(letter_model, letter_type, letters_query):
+    """Вложения писем из запроса: (номер письма, имя файла, путь, кодек, дата), серверным курсором."""
+    return (
+        letters_query
+        .join(Attachment, and_(Attachment.letter_id == letter_model.id, Attachment.letter_type == letter_type))
+        .with_entities(
+            letter_model.number, Attachment.filename, Attachment.filepath, Attachment.codec, Attachment.uploaded_at
+        )
+        .order_by(None)
+        .order_by(letter_model.year.desc(), letter_model.sequence_num.desc(), Attachment.id)
+        .execution_options(stream_results=True, yield_per=500)
+    )
+
+
+def zip_entries(rows):
+    """
+    Имена записей архива: <номер письма>/<исходное имя файла>.
+    Одинаковые имена внутри письма получают суффикс « (2)», « (3)»…
+    """
+    folder, used = None, set()
+    for number, filename, path, codec, uploaded_at in rows:
+        letter_folder = (number or 'без номера').replace('/', '_')
+        if letter_folder != folder:
+            folder, used = letter_folder, set()
+
+        base = (filename or os.path.basename(path)).replace('/', '_').replace('\\', '_')
+        stem, ext = os.path.splitext(base)
+        name, n = base, 2
+        while name in used:
+            name, n = f'{stem} ({n}){ext}', n + 1
+        used.add(name)
+
+        yield f'{folder}/{name}', path, codec, uploaded_at
+
+
+def stream_zip(entries):
+    """
+    ZIP-архив кусками, без временных файлов: в памяти только текущий кусок файла.
+    """
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, 'w') as archive:
+        for name, path, codec, uploaded_at in entries:
+            try:
+                source = open_stored(path, codec)
+            except (FileNotFoundError, TypeError):
+                current_app.logger.warning(f"Файл не найден при сборке архива: {path}")
+                continue
+
+            info = zipfile.ZipInfo(name, date_time=uploaded_at.timetuple()[:6])
+            ext = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+            info.compress_type = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+
+            with source, archive.open(info, 'w') as dest:
+                while chunk := source.read(CHUNK_SIZE):
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+
+    # Центральный каталог
+    yield sink.drain()
+
+
+def zip_response(rows, download_name):
+    return streaming_response(stream_zip(zip_entries(rows)), 'application/zip', download_name)
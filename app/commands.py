@@ -0,0 +1,133 @@
+import csv
+import sys
+
+import click
+
+from app.imports import ImportFileError, import_incoming
+from app.jobs import cleanup_exports
+from app.models import User
+from app.pipeline import STAGES, process_backlog, reset_stage
+from app.reconcile import RECONCILE_MODES, reconcile_uploads
+from app.storage import backfill_attachment_metadata, migrate_to_blobs
+
+
+def register_commands(app):
+    """Регистрирует служебные команды flask <...>."""
+
+    @app.cli.command('exports-cleanup')
+    def exports_cleanup():
+        """Удалить просроченные фоновые выгрузки и их файлы."""
+        removed = cleanup_exports()
+        click.echo(f'🧹 Удалено выгрузок: {removed}')
+
+    @app.cli.command('storage-migrate')
+    @click.option('--dry-run', is_flag=True, help='Только посчитать, ничего не переносить.')
+    @click.option('--batch-size', default=200, show_default=True, help='Вложений на одну транзакцию.')
+    def storage_migrate(dry_run, batch_size):
+        """Перенести файлы вложений в хранилище по содержимому (uploads/blobs)."""
+        stats = migrate_to_blobs(dry_run=dry_run, batch_size=batch_size, log=click.echo)
+        click.echo(
+            f"{'🔎 Пробный прогон. ' if dry_run else ''}"
+            f"Перенесено: {stats['moved']}, дубликатов: {stats['deduplicated']} "
+            f"({stats['freed_bytes'] / 2**20:.1f} МБ освобождено), не найдено: {stats['missing']}"
+        )
+
+    @app.cli.command('attachments-backfill')
+    @click.option('--workers', default=8, show_default=True, help='Потоков чтения файлов.')
+    @click.option('--batch-size', default=200, show_default=True, help='Вложений на одну транзакцию.')
+    def attachments_backfill(workers, batch_size):
+        """Заполнить размер, SHA-256 и MIME-тип у старых вложений."""
+        stats = backfill_attachment_metadata(workers=workers, batch_size=batch_size, log=click.echo)
+        click.echo(f"Обновлено: {stats['updated']}, не найдено: {stats['missing']}")
+
+    @app.cli.command('storage-reconcile')
+    @click.option('--mode', type=click.Choice(RECONCILE_MODES), default='report', show_default=True,
+                  help='Что делать с файлами без вложения.')
+    @click.option('--min-age', default=60, show_default=True, help='Не трогать файлы моложе стольких минут.')
+    @click.option('--workers', default=8, show_default=True, help='Потоков обхода диска.')
+    @click.option('--batch-size', default=1000, show_default=True, help='Путей на один запрос к БД.')
+    @click.option('--list', 'list_items', is_flag=True, help='Печатать каждый найденный файл и вложение.')
+    def storage_reconcile(mode, min_age, workers, batch_size, list_items):
+        """Найти файлы без вложений и вложения без файлов в UPLOAD_FOLDER."""
+        stats = reconcile_uploads(
+            mode=mode, min_age_minutes=min_age, workers=workers, batch_size=batch_size,
+            log=click.echo if list_items else (lambda message: None)
+        )
+        action = {'report': 'найдено', 'quarantine': 'в карантине', 'delete': 'удалено'}[mode]
+        click.echo(
+            f"Файлов: {stats['files']} ({stats['bytes'] / 2**20:.1f} МБ). "
+            f"Сирот {action}: {stats['orphans']} ({stats['orphan_bytes'] / 2**20:.1f} МБ), "
+            f"свежих пропущено: {stats['recent']}. "
+            f"Вложений: {stats['attachments']}, без файла: {stats['missing']}"
+        )
+
+    @app.cli.command('attachments-process')
+    @click.option('--workers', default=4, show_default=True, help='Вложений обрабатывается одновременно.')
+    @click.option('--batch-size', default=500, show_default=True, help='Вложений на одну выборку.')
+    @click.option('--retry-failed', is_flag=True, help='Повторить этапы, завершившиеся ошибкой.')
+    @click.option('--stage', type=click.Choice(STAGES), help='Только вложения с незавершённым этим этапом.')
+    @click.option('--rerun', is_flag=True, help='Заново выполнить --stage и следующие этапы у всех вложений.')
+    def attachments_process(workers, batch_size, retry_failed, stage, rerun):
+        """Догнать фоновую обработку вложений (хэш, тип, текст, индекс)."""
+        if rerun:
+            if not stage:
+                raise click.UsageError('--rerun требует --stage')
+            click.echo(f'🔁 Этапов к повтору: {reset_stage(stage)}')
+        stats = process_backlog(workers=workers, batch_size=batch_size, stage=stage,
+                                retry_failed=retry_failed, log=click.echo)
+        click.echo(f"Обработано: {stats['processed']}, полностью: {stats['completed']}, с ошибкой: {stats['failed']}")
+
+    @app.cli.command('attachments-extract-text')
+    @click.option('--processes', default=2, show_default=True, type=click.IntRange(min=1), help='Процессов разбора файлов (и вложений одновременно).')
+    @click.option('--batch-size', default=200, show_default=True, help='Вложений на одну выборку.')
+    @click.option('--retry-failed', is_flag=True, help='Повторить вложения, на которых извлечение упало.')
+    @click.option('--rerun', is_flag=True, help='Извлечь текст заново у всех вложений, например после обновления pypdf.')
+    def attachments_extract_text(processes, batch_size, retry_failed, rerun):
+        """
+        Извлечь текст PDF/DOCX/XLSX уже загруженных вложений для поиска.
+        Прогресс хранится в этапах обработки: прерванный запуск продолжается с того же места.
+        """
+        app.config['TEXT_EXTRACT_PROCESSES'] = processes
+        if rerun:
+            click.echo(f"🔁 Этапов к повтору: {reset_stage('text')}")
+        try:
+            stats = process_backlog(workers=processes, batch_size=batch_size, stage='text',
+                                    retry_failed=retry_failed, log=click.echo)
+        finally:
+            pool = app.extensions.pop('text_extract_pool', None)
+            if pool is not None:
+                pool.shutdown()
+        click.echo(f"Обработано: {stats['processed']}, полностью: {stats['completed']}, с ошибкой: {stats['failed']}")
+
+    @app.cli.command('incoming-import')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--user', 'username', required=True, help='Логин пользователя, от имени которого регистрируются письма.')
+    @click.option('--workers', default=4, show_default=True, type=click.IntRange(min=1), help='Процессов проверки строк.')
+    @click.option('--batch-size', default=5000, show_default=True, help='Строк в одной пачке проверки и записи.')
+    @click.option('--skip-invalid', is_flag=True, help='Записать годные строки, даже если в других есть ошибки.')
+    @click.option('--errors', 'errors_path', type=click.Path(dir_okay=False), help='Сохранить ошибки по строкам в CSV.')
+    def incoming_import(path, username, workers, batch_size, skip_invalid, errors_path):
+        """Массовая регистрация входящих писем из CSV или XLSX (например, бумажного архива)."""
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.UsageError(f'Нет пользователя {username}')
+        try:
+            # В файл ошибок — все, на экран и в память без --errors — первые IMPORT_MAX_ERRORS
+            stats = import_incoming(path, user.id, workers=workers, batch_size=batch_size,
+                                    skip_invalid=skip_invalid, max_errors=sys.maxsize if errors_path else None,
+                                    log=click.echo)
+        except ImportFileError as e:
+            raise click.ClickException(str(e))
+
+        for line, message in stats['errors'][:20]:
+            click.echo(f'  строка {line}: {message}')
+        if stats['error_count'] > 20:
+            click.echo(f"  … и ещё {stats['error_count'] - 20}")
+        if errors_path and stats['errors']:
+            with open(errors_path, 'w', newline='', encoding='utf-8-sig') as f:
+                writer = csv.writer(f, delimiter=';')
+                writer.writerow(['Строка', 'Ошибка'])
+                writer.writerows(stats['errors'])
+        click.echo(f"Строк: {stats['rows']}, записано писем: {stats['imported']}, с ошибками: {stats['error_count']}")
+        if stats['error_count'] and not skip_invalid:
+            raise click.ClickException('Ничего не записано: исправьте ошибки или запустите с --skip-invalid')
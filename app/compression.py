@@ -0,0 +1,84 @@
+import gzip
+import os
+import shutil
+
+from app.uploads import CHUNK_SIZE
+
+
+COMPRESSION_CODECS = ('gzip', 'zstd')
+
+# Сигнатуры уже сжатых форматов: docx/xlsx/zip, rar, 7z, gzip, zstd, jpeg, png, gif
+COMPRESSED_MAGIC = (
+    b'PK\x03\x04', b'Rar!\x1a\x07', b'7z\xbc\xaf\x27\x1c', b'\x1f\x8b',
+    b'\x28\xb5\x2f\xfd', b'\xff\xd8\xff', b'\x89PNG', b'GIF8',
+)
+# Меньший выигрыш не стоит распаковки при каждом скачивании
+MIN_SAVINGS = 0.1
+
+
+def zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError('Для сжатия zstd нужен пакет zstandard (pip install zstandard)')
+    return zstandard
+
+
+def check_codec(codec):
+    """Проверка ATTACHMENT_COMPRESSION при старте: неизвестный кодек или нет zstandard — ошибка сразу."""
+    if codec and codec not in COMPRESSION_CODECS:
+        raise ValueError(f'Неизвестный кодек сжатия: {codec} (допустимы: {", ".join(COMPRESSION_CODECS)})')
+    if codec == 'zstd':
+        zstd()
+
+
+def is_compressed(path):
+    """Уже сжатый формат — по первым байтам файла, а не по расширению."""
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    return head.startswith(COMPRESSED_MAGIC)
+
+
+def compress_file(source, dest, codec):
+    with open(source, 'rb') as src, open(dest, 'wb') as out:
+        if codec == 'gzip':
+            with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6, mtime=0) as packed:
+                shutil.copyfileobj(src, packed, CHUNK_SIZE)
+        elif codec == 'zstd':
+            zstd().ZstdCompressor(level=3).copy_stream(src, out, read_size=CHUNK_SIZE)
+        else:
+            raise ValueError(f'Неизвестный кодек сжатия: {codec}')
+
+
+def maybe_compress(path, codec):
+    """
+    Сжимает файл на месте, если формат ещё не сжат и выигрыш не меньше MIN_SAVINGS.
+    Возвращает кодек или None, если файл остался как был.
+    """
+    if not codec or is_compressed(path):
+        return None
+
+    packed = f'{path}.{codec}'
+    try:
+        compress_file(path, packed, codec)
+        if os.path.getsize(packed) > os.path.getsize(path) * (1 - MIN_SAVINGS):
+            os.remove(packed)
+            return None
+    except Exception:
+        if os.path.exists(packed):
+            os.remove(packed)
+        raise
+
+    os.replace(packed, path)
+    return codec
+
+
+def open_stored(path, codec=None):
+    """Файл хранилища для чтения: сжатый распаковывается на лету, кусками."""
+    if codec is None:
+        return open(path, 'rb')
+    if codec == 'gzip':
+        return gzip.open(path, 'rb')
+    if codec == 'zstd':
+        return zstd().ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    raise ValueError(f'Неизвестный кодек сжатия: {codec}')
@@ -10,8 +10,23 @@ class Config:
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
-    # Максимальный размер загруженного файла (50 МБ)
-    MAX_CONTENT_LENGTH = 50 * 1024 * 1024
+    # Максимальный размер обычного запроса (формы, логин, фильтры)
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+    # Маршрутам с @accepts_uploads — больше: за раз можно загрузить несколько файлов
+    MAX_UPLOAD_REQUEST_SIZE = 500 * 1024 * 1024
+    # Лимит на один файл — проверяется прямо во время приёма
+    MAX_ATTACHMENT_SIZE = 50 * 1024 * 1024
+    MAX_FILES_PER_UPLOAD = 50
+    # ⚙️ Фоновая обработка вложений после загрузки: хэш, проверка типа, текст, поисковый индекс
+    ATTACHMENT_PIPELINE = True
+    PIPELINE_WORKERS = int(os.environ.get('PIPELINE_WORKERS', 2))  # потоков на процесс
+    # Разбор PDF/DOCX/XLSX грузит CPU — он идёт в отдельных процессах, 0 — прямо в потоке обработки
+    TEXT_EXTRACT_PROCESSES = int(os.environ.get('TEXT_EXTRACT_PROCESSES', 2))
+    TEXT_EXTRACT_TIMEOUT = 120  # секунд на один файл
+    # 🗜️ Сжатие новых вложений на диске: None (выкл.), 'gzip' или 'zstd' (нужен пакет zstandard).
+    # Уже сжатые форматы (docx, xlsx, rar, jpg…) определяются по сигнатуре и хранятся как есть
+    ATTACHMENT_COMPRESSION = os.environ.get('ATTACHMENT_COMPRESSION') or None
+    UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 4))  # потоков на доводку файлов одного запроса
     ALLOWED_EXTENSIONS = {
         'pdf': 'PDF документ',
         'doc': 'Word 97-2003',
@@ -21,4 +36,32 @@ class Config:
         'rar': 'RAR архив'
     }
     UPLOAD_FOLDER = os.path.join(basedir, '..', 'uploads')
-    
\ No newline at end of file
+
+    # 📥 Кто передаёт файл вложения: 'python' (send_file), 'x-accel' (nginx) или 'x-sendfile' (Apache).
+    # Для nginx: location /protected-uploads/ { internal; alias <UPLOAD_FOLDER>/; }
+    ATTACHMENT_DOWNLOAD_MODE = os.environ.get('ATTACHMENT_DOWNLOAD_MODE', 'python')
+    ATTACHMENT_ACCEL_PREFIX = '/protected-uploads/'
+    # Проверять наличие файла перед отдачей (лишний stat на каждое скачивание — на NFS заметно)
+    ATTACHMENT_CHECK_EXISTS = os.environ.get('ATTACHMENT_CHECK_EXISTS', '').lower() in ('1', 'true', 'yes')
+    
+    # 📦 Фоновые выгрузки
+    EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', 2))  # потоков на процесс
+    EXPORT_MAX_ACTIVE_JOBS = 4  # в очереди и в работе, на все процессы
+    EXPORT_MAX_JOBS_PER_USER = 2
+    EXPORT_TTL_HOURS = 24  # сколько хранится готовый файл
+    EXPORT_JOB_TIMEOUT_MINUTES = 60  # дольше — считаем зависшей
+    # Как часто каждый процесс сам удаляет просроченные выгрузки; 0 — только flask exports-cleanup
+    EXPORT_CLEANUP_MINUTES = int(os.environ.get('EXPORT_CLEANUP_MINUTES', 30))
+    # XLSX по ссылке собирается прямо в запросе — больше строк только фоновой выгрузкой
+    EXPORT_XLSX_MAX_ROWS = 50000
+
+    # 📥 Импорт входящих из файла: файл больше этого — в фоне, а не в запросе
+    IMPORT_SYNC_MAX_BYTES = 1024 * 1024
+    IMPORT_MAX_ERRORS = 1000  # сколько ошибок по строкам хранить и показывать
+
+    # 🗄️ Кэш готовых выгрузок (UPLOAD_FOLDER/export_cache)
+    EXPORT_CACHE_MAX_BYTES = 500 * 1024 * 1024
+    EXPORT_CACHE_MAX_AGE_HOURS = 24
+
+    # 🔢 Превью следующих номеров в админ-панели — кэш в процессе, секунд
+    NUMBER_PREVIEW_TTL = 30
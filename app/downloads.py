@@ -0,0 +1,143 @@
+import os
+import unicodedata
+from urllib.parse import quote
+
+from flask import Response, current_app, request, send_file
+from werkzeug.http import is_resource_modified
+
+from app.compression import open_stored
+from app.uploads import CHUNK_SIZE
+
+
+DOWNLOAD_MODES = ('python', 'x-accel', 'x-sendfile')
+
+# Content-Type для расширений из ALLOWED_EXTENSIONS
+ATTACHMENT_MIMETYPES = {
+    'pdf': 'application/pdf',
+    'doc': 'application/msword',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'xls': 'application/vnd.ms-excel',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'rar': 'application/vnd.rar',
+}
+
+
+def attachment_disposition(download_name):
+    """Content-Disposition с кириллическим именем файла (RFC 5987), как у send_file."""
+    try:
+        download_name.encode('ascii')
+        return {'filename': download_name}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        return {'filename': simple, 'filename*': f"UTF-8''{quote(download_name, safe='!#$&+^`|~')}"}
+
+
+def accel_redirect_uri(path):
+    """Внутренний URI nginx для файла из UPLOAD_FOLDER (location ... { internal; alias ...; })."""
+    root = os.path.realpath(current_app.config['UPLOAD_FOLDER'])
+    relpath = os.path.relpath(os.path.realpath(path), root)
+    if relpath.startswith(os.pardir):
+        raise ValueError(f'Файл вне UPLOAD_FOLDER: {path}')
+    prefix = current_app.config['ATTACHMENT_ACCEL_PREFIX'].rstrip('/')
+    return f"{prefix}/{quote(relpath.replace(os.sep, '/'))}"
+
+
+def attachment_mimetype(filename):
+    """Тип по расширению; всё, что не из ALLOWED_EXTENSIONS, — просто поток байтов."""
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if ext not in current_app.config['ALLOWED_EXTENSIONS']:
+        return 'application/octet-stream'
+    return ATTACHMENT_MIMETYPES.get(ext, 'application/octet-stream')
+
+
+def not_modified(etag, last_modified):
+    """Ответ 304, если у клиента актуальная копия (If-None-Match / If-Modified-Since)."""
+    if etag and not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def attachment_headers(response, attachment, as_attachment):
+    disposition = 'attachment' if as_attachment else 'inline'
+    response.headers.set('Content-Disposition', disposition, **attachment_disposition(attachment.filename))
+    response.cache_control.private = True
+    return response
+
+
+def send_compressed(attachment, as_attachment, mimetype):
+    """
+    Сжатый на диске файл распаковывается на лету, кусками. Веб-сервер его не отдаст,
+    поэтому так — в любом режиме скачивания. Валидаторы те же, что у send_file.
+    """
+    response = not_modified(attachment.content_hash, attachment.uploaded_at)
+    if response is not None:
+        return response
+
+    source = open_stored(attachment.filepath, attachment.codec)
+
+    def chunks():
+        with source:
+            while chunk := source.read(CHUNK_SIZE):
+                yield chunk
+
+    response = Response(chunks(), mimetype=mimetype, direct_passthrough=True)
+    response.content_length = attachment.size_bytes
+    # ⚠️ Range не поддерживается: смещение в распакованном потоке не найти без чтения
+    # всего, что перед ним, — прерванное скачивание сжатого файла начинается заново
+    response.accept_ranges = 'none'
+    if attachment.content_hash:
+        response.set_etag(attachment.content_hash)
+    response.last_modified = attachment.uploaded_at
+    return attachment_headers(response, attachment, as_attachment)
+
+
+def send_attachment(attachment, as_attachment=True):
+    """
+    Отдаёт файл вложения. Права проверяет вызывающий маршрут, а передачу байтов
+    в режимах x-accel / x-sendfile берёт на себя веб-сервер (nginx / Apache),
+    не занимая Python-воркер на всё время скачивания.
+
+    В режиме python ETag — SHA-256 содержимого (строгий: файл по хэшу не меняется),
+    поэтому повторный просмотр получает 304, а прерванное скачивание докачивается по Range.
+    В x-accel / x-sendfile ETag, Last-Modified и 304 — целиком за веб-сервером.
+    Сжатые на диске файлы отдаются без Range (см. send_compressed).
+    Тип и хэш берутся из БД; пропавший файл — FileNotFoundError.
+    """
+    mode = current_app.config['ATTACHMENT_DOWNLOAD_MODE']
+    mimetype = attachment.mime_type or attachment_mimetype(attachment.filename)
+
+    if attachment.codec:
+        return send_compressed(attachment, as_attachment, mimetype)
+
+    if mode == 'python':
+        # Range, If-None-Match и If-Modified-Since разбирает send_file (conditional=True)
+        response = send_file(
+            attachment.filepath,
+            as_attachment=as_attachment,
+            download_name=attachment.filename,
+            mimetype=mimetype,
+            etag=attachment.content_hash or True,
+            last_modified=attachment.uploaded_at,
+            conditional=True
+        )
+        response.cache_control.private = True
+        return response
+
+    # Веб-сервер сам ответит 404 на пропавший файл; заранее проверяем только по настройке
+    if current_app.config['ATTACHMENT_CHECK_EXISTS'] and not os.path.exists(attachment.filepath):
+        raise FileNotFoundError(attachment.filepath)
+
+    # Валидаторы и 304 здесь не ставим: nginx подменяет ETag и Last-Modified своими
+    # (по mtime и размеру файла), и наш 304 разошёлся бы с его 200. Range, ETag и
+    # If-None-Match / If-Modified-Since обслуживает веб-сервер — по одному признаку
+    response = attachment_headers(Response(mimetype=mimetype), attachment, as_attachment)
+    response.cache_control.no_cache = True
+    if mode == 'x-accel':
+        response.headers['X-Accel-Redirect'] = accel_redirect_uri(attachment.filepath)
+    elif mode == 'x-sendfile':
+        response.headers['X-Sendfile'] = os.path.realpath(attachment.filepath)
+    else:
+        raise ValueError(f'Неизвестный ATTACHMENT_DOWNLOAD_MODE: {mode}')
+    return response
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+from flask import current_app
+
+from app.models import get_table_version
+
+
+def cache_folder():
+    folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'export_cache')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def cache_path(table, kind, export_format, filters):
+    """
+    Путь файла выгрузки в кэше. Имя — <таблица>.<версия>.<хэш>.<формат>:
+    хэш от вида выгрузки и непустых фильтров, версия — счётчик изменений таблицы.
+    После любой записи в таблицу версия меняется, и старые файлы больше не находятся.
+    """
+    filters = {key: value for key, value in filters.items() if value}
+    payload = json.dumps([kind, export_format, filters], ensure_ascii=False, sort_keys=True)
+    digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+    return os.path.join(cache_folder(), f'{table}.{get_table_version(table)}.{digest}.{export_format}')
+
+
+def open_cached(path):
+    """Открытый файл из кэша или None. Открываем сразу — его может удалить очистка."""
+    try:
+        fileobj = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    os.utime(path)  # mtime = время последнего обращения, по нему вытесняем
+    return fileobj
+
+
+def part_path(path):
+    """Временное имя: файл попадает в кэш только целиком, через os.replace."""
+    return f'{path}.{uuid.uuid4().hex}.part'
+
+
+def tee_to_cache(chunks, path):
+    """
+    Отдаёт куски потоковой выгрузки дальше и параллельно пишет их в кэш.
+    Если клиент оборвал загрузку, недописанный файл удаляется.
+    """
+    part = part_path(path)
+    complete = False
+    f = open(part, 'wb')
+    try:
+        for chunk in chunks:
+            f.write(chunk.encode('utf-8'))
+            yield chunk
+        complete = True
+    finally:
+        f.close()
+        if complete:
+            commit_to_cache(part, path)
+        else:
+            remove_cached(part)
+
+
+def commit_to_cache(part, path):
+    os.replace(part, path)
+    prune_cache()
+
+
+def copy_to_cache(src, path):
+    """Кладёт готовый файл (например, фоновой выгрузки) в кэш жёсткой ссылкой или копией."""
+    part = part_path(path)
+    try:
+        os.link(src, part)
+    except OSError:
+        shutil.copyfile(src, part)
+    commit_to_cache(part, path)
+
+
+def prune_cache():
+    """
+    Очистка кэша: удаляет файлы устаревших версий таблиц и старше EXPORT_CACHE_MAX_AGE_HOURS,
+    затем самые давно использованные — пока размер не уложится в EXPORT_CACHE_MAX_BYTES.
+    """
+    folder = cache_folder()
+    now = time.time()
+    max_age = current_app.config['EXPORT_CACHE_MAX_AGE_HOURS'] * 3600
+    versions = {}
+
+    entries = []
+    for entry in os.scandir(folder):
+        if not entry.is_file():
+            continue
+        stat = entry.stat()
+        name_parts = entry.name.split('.')
+        stale = now - stat.st_mtime > max_age
+
+        if not stale and not entry.name.endswith('.part'):
+            table, version = name_parts[0], name_parts[1]
+            if table not in versions:
+                versions[table] = str(get_table_version(table))
+            stale = version != versions[table]
+
+        if stale:
+            remove_cached(entry.path)
+        elif not entry.name.endswith('.part'):
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= current_app.config['EXPORT_CACHE_MAX_BYTES']:
+            break
+        remove_cached(path)
+        total -= size
+
+
+def remove_cached(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
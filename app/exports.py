@@ -0,0 +1,265 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from itertools import chain, islice
+
+from flask import Response, current_app, flash, redirect, request, send_file, stream_with_context, url_for
+
+from app import db
+from app.downloads import attachment_disposition
+from app.export_cache import cache_path, commit_to_cache, open_cached, part_path, remove_cached, tee_to_cache
+from app.models import AttachmentText, LetterIncoming, LetterOutgoing, User, get_table_version
+from app.queries import filter_incoming, filter_outgoing
+
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+EXPORT_MIMETYPES = {
+    'xlsx': XLSX_MIMETYPE,
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+# (заголовок, колонка) — что и в каком порядке попадает в выгрузку
+INCOMING_COLUMNS = (
+    ('Номер', LetterIncoming.number),
+    ('Организация', LetterIncoming.organization),
+    ('Тема', LetterIncoming.subject),
+    ('Направлено', LetterIncoming.forwarded_to),
+    ('Дата получения', LetterIncoming.date_received),
+)
+
+OUTGOING_COLUMNS = (
+    ('Номер', LetterOutgoing.number),
+    ('Тема', LetterOutgoing.subject),
+    ('Получатель', LetterOutgoing.recipient),
+    ('Дата', LetterOutgoing.date_created),
+)
+
+# Вид выгрузки -> (колонки, название листа, начало имени файла)
+EXPORT_KINDS = {
+    'incoming': (INCOMING_COLUMNS, 'Входящие письма', 'Входящие'),
+    'outgoing': (OUTGOING_COLUMNS, 'Исходящие', 'Исходящие'),
+    'my_letters': (OUTGOING_COLUMNS, 'Мои письма', 'Мои_письма'),
+}
+
+# Больше строк не помещается на лист Excel (1 048 576 вместе с заголовком)
+XLSX_SHEET_MAX_ROWS = 1048575
+BATCH_SIZE = 1000
+WIDTH_SAMPLE_ROWS = 500
+# Сколько строк копить перед отправкой очередного куска ответа
+FLUSH_ROWS = 200
+
+
+def export_query(kind, args, user_id=None):
+    """
+    Запрос выгрузки с теми же фильтрами, что и у списка.
+    Возвращает (query, search_params); my_letters — только письма user_id,
+    поиск по тексту вложений — только во вложениях, доступных user_id.
+    """
+    user = db.session.get(User, user_id) if user_id and args.get('content') else None
+    if kind == 'incoming':
+        query, search_params = filter_incoming(LetterIncoming.query, args, user)
+        query = query.order_by(LetterIncoming.year.desc(), LetterIncoming.sequence_num.desc())
+        return query, search_params
+
+    query = LetterOutgoing.query
+    if kind == 'my_letters':
+        query = query.filter_by(user_id=user_id)
+    query, search_params = filter_outgoing(query, args, user)
+    query = query.order_by(LetterOutgoing.year.desc(), LetterOutgoing.sequence_num.desc())
+    return query, search_params
+
+
+def export_cache_path(kind, export_format, search_params, user_id=None):
+    """
+    Путь выгрузки в кэше; зависит от таблицы, из которой она строится.
+    Результат поиска по тексту вложений зависит ещё от версии attachment_texts
+    и от того, чьи вложения доступны, — такие выгрузки кэшируются на пользователя.
+    """
+    columns = EXPORT_KINDS[kind][0]
+    table = columns[0][1].class_.__tablename__
+    filters = dict(search_params)
+    if kind == 'my_letters' or filters.get('content'):
+        filters['user_id'] = user_id
+    if filters.get('content'):
+        filters['attachment_texts'] = get_table_version(AttachmentText.__tablename__)
+    return cache_path(table, kind, export_format, filters)
+
+
+def export_rows(query, columns, batch_size=BATCH_SIZE):
+    """
+    Плоские кортежи значений вместо ORM-объектов, пачками через серверный курсор.
+    Даты сразу приводятся к строке YYYY-MM-DD, None — к пустой строке.
+    """
+    query = (
+        query.with_entities(*[column for _, column in columns])
+        .execution_options(stream_results=True, yield_per=batch_size)
+    )
+    for row in query:
+        yield tuple(
+            value.strftime('%Y-%m-%d') if hasattr(value, 'strftime') else ('' if value is None else value)
+            for value in row
+        )
+
+
+def column_widths(headers, sample):
+    """Ширина колонок по заголовкам и выборке первых строк (+4, как раньше)."""
+    widths = [len(str(header)) for header in headers]
+    for row in sample:
+        for i, value in enumerate(row):
+            widths[i] = max(widths[i], len(str(value)))
+    return [width + 4 for width in widths]
+
+
+def write_xlsx(fileobj, headers, rows, sheet_title):
+    """
+    Пишет книгу в режиме write_only: строки уходят на диск по мере поступления,
+    в памяти держится только выборка для оценки ширины колонок.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Font
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_title)
+
+    rows = iter(rows)
+    sample = list(islice(rows, WIDTH_SAMPLE_ROWS))
+
+    # 📏 Ширину в write_only можно задать только до первой строки
+    for i, width in enumerate(column_widths(headers, sample), start=1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+
+    # 💎 Формат заголовков
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center')
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    for row in chain(sample, rows):
+        ws.append(row)
+
+    wb.save(fileobj)
+
+
+def file_response(fileobj, export_format, download_name):
+    """Отдаёт готовый файл выгрузки кусками через send_file."""
+    response = send_file(
+        fileobj,
+        download_name=download_name,
+        as_attachment=True,
+        mimetype=EXPORT_MIMETYPES[export_format]
+    )
+    response.content_length = os.fstat(fileobj.fileno()).st_size
+    return response
+
+
+def streaming_response(chunks, mimetype, download_name):
+    """Генератор отдаётся клиенту сразу — первый байт уходит до конца выборки."""
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers.set('Content-Disposition', 'attachment', **attachment_disposition(download_name))
+    return response
+
+
+def generate_csv(headers, rows):
+    """
+    CSV для Excel: UTF-8 с BOM и разделитель «;» — так файл без мастера импорта
+    открывается в русской локали Excel.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+
+    buffer.write('\ufeff')
+    writer.writerow(headers)
+    yield buffer.getvalue()
+
+    for batch in batched(rows, FLUSH_ROWS):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue()
+
+
+def generate_ndjson(keys, rows):
+    """Одна JSON-запись на строку, ключи — имена колонок модели."""
+    for batch in batched(rows, FLUSH_ROWS):
+        yield ''.join(json.dumps(dict(zip(keys, row)), ensure_ascii=False) + '\n' for row in batch)
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_export(fileobj, export_format, columns, rows, sheet_title):
+    """Пишет строки выгрузки в бинарный файл в нужном формате."""
+    headers = [header for header, _ in columns]
+    if export_format == 'csv':
+        chunks = generate_csv(headers, rows)
+    elif export_format == 'ndjson':
+        chunks = generate_ndjson([column.key for _, column in columns], rows)
+    else:
+        write_xlsx(fileobj, headers, rows, sheet_title)
+        return
+
+    for chunk in chunks:
+        fileobj.write(chunk.encode('utf-8'))
+
+
+def export_response(kind, export_format, args, user_id=None):
+    """
+    Выгрузка в нужном формате: xlsx (по умолчанию), csv или ndjson.
+    CSV и NDJSON стримятся по мере выборки. XLSX — zip-архив, его нельзя отдавать
+    недописанным: книга целиком пишется в файл кэша и только потом уходит клиенту,
+    поэтому по ссылке — не больше EXPORT_XLSX_MAX_ROWS строк, остальное фоновой выгрузкой.
+    Повторная выгрузка с теми же фильтрами отдаётся из кэша, пока таблица не менялась.
+    """
+    if export_format not in EXPORT_MIMETYPES:
+        export_format = 'xlsx'
+
+    columns, sheet_title, basename = EXPORT_KINDS[kind]
+    # Путь (с версией таблицы) берём до чтения данных: запись во время выгрузки
+    # сменит версию, и этот файл просто не будет найден в следующий раз
+    query, search_params = export_query(kind, args, user_id)
+    path = export_cache_path(kind, export_format, search_params, user_id)
+    download_name = f"{basename}_{datetime.utcnow().strftime('%Y-%m-%d')}.{export_format}"
+
+    cached = open_cached(path)
+    if cached is not None:
+        return file_response(cached, export_format, download_name)
+
+    if export_format == 'xlsx':
+        max_rows = current_app.config['EXPORT_XLSX_MAX_ROWS']
+        total = query.order_by(None).count()
+        if total > max_rows:
+            flash(f'В выгрузке {total} строк — в Excel сразу можно не больше {max_rows}. '
+                  'Запустите фоновую выгрузку или выберите CSV.', 'warning')
+            return redirect(request.referrer or url_for('exports.list_exports'))
+
+        # Книга собирается сразу в файл кэша, клиенту отдаётся он же
+        part = part_path(path)
+        try:
+            with open(part, 'wb') as f:
+                write_xlsx(f, [header for header, _ in columns], export_rows(query, columns), sheet_title)
+            output = open(part, 'rb')
+        except Exception:
+            remove_cached(part)
+            raise
+        commit_to_cache(part, path)
+        return file_response(output, export_format, download_name)
+
+    if export_format == 'csv':
+        chunks = generate_csv([header for header, _ in columns], export_rows(query, columns))
+    else:
+        chunks = generate_ndjson([column.key for _, column in columns], export_rows(query, columns))
+    return streaming_response(tee_to_cache(chunks, path), EXPORT_MIMETYPES[export_format], download_name)
@@ -0,0 +1,349 @@
+import csv
+import io
+import json
+import multiprocessing
+import os
+import pickle
+import tempfile
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+
+from app import db
+from app.exports import batched
+from app.models import LETTER_REGISTERS, ImportJob, LetterIncoming, allocate_numbers, bump_table_version
+from app.numbering import invalidate_number_preview
+from app.uploads import staging_folder, store_upload
+
+
+IMPORT_FORMATS = ('csv', 'xlsx')
+
+# (поле, заголовки колонки, обязательное) — заголовки как в выгрузке входящих
+IMPORT_COLUMNS = (
+    ('organization', ('Организация', 'organization'), True),
+    ('subject', ('Тема', 'subject'), True),
+    ('forwarded_to', ('Направлено', 'forwarded_to'), False),
+    ('date_received', ('Дата получения', 'Дата', 'date_received'), True),
+)
+FIELD_LENGTHS = {
+    field: getattr(LetterIncoming, field).type.length
+    for field, _, _ in IMPORT_COLUMNS if field != 'date_received'
+}
+
+# Колонки letter_incoming в порядке записей, которые уходят в COPY
+COPY_COLUMNS = ('user_id', 'number', 'organization', 'subject', 'forwarded_to', 'date_received', 'sequence_num', 'year')
+
+
+class ImportFileError(Exception):
+    """Файл целиком не годится для импорта: неизвестный формат, нет нужных колонок."""
+
+
+def import_format(filename):
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if ext not in IMPORT_FORMATS:
+        raise ImportFileError(f'Поддерживаются только {", ".join(IMPORT_FORMATS)}, а не .{ext}')
+    return ext
+
+
+def read_csv(path):
+    """Строки CSV потоково. Разделитель — «;» (как в нашей выгрузке) или «,»."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        header = f.readline()
+        f.seek(0)
+        yield from csv.reader(f, delimiter=';' if header.count(';') >= header.count(',') else ',')
+
+
+def read_xlsx(path):
+    """Строки первого листа книги в режиме read_only — без загрузки всего листа в память."""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from wb.worksheets[0].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def header_columns(header):
+    """{поле: номер колонки} по строке заголовков."""
+    names = {str(name).strip().lower(): i for i, name in enumerate(header) if name is not None}
+    columns, missing = {}, []
+    for field, titles, required in IMPORT_COLUMNS:
+        index = next((names[title.lower()] for title in titles if title.lower() in names), None)
+        if index is not None:
+            columns[field] = index
+        elif required:
+            missing.append(titles[0])
+    if missing:
+        raise ImportFileError(f'В файле нет колонок: {", ".join(missing)}')
+    return columns
+
+
+def parse_date(value):
+    """
+    Дата из ячейки: datetime/date из Excel или строка 2025-03-01 (с временем или без),
+    01.03.2025, 01.03.25. Без strptime — на сотнях тысяч строк он заметно медленнее.
+    """
+    if isinstance(value, datetime):
+        return value
+    if hasattr(value, 'year'):  # date из Excel
+        return datetime(value.year, value.month, value.day)
+    text = str(value).strip()
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        pass
+    parts = text.split('.')
+    if len(parts) == 3 and all(part.isdigit() for part in parts) and len(parts[2]) in (2, 4):
+        day, month, year = (int(part) for part in parts)
+        try:
+            return datetime(year + 2000 if year < 100 else year, month, day)
+        except ValueError:
+            pass
+    raise ValueError(f'Не разобрать дату «{value}»')
+
+
+def validate_chunk(chunk, columns):
+    """
+    Проверяет пачку строк [(номер строки, значения)]. Выполняется в процессе пула,
+    поэтому работает только с переданными данными, без БД.
+    Возвращает (годные [(строка, организация, тема, направлено, дата)], ошибки [(строка, текст)]).
+    """
+    valid, errors = [], []
+    for line, values in chunk:
+        record, problems = {}, []
+        for field, titles, required in IMPORT_COLUMNS:
+            index = columns.get(field)
+            value = values[index] if index is not None and index < len(values) else None
+            if isinstance(value, str):
+                value = value.strip() or None
+            if value is None:
+                if required:
+                    problems.append(f'не заполнено «{titles[0]}»')
+                record[field] = None
+                continue
+            if field == 'date_received':
+                try:
+                    value = parse_date(value)
+                except ValueError as e:
+                    problems.append(str(e))
+            else:
+                value = str(value)
+                if len(value) > FIELD_LENGTHS[field]:
+                    problems.append(f'«{titles[0]}» длиннее {FIELD_LENGTHS[field]} символов')
+            record[field] = value
+        if problems:
+            errors.append((line, '; '.join(problems)))
+        else:
+            valid.append((line, record['organization'], record['subject'],
+                          record['forwarded_to'], record['date_received']))
+    return valid, errors
+
+
+def validated_chunks(rows, columns, workers=1, chunk_size=5000):
+    """
+    Проверка пачек строк; при workers > 1 — в пуле процессов.
+    Порядок пачек сохраняется, а вперёд читается не больше workers * 2 пачек.
+    Процессов не больше, чем ядер: на одном ядре пул только добавляет пересылку строк.
+    """
+    chunks = batched(rows, chunk_size)
+    workers = min(workers, os.cpu_count() or 1)
+    if workers <= 1:
+        for chunk in chunks:
+            yield validate_chunk(chunk, columns)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(pool.submit(validate_chunk, chunk, columns))
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def numbered_records(user_id, rows, next_numbers):
+    """Записи для COPY с номерами из заранее выделенных диапазонов; next_numbers сдвигается."""
+    prefix = LETTER_REGISTERS['incoming'][1]
+    records = []
+    for _, organization, subject, forwarded_to, date_received in rows:
+        year = date_received.year % 100
+        sequence_num = next_numbers[year]
+        next_numbers[year] += 1
+        records.append((user_id, f'{prefix}-{sequence_num}/{year}', organization, subject,
+                        forwarded_to, date_received, sequence_num, year))
+    return records
+
+
+def reserve_numbers(counts):
+    """
+    Номера на весь импорт — короткой отдельной транзакцией: строки счётчиков
+    заблокированы только на время выделения, а не на всю запись писем.
+    Возвращает {год: первый номер}.
+    """
+    connection = db.session.connection()
+    try:
+        first = {year: allocate_numbers(connection, 'incoming', year, count) for year, count in sorted(counts.items())}
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_number_preview()
+    return first
+
+
+def copy_records(connection, records):
+    """Запись пачки писем: COPY в Postgres, executemany в остальных БД."""
+    if connection.dialect.name != 'postgresql':
+        connection.execute(
+            LetterIncoming.__table__.insert(),
+            [dict(zip(COPY_COLUMNS, record)) for record in records]
+        )
+        return
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(records)  # None -> пустое поле -> NULL
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY letter_incoming ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+
+def import_incoming(path, user_id, filename=None, workers=1, batch_size=5000, skip_invalid=False,
+                    max_errors=None, log=None):
+    """
+    Массовая регистрация входящих писем из CSV/XLSX.
+    Сначала строки проверяются пачками (параллельно при workers > 1), годные
+    откладываются во временный файл и считаются по годам даты получения.
+    Затем номера выделяются сразу на весь файл (reserve_numbers), а письма
+    записываются одной транзакцией — уже без блокировки счётчика. Сорвалась
+    запись — выделенные номера пропадают, в нумерации будет пропуск.
+    Если есть ошибки и не задан skip_invalid, не записывается ничего и номера не выделяются.
+    Ошибок в ответе не больше max_errors (по умолчанию IMPORT_MAX_ERRORS), всего — error_count.
+    Возвращает {'rows', 'imported', 'errors': [(строка, текст)], 'error_count'}.
+    """
+    if max_errors is None:
+        max_errors = current_app.config['IMPORT_MAX_ERRORS']
+    fmt = import_format(filename or path)
+    rows = read_csv(path) if fmt == 'csv' else read_xlsx(path)
+    stats = {'rows': 0, 'imported': 0, 'errors': [], 'error_count': 0}
+
+    header = next(rows, None)
+    if header is None:
+        raise ImportFileError('Файл пустой')
+    columns = header_columns(header)
+    numbered = (
+        (line, values) for line, values in enumerate(rows, start=2)
+        if any(value not in (None, '') for value in values)
+    )
+
+    counts = Counter()
+    with tempfile.TemporaryFile(dir=staging_folder()) as spool:
+        for valid, errors in validated_chunks(numbered, columns, workers, batch_size):
+            stats['rows'] += len(valid) + len(errors)
+            stats['error_count'] += len(errors)
+            stats['errors'].extend(errors[:max(max_errors - len(stats['errors']), 0)])
+            if valid and (skip_invalid or not stats['error_count']):
+                counts.update(row[4].year % 100 for row in valid)
+                pickle.dump(valid, spool)
+            if log:
+                log(f"🔎 Проверено строк: {stats['rows']}, ошибок: {stats['error_count']}")
+
+        if not counts or (stats['error_count'] and not skip_invalid):
+            return stats
+
+        next_numbers = reserve_numbers(counts)
+        spool.seek(0)
+        stats['imported'] = write_spooled(spool, user_id, next_numbers, log)
+    return stats
+
+
+def write_spooled(spool, user_id, next_numbers, log=None):
+    """Записывает отложенные пачки одной транзакцией. Возвращает число писем."""
+    connection = db.session.connection()
+    imported = 0
+    try:
+        while True:
+            try:
+                valid = pickle.load(spool)
+            except EOFError:
+                break
+            copy_records(connection, numbered_records(user_id, valid, next_numbers))
+            imported += len(valid)
+            if log:
+                log(f'📥 Записано писем: {imported}')
+
+        # Запись мимо ORM: версию таблицы для кэша выгрузок меняем сами
+        bump_table_version(connection, LetterIncoming.__tablename__)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return imported
+
+
+def save_import_upload(file):
+    """Кладёт загруженный файл импорта в черновики UPLOAD_FOLDER и возвращает путь."""
+    path = os.path.join(staging_folder(), f'import_{uuid.uuid4().hex}.{import_format(file.filename)}')
+    store_upload(file, path)
+    return path
+
+
+def get_import_executor(app):
+    """Фоновые импорты — в одном потоке на процесс, по очереди."""
+    executor = app.extensions.get('import_executor')
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='import')
+        app.extensions['import_executor'] = executor
+    return executor
+
+
+def start_import(path, filename, user_id, skip_invalid=False):
+    """Ставит импорт уже сохранённого файла в фон; файл удалит задание."""
+    job = ImportJob(user_id=user_id, filename=filename, file_path=path, skip_invalid=skip_invalid)
+    db.session.add(job)
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    get_import_executor(app).submit(run_import_job, app, job.id)
+    current_app.logger.info(f"📥 Импорт #{job.id} ({filename}) поставлен в очередь")
+    return job
+
+
+def run_import_job(app, job_id):
+    """Выполняет импорт в потоке пула, со своим контекстом приложения и сессией."""
+    with app.app_context():
+        job = db.session.get(ImportJob, job_id)
+        if job is None or job.status != 'pending':
+            return
+        job.status = 'running'
+        job.started_at = datetime.utcnow()
+        db.session.commit()
+
+        try:
+            stats = import_incoming(job.file_path, job.user_id, filename=job.filename,
+                                    skip_invalid=job.skip_invalid)
+        except Exception as e:
+            db.session.rollback()
+            if not isinstance(e, ImportFileError):
+                app.logger.exception(f"❌ Импорт #{job_id} завершился ошибкой")
+            job.status = 'failed'
+            job.error = str(e)
+        else:
+            job.status = 'done'
+            job.rows = stats['rows']
+            job.imported = stats['imported']
+            job.error_count = stats['error_count']
+            job.errors = json.dumps(stats['errors'], ensure_ascii=False)
+            app.logger.info(f"✅ Импорт #{job_id}: строк {job.rows}, записано {job.imported}, ошибок {job.error_count}")
+        finally:
+            if job.file_path and os.path.exists(job.file_path):
+                os.remove(job.file_path)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
@@ -0,0 +1,231 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, func, or_, text
+
+from app import db
+from app.export_cache import copy_to_cache, open_cached
+from app.exports import (
+    EXPORT_KINDS, XLSX_SHEET_MAX_ROWS, export_cache_path, export_query, export_rows, write_export,
+)
+from app.models import ExportJob
+
+
+ACTIVE_STATUSES = ('pending', 'running')
+# Как часто (в строках) записывать прогресс в БД
+PROGRESS_EVERY = 1000
+# Ключ advisory-блокировки, под которой проверяются лимиты выгрузок
+EXPORT_LIMITS_LOCK = 7310021
+
+
+def get_executor(app):
+    """
+    Пул потоков выгрузок, один на процесс. Его размер (EXPORT_WORKERS) ограничивает,
+    сколько выгрузок реально работает одновременно, остальные ждут в очереди.
+    """
+    executor = app.extensions.get('export_executor')
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=app.config['EXPORT_WORKERS'], thread_name_prefix='export')
+        app.extensions['export_executor'] = executor
+    return executor
+
+
+def exports_folder():
+    folder = os.path.join(current_app.config['UPLOAD_FOLDER'], 'exports')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def start_export(kind, export_format, args, user):
+    """
+    Создаёт задание выгрузки и ставит его в пул.
+    Возвращает None, если превышен общий лимит или лимит пользователя.
+    """
+    cleanup_exports()
+
+    lock_export_limits()
+    active = ExportJob.query.filter(ExportJob.status.in_(ACTIVE_STATUSES))
+    if (active.count() >= current_app.config['EXPORT_MAX_ACTIVE_JOBS'] or
+            active.filter_by(user_id=user.id).count() >= current_app.config['EXPORT_MAX_JOBS_PER_USER']):
+        db.session.rollback()
+        return None
+
+    # Сохраняем уже нормализованные фильтры — ровно те, что применит запрос
+    _, search_params = export_query(kind, args, user.id)
+
+    job = ExportJob(
+        user_id=user.id,
+        kind=kind,
+        export_format=export_format,
+        params=json.dumps(search_params, ensure_ascii=False),
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    get_executor(app).submit(run_export_job, app, job.id)
+    current_app.logger.info(f"📦 Выгрузка #{job.id} ({kind}, {export_format}) поставлена в очередь")
+    return job
+
+
+def lock_export_limits():
+    """
+    Блокировка до конца транзакции: параллельные запросы (из любых процессов) считают
+    активные задания по очереди и не превысят ни общий лимит, ни лимит пользователя.
+    На SQLite advisory-блокировок нет — там запись и так идёт по одной.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': EXPORT_LIMITS_LOCK})
+
+
+def run_export_job(app, job_id):
+    """Выполняет задание в потоке пула, со своим контекстом приложения и сессией."""
+    with app.app_context():
+        job = db.session.get(ExportJob, job_id)
+        if job is None or job.status != 'pending':
+            return
+
+        columns, sheet_title, basename = EXPORT_KINDS[job.kind]
+        part_path = None
+        try:
+            query, search_params = export_query(job.kind, json.loads(job.params or '{}'), job.user_id)
+            cache_path = export_cache_path(job.kind, job.export_format, search_params, job.user_id)
+
+            job.status = 'running'
+            job.started_at = job.heartbeat_at = datetime.utcnow()
+            job.total_rows = query.order_by(None).count()
+            job.file_path = os.path.join(exports_folder(), f'{job.id}_{uuid.uuid4().hex}.{job.export_format}')
+            job.download_name = f"{basename}_{job.started_at.strftime('%Y-%m-%d')}.{job.export_format}"
+            db.session.commit()
+            if job.export_format == 'xlsx' and job.total_rows > XLSX_SHEET_MAX_ROWS:
+                raise ValueError(f'{job.total_rows} строк не помещаются на лист Excel — выберите CSV')
+
+            # Пишем во временный файл: под именем file_path лежит только готовая выгрузка
+            part_path = job.file_path + '.part'
+            cached = open_cached(cache_path)
+            if cached is not None:
+                with cached, open(part_path, 'wb') as f:
+                    shutil.copyfileobj(cached, f)
+            else:
+                rows = track_progress(export_rows(query, columns), job_id)
+                with open(part_path, 'wb') as f:
+                    write_export(f, job.export_format, columns, rows, sheet_title)
+            os.replace(part_path, job.file_path)
+            if cached is None:
+                copy_to_cache(job.file_path, cache_path)
+        except Exception as e:
+            db.session.rollback()
+            remove_file(part_path)
+            app.logger.exception(f"❌ Выгрузка #{job_id} завершилась ошибкой")
+            finish_job(job, 'failed', error=str(e))
+            return
+
+        job.processed_rows = job.total_rows
+        finish_job(job, 'done')
+        app.logger.info(f"✅ Выгрузка #{job_id} готова: {job.total_rows} строк")
+
+
+def track_progress(rows, job_id):
+    """
+    Пропускает строки дальше и раз в PROGRESS_EVERY строк пишет счётчик в БД —
+    заодно с heartbeat_at, по которому очистка отличает долгую выгрузку от зависшей.
+    Пишем отдельным соединением: коммит в сессии закрыл бы серверный курсор выгрузки.
+    """
+    table = ExportJob.__table__
+    processed = 0
+    for row in rows:
+        yield row
+        processed += 1
+        if processed % PROGRESS_EVERY == 0:
+            with db.engine.begin() as conn:
+                conn.execute(
+                    table.update().where(table.c.id == job_id)
+                    .values(processed_rows=processed, heartbeat_at=datetime.utcnow())
+                )
+
+
+def finish_job(job, status, error=None):
+    now = datetime.utcnow()
+    job.status = status
+    job.error = error
+    job.finished_at = now
+    job.expires_at = now + timedelta(hours=current_app.config['EXPORT_TTL_HOURS'])
+    db.session.commit()
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except (FileNotFoundError, TypeError):
+        pass
+
+
+def cleanup_exports(now=None):
+    """
+    Удаляет просроченные выгрузки вместе с файлами и помечает зависшие задания
+    (процесс упал вместе с потоком) как ошибочные. Возвращает число удалённых.
+    Зависшее — то, что дольше EXPORT_JOB_TIMEOUT_MINUTES не подавало признаков жизни:
+    работающее — по heartbeat_at, ждущее в очереди — с момента создания.
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(minutes=current_app.config['EXPORT_JOB_TIMEOUT_MINUTES'])
+
+    # skip_locked: очистка идёт в каждом процессе, одно задание обработает кто-то один
+    stale = ExportJob.query.filter(or_(
+        and_(ExportJob.status == 'pending', ExportJob.created_at < cutoff),
+        and_(ExportJob.status == 'running',
+             func.coalesce(ExportJob.heartbeat_at, ExportJob.started_at, ExportJob.created_at) < cutoff),
+    )).with_for_update(skip_locked=True).all()
+    for job in stale:
+        if job.file_path:
+            remove_file(job.file_path + '.part')
+        job.status = 'failed'
+        job.error = 'Превышено время ожидания'
+        job.finished_at = now
+        job.expires_at = now + timedelta(hours=current_app.config['EXPORT_TTL_HOURS'])
+
+    expired = ExportJob.query.filter(ExportJob.expires_at < now).with_for_update(skip_locked=True).all()
+    for job in expired:
+        remove_file(job.file_path)
+        db.session.delete(job)
+
+    if stale or expired:
+        db.session.commit()
+    return len(expired)
+
+
+def run_cleanup(app):
+    """Очистка выгрузок в потоке пула, со своим контекстом приложения."""
+    with app.app_context():
+        try:
+            removed = cleanup_exports()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("🧹 Очистка выгрузок не удалась")
+            return
+        if removed:
+            app.logger.info(f"🧹 Удалено просроченных выгрузок: {removed}")
+
+
+def start_cleanup_timer(app):
+    """
+    Раз в EXPORT_CLEANUP_MINUTES ставит очистку выгрузок в пул выгрузок.
+    Один поток-таймер на процесс; остановить — app.extensions['export_cleanup_stop'].set().
+    """
+    interval = app.config['EXPORT_CLEANUP_MINUTES'] * 60
+    if not interval or 'export_cleanup_stop' in app.extensions:
+        return
+    stop = threading.Event()
+    app.extensions['export_cleanup_stop'] = stop
+
+    def tick():
+        while not stop.wait(interval):
+            get_executor(app).submit(run_cleanup, app)
+
+    threading.Thread(target=tick, name='export-cleanup', daemon=True).start()
@@ -1,13 +1,15 @@
+import json
 from datetime import datetime
 from flask import current_app, request
 from flask_login import UserMixin
 from app import db, login
-from sqlalchemy.orm import foreign
+from sqlalchemy.orm import Session, foreign
 from sqlalchemy.sql import or_, and_
 from werkzeug.security import check_password_hash
 from datetime import datetime, timedelta
 import os
-from sqlalchemy import event
+from itertools import chain
+from sqlalchemy import case, event, func, inspect, literal
 
 
 class Role(db.Model):
@@ -152,9 +154,17 @@ class LetterOutgoing(db.Model):
     recipient = db.Column(db.String(120))
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
     is_protected = db.Column(db.Boolean, default=False)  
-    sequence_num = db.Column(db.Integer, unique=True)
+    sequence_num = db.Column(db.Integer)
     year = db.Column(db.Integer)
 
+    # 🔎 search_vector (tsvector, russian) — генерируемая колонка Postgres,
+    # создаётся миграцией и читается только из app/search.py, в ORM не отображается
+
+    # 🔢 Номер уникален в пределах года; индекс же обслуживает сортировку списков
+    __table_args__ = (
+        db.Index('ix_letter_outgoing_year_sequence_num', 'year', 'sequence_num', unique=True),
+    )
+
 
     # 👇 Вот эта строка — создаёт связь с вложениями
     attachments = db.relationship(
@@ -167,12 +177,10 @@ class LetterOutgoing(db.Model):
     )
 
     def delete_with_attachments(self):
+        from app.storage import release_attachment_file  # storage импортирует модели
+
         for attachment in self.attachments:
-            try:
-                os.remove(attachment.filepath)
-                current_app.logger.info(f"Файл удалён: {attachment.filepath}")
-            except FileNotFoundError:
-                current_app.logger.warning(f"Файл не найден при удалении: {attachment.filepath}")
+            release_attachment_file(attachment)
             db.session.delete(attachment)
         current_app.logger.info(f"Удаление письма (исходящего): ID={self.id}, Номер={self.number}")
         db.session.delete(self)
@@ -187,6 +195,15 @@ class Attachment(db.Model):
     stored_filename = db.Column(db.String(255))
     filepath = db.Column(db.String(300))
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    size_bytes = db.Column(db.BigInteger)
+    content_hash = db.Column(db.String(64))  # SHA-256, hex; файл — StoredBlob с этим хэшем
+    mime_type = db.Column(db.String(100))
+    codec = db.Column(db.String(10))  # как сжат файл на диске: None, 'gzip' или 'zstd'
+
+    __table_args__ = (
+        db.Index('ix_attachment_letter_type_letter_id', 'letter_type', 'letter_id'),
+        db.Index('ix_attachment_content_hash', 'content_hash'),
+    )
 
     # 📨 Входящее письмо
     incoming_letter = db.relationship(
@@ -202,6 +219,45 @@ class Attachment(db.Model):
         overlaps="attachments,incoming_letter"
     )
 
+    # ⚙️ Фоновая обработка после загрузки и извлечённый текст
+    stages = db.relationship('AttachmentStage', cascade='all, delete-orphan')
+    text = db.relationship('AttachmentText', cascade='all, delete-orphan', uselist=False)
+
+
+class AttachmentStage(db.Model):
+    """Этап обработки вложения после загрузки (hash, mime, text, index) и его состояние."""
+    __tablename__ = 'attachment_stages'
+    attachment_id = db.Column(db.Integer, db.ForeignKey('attachment.id', ondelete='CASCADE'), primary_key=True)
+    stage = db.Column(db.String(20), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, done, skipped, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(500))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_attachment_stages_status', 'status'),
+    )
+
+
+class AttachmentText(db.Model):
+    """Текст, извлечённый из файла вложения (docx, xlsx…)."""
+    __tablename__ = 'attachment_texts'
+    attachment_id = db.Column(db.Integer, db.ForeignKey('attachment.id', ondelete='CASCADE'), primary_key=True)
+    content = db.Column(db.Text, nullable=False, default='')
+    extracted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # 🔎 search_vector (tsvector, russian) — колонка только в Postgres (миграция),
+    # её заполняет этап index; в модели не объявлена, как и у писем
+
+
+class StoredBlob(db.Model):
+    """Файл в хранилище по содержимому: один на SHA-256, сколько бы вложений на него ни ссылалось."""
+    __tablename__ = 'stored_blobs'
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size_bytes = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    codec = db.Column(db.String(10))  # сжатие файла; вложения копируют его себе
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 
 class LetterIncoming(db.Model):
     __tablename__ = 'letter_incoming'
@@ -212,9 +268,17 @@ class LetterIncoming(db.Model):
     subject = db.Column(db.String(200))
     forwarded_to = db.Column(db.String(120))
     date_received = db.Column(db.DateTime, default=datetime.utcnow)
-    sequence_num = db.Column(db.Integer, unique=True)  # Новое поле
+    sequence_num = db.Column(db.Integer)  # Новое поле
     year = db.Column(db.Integer)  # Новое поле
 
+    # 🔎 search_vector (tsvector, russian) — генерируемая колонка Postgres,
+    # создаётся миграцией и читается только из app/search.py, в ORM не отображается
+
+    # 🔢 Номер уникален в пределах года; индекс же обслуживает сортировку списков
+    __table_args__ = (
+        db.Index('ix_letter_incoming_year_sequence_num', 'year', 'sequence_num', unique=True),
+    )
+
 
 
     # 👇 Добавляем связь с вложениями
@@ -229,12 +293,10 @@ class LetterIncoming(db.Model):
     )
 
     def delete_with_attachments(self):
+        from app.storage import release_attachment_file  # storage импортирует модели
+
         for attachment in self.attachments:
-            try:
-                os.remove(attachment.filepath)
-                current_app.logger.info(f"Файл удалён: {attachment.filepath}")
-            except FileNotFoundError:
-                current_app.logger.warning(f"Файл не найден при удалении: {attachment.filepath}")
+            release_attachment_file(attachment)
             db.session.delete(attachment)
         current_app.logger.info(f"Удаление письма (входящего): ID={self.id}, Номер={self.number}")
         db.session.delete(self)
@@ -251,21 +313,218 @@ class LoginAttempt(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
 
 
+class TableVersion(db.Model):
+    """Счётчик изменений таблицы: растёт при каждой записи в неё через ORM."""
+    __tablename__ = 'table_versions'
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+def dialect_insert(connection):
+    """insert() с ON CONFLICT для БД соединения: Postgres или SQLite."""
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def bump_table_version(connection, name):
+    """
+    Увеличивает счётчик в той же транзакции, что и сама запись.
+    Одной командой INSERT … ON CONFLICT DO UPDATE: при UPDATE, а затем INSERT две первые
+    записи в таблицу без строки счётчика обе вставляли бы её, и одна падала бы на ключе.
+    """
+    table = TableVersion.__table__
+    connection.execute(
+        dialect_insert(connection)(table)
+        .values(name=name, version=1)
+        .on_conflict_do_update(index_elements=[table.c.name], set_={'version': table.c.version + 1})
+    )
 
-@event.listens_for(LetterOutgoing, 'before_insert')
-def set_outgoing_values(mapper, connection, target):
-    if not target.year:
-        target.year = datetime.now().year
-    if not target.sequence_num:
-        target.sequence_num = db.session.execute(
-            db.text("SELECT nextval('outgoing_number_seq')")
-        ).scalar()
-
-@event.listens_for(LetterIncoming, 'before_insert')
-def set_incoming_values(mapper, connection, target):
-    if not target.year:
-        target.year = datetime.now().year
-    if not target.sequence_num:
-        target.sequence_num = db.session.execute(
-            db.text("SELECT nextval('incoming_number_seq')")
-        ).scalar()
\ No newline at end of file
+
+def get_table_version(name):
+    version = db.session.execute(
+        db.select(TableVersion.version).where(TableVersion.name == name)
+    ).scalar()
+    return version or 0
+
+
+class NumberCounter(db.Model):
+    """Последний выданный номер журнала ('incoming', 'outgoing') за год."""
+    __tablename__ = 'number_counters'
+    register = db.Column(db.String(20), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    last_value = db.Column(db.Integer, nullable=False, default=0)
+
+
+def greatest(a, b):
+    """GREATEST(a, b) и в Postgres, и в SQLite."""
+    return case((a >= b, a), else_=b)
+
+
+def allocate_numbers(connection, register, year, count=1, at_least=0):
+    """
+    Выделяет count подряд идущих номеров журнала за год, возвращает первый из них.
+    Одна команда INSERT … ON CONFLICT DO UPDATE … RETURNING: строка счётчика блокируется
+    до конца транзакции, поэтому параллельные письма получают номера по очереди, без дублей,
+    а откат транзакции возвращает номера обратно — без дыр.
+    Нового счётчика года ещё нет — он начинается после уже занятых номеров этого года.
+    at_least — номер, уже занятый вручную: счётчик сперва поднимается до него,
+    иначе потом выдаст его повторно (count=0 — только поднять).
+    """
+    model = LETTER_REGISTERS[register][0]
+    table = NumberCounter.__table__
+    taken = (
+        db.select(
+            literal(register), literal(year),
+            greatest(func.coalesce(func.max(model.sequence_num), 0), literal(at_least)) + count,
+        )
+        .where(model.year == year)
+    )
+    statement = (
+        dialect_insert(connection)(table)
+        .from_select(['register', 'year', 'last_value'], taken)
+        .on_conflict_do_update(
+            index_elements=[table.c.register, table.c.year],
+            set_={'last_value': greatest(table.c.last_value, literal(at_least)) + count},
+        )
+        .returning(table.c.last_value)
+    )
+    return connection.execute(statement).scalar_one() - count + 1
+
+
+class ExportJob(db.Model):
+    """Фоновая выгрузка: параметры, прогресс и готовый файл."""
+    __tablename__ = 'export_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # 'incoming', 'outgoing', 'my_letters'
+    export_format = db.Column(db.String(10), nullable=False)  # 'xlsx', 'csv', 'ndjson'
+    params = db.Column(db.Text)  # фильтры списка, JSON
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending/running/done/failed
+    total_rows = db.Column(db.Integer)
+    processed_rows = db.Column(db.Integer, nullable=False, default=0)
+    file_path = db.Column(db.String(300))
+    download_name = db.Column(db.String(255))
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # последний знак жизни работающего задания
+    finished_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime)
+
+    user = db.relationship('User')
+
+    __table_args__ = (
+        db.Index('ix_export_jobs_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_export_jobs_status', 'status'),
+    )
+
+    @property
+    def is_active(self):
+        return self.status in ('pending', 'running')
+
+    @property
+    def progress(self):
+        """Процент готовности для индикатора."""
+        if self.status == 'done':
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(99, self.processed_rows * 100 // self.total_rows)
+
+
+
+class ImportJob(db.Model):
+    """Фоновый импорт входящих из файла: итог и ошибки по строкам (первые IMPORT_MAX_ERRORS)."""
+    __tablename__ = 'import_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.String(300))
+    skip_invalid = db.Column(db.Boolean, nullable=False, default=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending/running/done/failed
+    rows = db.Column(db.Integer)
+    imported = db.Column(db.Integer)
+    error_count = db.Column(db.Integer)
+    errors = db.Column(db.Text)  # [[строка, текст], ...], JSON
+    error = db.Column(db.Text)  # файл целиком не годится или запись сорвалась
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    user = db.relationship('User')
+
+    @property
+    def is_active(self):
+        return self.status in ('pending', 'running')
+
+    @property
+    def stats(self):
+        """Итог в том же виде, что возвращает import_incoming."""
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'errors': json.loads(self.errors or '[]'),
+            'error_count': self.error_count,
+        }
+
+
+# Журнал -> (модель, префикс номера)
+LETTER_REGISTERS = {
+    'incoming': (LetterIncoming, 'ВХ'),
+    'outgoing': (LetterOutgoing, 'H'),
+}
+
+
+# 🔢 Номера новых писем — из счётчиков number_counters, пачкой на весь flush.
+# Порядок номеров — порядок session.add(), журналы и годы — всегда в одном порядке (без взаимных блокировок).
+# Номер, заданный вручную, принимается только вместе с совпадающими sequence_num и year
+# (иначе видимый номер разойдётся с ключом сортировки) и поднимает счётчик до себя,
+# чтобы тот не выдал его повторно
+@event.listens_for(Session, 'before_flush')
+def assign_letter_numbers(session, flush_context, instances):
+    pending, manual = {}, {}
+    for obj in session.new:
+        for register, (model, prefix) in LETTER_REGISTERS.items():
+            if not isinstance(obj, model):
+                continue
+            if not obj.sequence_num and not obj.number:
+                if not obj.year:
+                    obj.year = datetime.now().year % 100
+                pending.setdefault((register, obj.year), []).append(obj)
+            elif obj.number != f'{prefix}-{obj.sequence_num}/{obj.year}':
+                raise ValueError(
+                    f'Номер {obj.number!r} не совпадает с sequence_num={obj.sequence_num}, year={obj.year}: '
+                    f'задайте все три согласованно или ни одного — тогда номер выдаст счётчик'
+                )
+            else:
+                key = (register, obj.year)
+                manual[key] = max(manual.get(key, 0), obj.sequence_num)
+
+    for register, year in sorted(pending.keys() | manual.keys()):
+        prefix = LETTER_REGISTERS[register][1]
+        letters = pending.get((register, year), [])
+        first = allocate_numbers(session.connection(), register, year, len(letters),
+                                 at_least=manual.get((register, year), 0))
+        letters.sort(key=lambda letter: inspect(letter).insert_order)
+        for sequence_num, letter in enumerate(letters, start=first):
+            letter.sequence_num = sequence_num
+            letter.number = f'{prefix}-{sequence_num}/{year}'
+
+
+# 🔄 Любая запись в письма (и в тексты вложений — по ним фильтрует поиск) меняет версию таблицы,
+# по ней сбрасывается кэш выгрузок
+VERSIONED_MODELS = (LetterIncoming, LetterOutgoing, AttachmentText)
+
+
+@event.listens_for(Session, 'after_flush')
+def bump_table_versions(session, flush_context):
+    changed = {
+        obj.__tablename__
+        for obj in chain(session.new, session.dirty, session.deleted)
+        if isinstance(obj, VERSIONED_MODELS)
+    }
+    for name in sorted(changed):
+        bump_table_version(session.connection(), name)
@@ -0,0 +1,101 @@
+import time
+from datetime import datetime
+from itertools import chain
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import LETTER_REGISTERS, NumberCounter, allocate_numbers
+
+
+def current_year():
+    return datetime.now().year % 100
+
+
+def taken_numbers(register, year):
+    """Наибольший порядковый номер среди писем журнала за год (0, если писем нет)."""
+    model = LETTER_REGISTERS[register][0]
+    return db.session.query(func.max(model.sequence_num)).filter(model.year == year).scalar() or 0
+
+
+def peek_number(register, year=None):
+    """
+    Следующий номер журнала без его выдачи: строка счётчика читается обычным SELECT,
+    без блокировки. Счётчика года ещё нет — он начнётся после уже занятых номеров.
+    """
+    year = current_year() if year is None else year
+    last_value = db.session.query(NumberCounter.last_value).filter_by(register=register, year=year).scalar()
+    if last_value is None:
+        last_value = taken_numbers(register, year)
+    return f'{LETTER_REGISTERS[register][1]}-{last_value + 1}/{year}'
+
+
+def reserve_numbers(register, count, year=None):
+    """
+    Пачка из count номеров журнала в текущей транзакции: [(sequence_num, number), ...].
+    Для массового создания писем, которым номера нужны до flush.
+    """
+    year = current_year() if year is None else year
+    first = allocate_numbers(db.session.connection(), register, year, count)
+    prefix = LETTER_REGISTERS[register][1]
+    return [(sequence_num, f'{prefix}-{sequence_num}/{year}') for sequence_num in range(first, first + count)]
+
+
+def sync_counter(register, year=None):
+    """
+    Ставит счётчик года на последний занятый номер: освобождает номера удалённых
+    с конца писем, а без писем за год — сбрасывает нумерацию на 1. Коммит — за вызывающим.
+    """
+    year = current_year() if year is None else year
+    counter = (
+        NumberCounter.query.filter_by(register=register, year=year).with_for_update().first()
+        or NumberCounter(register=register, year=year)
+    )
+    counter.last_value = taken_numbers(register, year)
+    db.session.add(counter)
+    return counter.last_value
+
+
+def next_numbers_preview():
+    """
+    Следующие номера для админ-панели: {'next_outgoing', 'next_incoming'}.
+    Только чтение; результат кэшируется в процессе на NUMBER_PREVIEW_TTL секунд,
+    создание или удаление письма кэш сбрасывает.
+    """
+    cached = current_app.extensions.get('number_preview')
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+
+    preview = {
+        'next_outgoing': peek_number('outgoing'),
+        'next_incoming': peek_number('incoming'),
+    }
+    current_app.extensions['number_preview'] = (time.monotonic() + current_app.config['NUMBER_PREVIEW_TTL'], preview)
+    return preview
+
+
+def invalidate_number_preview():
+    if has_app_context():
+        current_app.extensions.pop('number_preview', None)
+
+
+# 🔄 Письмо создано или удалено — превью сбрасываем после коммита, а не при flush:
+# иначе параллельный запрос успел бы закэшировать ещё старый номер
+@event.listens_for(Session, 'after_flush')
+def mark_numbers_changed(session, flush_context):
+    models = tuple(model for model, _ in LETTER_REGISTERS.values())
+    if any(isinstance(obj, models) for obj in chain(session.new, session.deleted)):
+        session.info['numbers_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def reset_number_preview(session):
+    if session.info.pop('numbers_changed', False):
+        invalidate_number_preview()
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_numbers_changed(session):
+    session.info.pop('numbers_changed', None)
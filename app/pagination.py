@@ -0,0 +1,86 @@
+import base64
+import binascii
+import json
+
+from sqlalchemy import tuple_
+
+
+def encode_cursor(key, direction):
+    """Упаковывает ключ строки (year, sequence_num) в непрозрачный токен."""
+    payload = json.dumps({'k': list(key), 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Разбирает токен курсора. Повреждённый токен — это просто первая страница."""
+    if not token:
+        return None, 'next'
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        key = tuple(int(v) for v in data['k'])
+        direction = data.get('d', 'next')
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        return None, 'next'
+    if direction not in ('next', 'prev'):
+        direction = 'next'
+    return key, direction
+
+
+class KeysetPage:
+    """Страница keyset-пагинации — аналог Pagination для шаблонов."""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def keyset_paginate(query, columns, cursor=None, per_page=10):
+    """
+    Постраничная выборка без OFFSET и COUNT(*): каждая страница начинается
+    строго после (или до) ключа последней показанной строки.
+    Порядок — по убыванию columns, например (year, sequence_num).
+    """
+    key, direction = decode_cursor(cursor)
+    if key is not None and len(key) != len(columns):
+        key, direction = None, 'next'  # ключ не той длины — тоже повреждённый курсор
+    per_page = max(per_page, 1)
+    row_key = tuple_(*columns)
+
+    if direction == 'prev' and key is not None:
+        query = query.filter(row_key > key).order_by(*[c.asc() for c in columns])
+    else:
+        if key is not None:
+            query = query.filter(row_key < key)
+        query = query.order_by(*[c.desc() for c in columns])
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if direction == 'prev' and key is not None:
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = key is not None, has_more
+
+    def row_key_of(row):
+        return tuple(getattr(row, c.key) for c in columns)
+
+    next_cursor = prev_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor(row_key_of(rows[-1]), 'next')
+    if rows and has_prev:
+        prev_cursor = encode_cursor(row_key_of(rows[0]), 'prev')
+
+    return KeysetPage(rows, per_page, next_cursor=next_cursor, prev_cursor=prev_cursor)
@@ -0,0 +1,289 @@
+import multiprocessing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import or_, text
+
+from app import db
+from app.compression import open_stored
+from app.downloads import attachment_mimetype
+from app.models import Attachment, AttachmentStage, AttachmentText
+from app.storage import hash_file
+from app.text_extract import extract_text
+
+
+# Этапы по порядку: следующий начинается, только когда предыдущий done или skipped
+STAGES = ('hash', 'mime', 'text', 'index')
+FINISHED_STATUSES = ('done', 'skipped')
+OLE_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+# Столько символов текста попадает в tsvector (у него предел в 1 МБ)
+INDEX_TEXT_CHARS = 200_000
+
+
+class StageFailed(Exception):
+    """Этап не прошёл, но изменения вложения (например, mime_type) нужно сохранить."""
+
+
+def get_executor(app):
+    """Пул потоков обработки вложений, один на процесс (PIPELINE_WORKERS)."""
+    executor = app.extensions.get('pipeline_executor')
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=app.config['PIPELINE_WORKERS'], thread_name_prefix='pipeline')
+        app.extensions['pipeline_executor'] = executor
+    return executor
+
+
+def get_extract_pool(app):
+    """
+    Пул процессов извлечения текста, один на процесс приложения (TEXT_EXTRACT_PROCESSES).
+    spawn, а не fork: форк процесса с открытыми соединениями БД и потоками небезопасен.
+    """
+    pool = app.extensions.get('text_extract_pool')
+    if pool is None:
+        pool = ProcessPoolExecutor(
+            max_workers=app.config['TEXT_EXTRACT_PROCESSES'],
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+        app.extensions['text_extract_pool'] = pool
+    return pool
+
+
+def discard_extract_pool(app, pool, terminate=False):
+    """
+    Убирает пул, чтобы следующий вызов создал новый. terminate — добить процессы:
+    зависший разбор сам не завершится и будет вечно занимать место в пуле.
+    Задачи других потоков в этом пуле при этом падают — их этап повторится позже.
+    """
+    if app.extensions.get('text_extract_pool') is pool:
+        del app.extensions['text_extract_pool']
+    # Публичного способа остановить процессы пула в 3.11 нет
+    processes = list((pool._processes or {}).values()) if terminate else []
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+def extract_in_pool(path, codec, ext):
+    """Текст файла: в пуле процессов, чтобы разбор не держал GIL потоков веб-сервера."""
+    app = current_app._get_current_object()
+    if not app.config['TEXT_EXTRACT_PROCESSES']:
+        return extract_text(path, codec, ext)
+    pool = get_extract_pool(app)
+    try:
+        return pool.submit(extract_text, path, codec, ext).result(timeout=app.config['TEXT_EXTRACT_TIMEOUT'])
+    except BrokenProcessPool:
+        # Процесс пула упал (например, по памяти на кривом файле) — следующий вызов создаст новый пул
+        discard_extract_pool(app, pool)
+        raise
+    except TimeoutError:
+        # Разбор завис (битый PDF) — останавливаем его процессы вместе с пулом
+        current_app.logger.warning(f"⏱️ Извлечение текста дольше {app.config['TEXT_EXTRACT_TIMEOUT']} с: {path}")
+        discard_extract_pool(app, pool, terminate=True)
+        raise
+
+
+def file_extension(filename):
+    return filename.rsplit('.', 1)[-1].lower() if filename and '.' in filename else ''
+
+
+def sniff_extensions(path, codec):
+    """Какие расширения подходят содержимому файла — по сигнатуре, а для zip — по составу архива."""
+    with open_stored(path, codec) as f:
+        head = f.read(1024)
+        if b'%PDF' in head:
+            return {'pdf'}
+        if head.startswith(OLE_MAGIC):
+            return {'doc', 'xls'}
+        if head.startswith(b'Rar!\x1a\x07'):
+            return {'rar'}
+        if head.startswith(b'PK\x03\x04'):
+            f.seek(0)
+            names = set(zipfile.ZipFile(f).namelist())
+            if 'word/document.xml' in names:
+                return {'docx'}
+            if 'xl/workbook.xml' in names:
+                return {'xlsx'}
+            return {'zip'}
+    return set()
+
+
+def stage_hash(attachment):
+    """Размер и SHA-256; у новых загрузок они уже посчитаны при приёме файла."""
+    if attachment.size_bytes is not None and attachment.content_hash:
+        return False
+    attachment.size_bytes, attachment.content_hash = hash_file(attachment.filepath)
+
+
+def stage_mime(attachment):
+    """
+    Сверяет содержимое с расширением. Если файл только притворяется PDF или Word,
+    он будет отдаваться как application/octet-stream.
+    """
+    ext = file_extension(attachment.filename)
+    if ext in sniff_extensions(attachment.filepath, attachment.codec):
+        attachment.mime_type = attachment_mimetype(attachment.filename)
+        return
+    attachment.mime_type = 'application/octet-stream'
+    raise StageFailed(f'Содержимое файла не соответствует расширению .{ext}')
+
+
+def stage_text(attachment):
+    """Текст PDF/DOCX/XLSX в attachment_texts; остальные форматы пропускаются."""
+    content = extract_in_pool(attachment.filepath, attachment.codec, file_extension(attachment.filename))
+    if content is None:
+        return False
+    if attachment.text is None:
+        attachment.text = AttachmentText(content=content)
+    else:
+        attachment.text.content = content
+        attachment.text.extracted_at = datetime.utcnow()
+
+
+def stage_index(attachment):
+    """tsvector по извлечённому тексту (только Postgres; колонка есть лишь в миграции)."""
+    if attachment.text is None or db.engine.dialect.name != 'postgresql':
+        return False
+    db.session.flush()
+    db.session.execute(text("""
+        UPDATE attachment_texts
+        SET search_vector = to_tsvector('russian'::regconfig, left(content, :chars))
+        WHERE attachment_id = :attachment_id
+    """), {'chars': INDEX_TEXT_CHARS, 'attachment_id': attachment.id})
+
+
+STAGE_HANDLERS = {
+    'hash': stage_hash,
+    'mime': stage_mime,
+    'text': stage_text,
+    'index': stage_index,
+}
+
+
+def new_stages():
+    """Записи этапов для только что созданного вложения."""
+    return [AttachmentStage(stage=name, status='pending', attempts=0) for name in STAGES]
+
+
+def run_stages(attachment, retry_failed=True):
+    """
+    Выполняет незавершённые этапы вложения по порядку, коммитя после каждого.
+    Возвращает True, если все этапы завершены.
+    """
+    stages = {stage.stage: stage for stage in attachment.stages}
+    missing = [name for name in STAGES if name not in stages]
+    if missing:
+        # У старых вложений записей этапов нет — создаём до запуска, чтобы откат этапа их не потерял
+        for name in missing:
+            stages[name] = AttachmentStage(stage=name, status='pending', attempts=0)
+            attachment.stages.append(stages[name])
+        db.session.commit()
+
+    for name in STAGES:
+        stage = stages[name]
+        if stage.status in FINISHED_STATUSES:
+            continue
+        if stage.status == 'failed' and not retry_failed:
+            return False
+
+        try:
+            result = STAGE_HANDLERS[name](attachment)
+            stage.status, stage.error = ('skipped' if result is False else 'done'), None
+        except StageFailed as e:
+            stage.status, stage.error = 'failed', str(e)[:500]
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.warning(f"⚙️ Вложение #{attachment.id}: этап {name} не выполнен: {e}")
+            stage.status, stage.error = 'failed', f'{type(e).__name__}: {e}'[:500]
+        stage.attempts += 1
+        db.session.commit()
+
+        if stage.status == 'failed':
+            return False
+    return True
+
+
+def process_attachment(app, attachment_id, retry_failed=True):
+    """Обработка одного вложения в потоке пула, со своим контекстом приложения и сессией."""
+    with app.app_context():
+        try:
+            attachment = db.session.get(Attachment, attachment_id)
+            if attachment is None:
+                return None
+            return run_stages(attachment, retry_failed)
+        finally:
+            db.session.remove()
+
+
+def enqueue_attachments(attachment_ids):
+    """Ставит только что закоммиченные вложения в фоновую обработку."""
+    if not current_app.config['ATTACHMENT_PIPELINE']:
+        return
+    app = current_app._get_current_object()
+    executor = get_executor(app)
+    for attachment_id in attachment_ids:
+        executor.submit(process_attachment, app, attachment_id)
+
+
+def backlog_query(stage=None, retry_failed=False):
+    """
+    Вложения с незавершёнными этапами, включая старые — у них записей этапов ещё нет.
+    Вложения с ошибкой в каком-либо этапе — только при retry_failed.
+    """
+    unfinished = ['pending', 'failed'] if retry_failed else ['pending']
+    pending = db.session.query(AttachmentStage.attachment_id).filter(AttachmentStage.status.in_(unfinished))
+    if stage:
+        pending = pending.filter(AttachmentStage.stage == stage)
+
+    def stages_exist(*criteria):
+        return db.session.query(AttachmentStage.attachment_id).filter(
+            AttachmentStage.attachment_id == Attachment.id, *criteria
+        ).exists()
+
+    query = db.session.query(Attachment.id).filter(or_(Attachment.id.in_(pending), ~stages_exist()))
+    if not retry_failed:
+        query = query.filter(~stages_exist(AttachmentStage.status == 'failed'))
+    return query
+
+
+def reset_stage(stage):
+    """Помечает этап и все следующие за ним к повторному выполнению у всех вложений."""
+    updated = (
+        AttachmentStage.query
+        .filter(AttachmentStage.stage.in_(STAGES[STAGES.index(stage):]))
+        .update({'status': 'pending', 'error': None}, synchronize_session=False)
+    )
+    db.session.commit()
+    return updated
+
+
+def process_backlog(workers=4, batch_size=500, stage=None, retry_failed=False, log=print):
+    """
+    Догоняет обработку: все вложения с незавершёнными этапами — параллельно, пачками по batch_size.
+    Возвращает {'processed', 'completed', 'failed'}.
+    """
+    app = current_app._get_current_object()
+    stats = {'processed': 0, 'completed': 0, 'failed': 0}
+    last_id = 0
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pipeline-backlog') as pool:
+        while True:
+            ids = [
+                attachment_id for (attachment_id,) in
+                backlog_query(stage, retry_failed).filter(Attachment.id > last_id)
+                .order_by(Attachment.id).limit(batch_size)
+            ]
+            db.session.rollback()
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            for attachment_id, completed in zip(ids, pool.map(
+                    lambda attachment_id: process_attachment(app, attachment_id, retry_failed), ids)):
+                stats['processed'] += 1
+                stats['completed' if completed else 'failed'] += 1
+            log(f"⚙️ Обработано: {stats['processed']} (последнее #{last_id})")
+
+    return stats
@@ -0,0 +1,148 @@
+from sqlalchemy import func, literal_column, or_
+
+from app import db
+from app.models import Attachment, AttachmentText, LetterIncoming, LetterOutgoing
+
+
+def escape_like(value):
+    """Экранирует спецсимволы LIKE, чтобы % и _ из поиска искались буквально."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def contains(column, term):
+    """
+    Поиск подстроки без учёта регистра.
+    Сравниваем lower(column) с уже приведённым к нижнему регистру шаблоном —
+    так запрос совпадает с выражением GIN-индекса pg_trgm (lower(col) gin_trgm_ops).
+    Шаблон приводится к нижнему регистру в Python, а колонка — функцией lower() в БД,
+    и она знает кириллицу только при UTF-8 локали (LC_CTYPE базы, например ru_RU.UTF-8
+    или C.UTF-8). В базе с LC_CTYPE=C lower() кириллицу не трогает и «Договор» не найдётся.
+    """
+    pattern = f"%{escape_like(term.lower())}%"
+    return func.lower(column).like(pattern, escape='\\')
+
+
+def attachment_content_match(letter_type, term, user=None):
+    """
+    Подзапрос id писем, в тексте вложений которых есть term.
+    В Postgres — по tsvector (GIN-индекс, морфология: «трубы» найдёт «труба»),
+    в остальных БД — подстрокой по самому тексту.
+    С user ищем только во вложениях, которые ему можно открыть, — иначе поиск
+    выдавал бы содержимое защищённых файлов.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        match = literal_column('attachment_texts.search_vector').op('@@')(
+            func.websearch_to_tsquery('russian', term)
+        )
+    else:
+        match = contains(AttachmentText.content, term)
+    query = (
+        db.session.query(Attachment.letter_id)
+        .join(AttachmentText, AttachmentText.attachment_id == Attachment.id)
+        .filter(Attachment.letter_type == letter_type, match)
+    )
+    if user is not None:
+        if letter_type == 'incoming':
+            visible = visible_incoming(LetterIncoming.query, user).with_entities(LetterIncoming.id)
+        else:
+            visible = visible_outgoing(LetterOutgoing.query, user).with_entities(LetterOutgoing.id)
+        query = query.filter(Attachment.letter_id.in_(visible))
+    return query
+
+
+def filter_incoming(query, args, user=None):
+    """Фильтры списка входящих. Возвращает (query, search_params); user — для поиска по вложениям."""
+    search_params = {
+        'organization': args.get('organization', '').strip(),
+        'number': args.get('number', '').strip(),
+        'subject': args.get('subject', '').strip(),
+        'forwarded_to': args.get('forwarded_to', '').strip(),
+        'content': args.get('content', '').strip(),
+        'date_from': args.get('date_from'),
+        'date_to': args.get('date_to'),
+    }
+
+    for field in ('organization', 'number', 'subject', 'forwarded_to'):
+        if search_params[field]:
+            query = query.filter(contains(getattr(LetterIncoming, field), search_params[field]))
+    if search_params['content']:
+        # 📎 Поиск по тексту вложений
+        matched = attachment_content_match('incoming', search_params['content'], user)
+        query = query.filter(LetterIncoming.id.in_(matched))
+
+    # 📅 Опциональная фильтрация по дате
+    if search_params['date_from']:
+        query = query.filter(LetterIncoming.date_received >= search_params['date_from'])
+    if search_params['date_to']:
+        query = query.filter(LetterIncoming.date_received <= search_params['date_to'])
+
+    return query, search_params
+
+
+def filter_outgoing(query, args, user=None):
+    """Фильтры списка исходящих. Возвращает (query, search_params); user — для поиска по вложениям."""
+    search_params = {
+        'number': args.get('number', '').strip(),
+        'subject': args.get('subject', '').strip(),
+        'recipient': args.get('recipient', '').strip(),
+        'content': args.get('content', '').strip(),
+        'date_from': args.get('date_from'),
+        'date_to': args.get('date_to'),
+    }
+
+    for field in ('number', 'subject', 'recipient'):
+        if search_params[field]:
+            query = query.filter(contains(getattr(LetterOutgoing, field), search_params[field]))
+    if search_params['content']:
+        # 📎 Поиск по тексту вложений
+        matched = attachment_content_match('outgoing', search_params['content'], user)
+        query = query.filter(LetterOutgoing.id.in_(matched))
+
+    if search_params['date_from']:
+        query = query.filter(LetterOutgoing.date_created >= search_params['date_from'])
+    if search_params['date_to']:
+        query = query.filter(LetterOutgoing.date_created <= search_params['date_to'])
+
+    return query, search_params
+
+
+def visible_incoming(query, user):
+    """Входящие, вложения которых доступны пользователю: Admin и Editor — все, остальным — свои."""
+    if user.role and user.role.name in ('Admin', 'Editor'):
+        return query
+    return query.filter(LetterIncoming.user_id == user.id)
+
+
+def visible_outgoing(query, user):
+    """
+    Исходящие, вложения которых доступны пользователю: защищённые — только автору и админу,
+    открытые — ещё Editor и Viewer.
+    """
+    if user.is_admin:
+        return query
+    if user.role and user.role.name in ('Editor', 'Viewer'):
+        return query.filter(or_(LetterOutgoing.is_protected.isnot(True), LetterOutgoing.user_id == user.id))
+    return query.filter(LetterOutgoing.user_id == user.id)
+
+
+def attachment_stats(letter_type, letters):
+    """
+    Число и суммарный размер вложений для писем страницы одним GROUP BY-запросом
+    вместо letter.attachments.count() на каждую строку. Размер — из БД, диск не трогаем.
+    Возвращает {letter_id: (count, size_bytes)}; письма без вложений в словарь не попадают.
+    """
+    ids = [letter.id for letter in letters]
+    if not ids:
+        return {}
+
+    rows = (
+        db.session.query(
+            Attachment.letter_id,
+            func.count(Attachment.id),
+            func.coalesce(func.sum(Attachment.size_bytes), 0),
+        )
+        .filter(Attachment.letter_type == letter_type, Attachment.letter_id.in_(ids))
+        .group_by(Attachment.letter_id)
+        .all()
+    )
+    return {letter_id: (count, size_bytes) for letter_id, count, size_bytes in rows}
@@ -0,0 +1,191 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.exports import batched
+from app.models import Attachment, StoredBlob
+
+
+# Служебные папки UPLOAD_FOLDER: черновики загрузок, выгрузки и сам карантин
+SKIP_DIRS = ('.staging', '.quarantine', 'export_cache', 'exports')
+RECONCILE_MODES = ('report', 'quarantine', 'delete')
+
+
+def scan_dir(path):
+    """Одна папка: ([(путь, stat)], [подпапки]). stat — главный расход на NFS, поэтому в пуле."""
+    files, dirs = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append((entry.path, entry.stat(follow_symlinks=False)))
+    except FileNotFoundError:
+        pass
+    return files, dirs
+
+
+def walk_files(root, pool, skip=(), ahead=16):
+    """
+    Параллельный обход дерева: каждая папка сканируется отдельной задачей пула,
+    файлы отдаются по мере готовности. Впереди потребителя — не больше ahead папок,
+    так что в памяти только очередь путей ещё не просмотренных папок.
+    """
+    queue, pending = deque([root]), set()
+    while queue or pending:
+        while queue and len(pending) < ahead:
+            pending.add(pool.submit(scan_dir, queue.popleft()))
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            files, dirs = future.result()
+            queue.extend(path for path in dirs if path not in skip)
+            yield from files
+
+
+def find_orphans(batch, blobs_root):
+    """
+    Файлы пачки, на которые не ссылается ни одно вложение. Блоб узнаём по имени (sha256):
+    он не сирота, если есть вложение с таким хэшем или строка stored_blobs — оба по индексу.
+    По Attachment.filepath (без индекса) сверяем только старые файлы вне хранилища блобов.
+    """
+    blobs, legacy = {}, []
+    for path, _ in batch:
+        if path.startswith(blobs_root + os.sep):
+            blobs[path] = os.path.basename(path)
+        else:
+            legacy.append(path)
+
+    known_paths = set()
+    if legacy:
+        known_paths = {
+            filepath for (filepath,) in
+            db.session.query(Attachment.filepath).filter(Attachment.filepath.in_(legacy))
+        }
+    known_hashes = set()
+    if blobs:
+        hashes = list(blobs.values())
+        known_hashes = {
+            content_hash for (content_hash,) in
+            db.session.query(Attachment.content_hash).filter(Attachment.content_hash.in_(hashes))
+        }
+        known_hashes.update(
+            sha256 for (sha256,) in
+            db.session.query(StoredBlob.sha256).filter(StoredBlob.sha256.in_(hashes))
+        )
+
+    return [
+        (path, stat) for path, stat in batch
+        if path not in known_paths and blobs.get(path) not in known_hashes
+    ]
+
+
+def claim_orphan(path, blobs_root, cutoff):
+    """
+    Перепроверка сироты прямо перед удалением или переносом: пачку сверяли раньше,
+    и за это время загрузка того же содержимого могла сослаться на блоб.
+    Для блоба берём строку stored_blobs под блокировку, а если строки нет —
+    вставляем пустую: параллельный acquire_blob будет ждать конца нашей транзакции.
+    Вызывающий закрывает транзакцию (rollback) сразу после действия над файлом.
+    """
+    is_blob = path.startswith(blobs_root + os.sep)
+    if is_blob:
+        sha256 = os.path.basename(path)
+        if StoredBlob.query.filter_by(sha256=sha256).with_for_update().populate_existing().first():
+            return False
+        try:
+            with db.session.begin_nested():
+                db.session.add(StoredBlob(sha256=sha256, size_bytes=0, ref_count=0))
+        except IntegrityError:
+            return False  # строку только что создала загрузка того же файла
+        # Вложение на блоб всегда несёт его хэш — filepath (без индекса) не нужен
+        referenced = Attachment.query.filter_by(content_hash=sha256).first()
+    else:
+        referenced = Attachment.query.filter_by(filepath=path).first()
+    if referenced:
+        return False
+
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    return stat.st_mtime <= cutoff
+
+
+def quarantine_file(path, root):
+    """Переносит файл в UPLOAD_FOLDER/.quarantine с сохранением относительного пути."""
+    dest = os.path.join(root, '.quarantine', os.path.relpath(path, root))
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    os.replace(path, dest)
+
+
+def reconcile_uploads(mode='report', min_age_minutes=60, workers=8, batch_size=1000, log=print):
+    """
+    Сверяет UPLOAD_FOLDER с таблицей вложений в обе стороны:
+    файлы без вложения (сироты) и вложения без файла (пропавшие).
+    Сирот можно перенести в карантин или удалить; моложе min_age_minutes не трогаем —
+    это может быть загрузка, которая ещё не закоммичена.
+    """
+    if mode not in RECONCILE_MODES:
+        raise ValueError(f'Неизвестный режим: {mode}')
+
+    root = current_app.config['UPLOAD_FOLDER']
+    blobs_root = os.path.join(root, 'blobs')
+    skip = {os.path.join(root, name) for name in SKIP_DIRS}
+    cutoff = time.time() - min_age_minutes * 60
+    stats = {
+        'files': 0, 'bytes': 0,
+        'orphans': 0, 'orphan_bytes': 0, 'recent': 0,
+        'attachments': 0, 'missing': 0,
+    }
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # 🗂️ Диск → БД
+        for batch in batched(walk_files(root, pool, skip, ahead=workers * 2), batch_size):
+            stats['files'] += len(batch)
+            stats['bytes'] += sum(stat.st_size for _, stat in batch)
+
+            for path, stat in find_orphans(batch, blobs_root):
+                if stat.st_mtime > cutoff:
+                    stats['recent'] += 1
+                    continue
+                stats['orphans'] += 1
+                stats['orphan_bytes'] += stat.st_size
+                log(f'🧩 Сирота: {path} ({stat.st_size} байт)')
+                if mode == 'report':
+                    continue
+                try:
+                    if not claim_orphan(path, blobs_root, cutoff):
+                        stats['orphans'] -= 1
+                        stats['orphan_bytes'] -= stat.st_size
+                        log(f'↩️ Уже не сирота, пропущен: {path}')
+                    elif mode == 'quarantine':
+                        quarantine_file(path, root)
+                    else:
+                        os.remove(path)
+                finally:
+                    # Снимаем блокировку и пустую строку stored_blobs
+                    db.session.rollback()
+            db.session.rollback()
+
+        # 📎 БД → диск
+        rows = (
+            db.session.query(Attachment.id, Attachment.filepath)
+            .order_by(Attachment.id)
+            .execution_options(stream_results=True, yield_per=batch_size)
+        )
+        for batch in batched(rows, batch_size):
+            stats['attachments'] += len(batch)
+            exists = pool.map(lambda path: bool(path) and os.path.isfile(path), [path for _, path in batch])
+            for (attachment_id, path), found in zip(batch, exists):
+                if not found:
+                    stats['missing'] += 1
+                    log(f'⚠️ Нет файла у вложения #{attachment_id}: {path}')
+        db.session.rollback()
+
+    return stats
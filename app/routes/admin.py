@@ -1,13 +1,20 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
+import os
+
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify
 from flask_login import login_required, current_user, logout_user
 from werkzeug.security import generate_password_hash
 from app import db
-from app.models import User, Role, LetterOutgoing, LetterIncoming, UserBlockHistory
+from app.models import User, Role, LetterOutgoing, LetterIncoming, UserBlockHistory, ImportJob
 from app.forms import AdminUserForm
 from datetime import datetime, timedelta
 from sqlalchemy import or_, and_, func, extract
-from sqlalchemy.sql import text
+from sqlalchemy.orm import joinedload
 from app.decorators import admin_required
+from app.imports import ImportFileError, import_incoming, save_import_upload, start_import
+from app.numbering import invalidate_number_preview, next_numbers_preview, sync_counter
+from app.pagination import keyset_paginate
+from app.uploads import accepts_uploads
+from app.queries import filter_outgoing
 
 
 admin_bp = Blueprint(
@@ -22,71 +29,22 @@ def is_user_online(user, minutes=5):
     return user.last_active_at > datetime.utcnow() - timedelta(minutes=minutes)
 
 def get_dashboard_stats():
-    now = datetime.utcnow()
-    current_year = now.year % 100  # 25 для 2025 года
-
+    # 🔢 Следующие номера — только чтение: ни nextval, ни setval с панели
     try:
-        # Для исходящих писем
-        # Получаем максимальный номер из поля number
-        max_outgoing_num = db.session.execute(
-            text("""
-                SELECT MAX(CAST(SUBSTRING(number FROM 3 FOR POSITION('/' IN number)-3) AS INTEGER))
-                FROM letter_outgoing 
-                WHERE number LIKE 'H-%/%' AND SUBSTRING(number FROM POSITION('/' IN number)+1) = :year
-            """), {'year': str(current_year)}
-        ).scalar() or 0
-        
-        # Устанавливаем последовательность
-        db.session.execute(
-            text("SELECT setval('outgoing_number_seq', :val, true)"),
-            {'val': max_outgoing_num + 1}
-        )
-        
-        # Получаем следующий номер
-        next_outgoing = db.session.execute(
-            text("SELECT nextval('outgoing_number_seq')")
-        ).scalar()
-        
-        outgoing_number = f"H-{next_outgoing}/{current_year}"
-
-        # Для входящих писем
-        max_incoming_num = db.session.execute(
-            text("""
-                SELECT MAX(sequence_num)
-                FROM letter_incoming
-                WHERE year = :year
-         """), {'year': current_year}
-        ).scalar() or 0
-
-        db.session.execute(
-            text("SELECT setval('incoming_number_seq', :val, true)"),
-            {'val': max_incoming_num + 1}
-        )
-        
-        next_incoming = db.session.execute(
-            text("SELECT nextval('incoming_number_seq')")
-        ).scalar()
-        incoming_number = f"ВХ-{next_incoming}/{current_year}"
-        
-        stats = {
-            'next_outgoing': outgoing_number,
-            'next_incoming': incoming_number,
-            # ... остальная статистика ...
-        }
-        
-        return stats
-
+        return next_numbers_preview()
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Ошибка при получении статистики: {str(e)}")
+        current_year = datetime.utcnow().year % 100
         return {
             'next_outgoing': f'H-0/{current_year}',
             'next_incoming': f'ВХ-0/{current_year}',
-            # ... значения по умолчанию ...
         }
 
 def get_recent_logs(limit=20):
     logs = (
         UserBlockHistory.query
+        .options(joinedload(UserBlockHistory.admin), joinedload(UserBlockHistory.user))
         .order_by(UserBlockHistory.timestamp.desc())
         .limit(limit)
         .all()
@@ -128,26 +86,13 @@ def index():
 @admin_required
 def reset_outgoing():
     try:
-        current_year = datetime.now().year % 100
-        exists = LetterOutgoing.query.filter_by(year=current_year).first()
-        
-        if exists:
-            # Синхронизируем с максимальным номером
-            max_num = db.session.execute(
-                text("SELECT MAX(sequence_num) FROM letter_outgoing WHERE year = :year"),
-                {'year': current_year}
-            ).scalar()
-            db.session.execute(
-                text("SELECT setval('outgoing_number_seq', :val, true)"),
-                {'val': max_num + 1}
-            )
+        # Есть письма за год — синхронизируем с максимальным номером, нет — полный сброс
+        if sync_counter('outgoing'):
             flash('Нумерация синхронизирована с существующими письмами', 'info')
         else:
-            # Полный сброс
-            db.session.execute(text("ALTER SEQUENCE outgoing_number_seq RESTART WITH 1"))
             flash('Нумерация исходящих писем сброшена', 'success')
-        
         db.session.commit()
+        invalidate_number_preview()
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Ошибка сброса нумерации: {str(e)}")
@@ -159,8 +104,10 @@ def reset_outgoing():
 @admin_required
 def release_outgoing():
     try:
-        db.session.execute(text("SELECT setval('outgoing_number_seq', nextval('outgoing_number_seq') - 1)"))
+        # Номера после последнего существующего письма года снова свободны
+        sync_counter('outgoing')
         db.session.commit()
+        invalidate_number_preview()
         flash('Последний номер исходящих освобожден', 'info')
     except Exception as e:
         db.session.rollback()
@@ -181,8 +128,9 @@ def reset_incoming():
         if exists:
             flash('Нельзя сбросить нумерацию - уже есть письма за этот год', 'danger')
         else:
-            db.session.execute(text("ALTER SEQUENCE incoming_number_seq RESTART WITH 1"))
+            sync_counter('incoming')
             db.session.commit()
+            invalidate_number_preview()
             flash('Нумерация входящих писем сброшена', 'success')
     except Exception as e:
         db.session.rollback()
@@ -194,8 +142,9 @@ def reset_incoming():
 @admin_required
 def release_incoming():
     try:
-        db.session.execute(text("SELECT setval('incoming_number_seq', nextval('incoming_number_seq') - 1)"))
+        sync_counter('incoming')
         db.session.commit()
+        invalidate_number_preview()
         flash('Последний номер входящих освобожден', 'info')
     except Exception as e:
         db.session.rollback()
@@ -321,12 +270,114 @@ def dashboard():
                             next_incoming='ВХ-0/00')
 
 
+# 📥 Массовый импорт входящих (бумажный архив) из CSV/XLSX
+@admin_bp.route('/import/incoming', methods=['GET', 'POST'])
+@accepts_uploads
+@login_required
+@admin_required
+def import_incoming_letters():
+    stats = None
+    if request.method == 'POST':
+        file = request.files.get('file')
+        if not file or not file.filename:
+            flash('Выберите файл CSV или XLSX', 'warning')
+            return redirect(url_for('admin.import_incoming_letters'))
+
+        path = None
+        try:
+            path = save_import_upload(file)
+            # Большой файл — в фон: запрос не держит воркер на всё время импорта
+            if os.path.getsize(path) > current_app.config['IMPORT_SYNC_MAX_BYTES']:
+                job = start_import(path, file.filename, current_user.id, 'skip_invalid' in request.form)
+                path = None  # файл теперь удалит задание
+                flash('📥 Файл большой — импорт идёт в фоне, итог появится на этой странице.', 'info')
+                return redirect(url_for('admin.import_job', job_id=job.id))
+            stats = import_incoming(path, current_user.id, filename=file.filename,
+                                    skip_invalid='skip_invalid' in request.form)
+        except ImportFileError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('admin.import_incoming_letters'))
+        finally:
+            if path and os.path.exists(path):
+                os.remove(path)
+
+        current_app.logger.info(
+            f"Импорт входящих: {current_user.username}, строк {stats['rows']}, "
+            f"записано {stats['imported']}, ошибок {stats['error_count']}"
+        )
+        if stats['imported']:
+            flash(f"Зарегистрировано писем: {stats['imported']}", 'success')
+        elif stats['errors']:
+            flash('Ничего не записано: в файле есть ошибки', 'danger')
+
+    return render_template('admin/import_incoming.html', stats=stats)
+
+
+@admin_bp.route('/import/incoming/<int:job_id>')
+@login_required
+@admin_required
+def import_job(job_id):
+    job = ImportJob.query.get_or_404(job_id)
+    stats = job.stats if job.status == 'done' else None
+    return render_template('admin/import_incoming.html', stats=stats, job=job)
+
+
 @admin_bp.route('/outgoing')
 @login_required
 @admin_required
 def all_outgoing():
-    letters = LetterOutgoing.query.order_by(LetterOutgoing.date_created.desc()).all()
-    return render_template('admin/outgoing_all.html', letters=letters)
+    # Строки подгружает страница из all_outgoing_data — здесь только фильтры
+    _, search_params = filter_outgoing(LetterOutgoing.query, request.args)
+    return render_template('admin/outgoing_all.html', search_params=search_params)
+
+
+@admin_bp.route('/outgoing/data')
+@login_required
+@admin_required
+def all_outgoing_data():
+    """JSON-порция «всех исходящих»: keyset-курсор + те же фильтры, что у списка."""
+    per_page = max(1, min(request.args.get('per_page', 100, type=int), 500))
+
+    # Плоские строки вместо ORM-объектов, чтение через серверный курсор
+    query = (
+        db.session.query(
+            LetterOutgoing.id,
+            LetterOutgoing.number,
+            LetterOutgoing.subject,
+            LetterOutgoing.recipient,
+            LetterOutgoing.date_created,
+            LetterOutgoing.year,
+            LetterOutgoing.sequence_num,
+            User.username,
+        )
+        .outerjoin(User, LetterOutgoing.user_id == User.id)
+        .execution_options(stream_results=True, yield_per=per_page + 1)
+    )
+    query, _ = filter_outgoing(query, request.args)
+
+    page = keyset_paginate(
+        query,
+        (LetterOutgoing.year, LetterOutgoing.sequence_num),
+        cursor=request.args.get('cursor'),
+        per_page=per_page
+    )
+
+    return jsonify({
+        'items': [
+            {
+                'id': row.id,
+                'author': row.username,
+                'number': row.number,
+                'subject': row.subject,
+                'recipient': row.recipient,
+                'date': row.date_created.strftime('%Y-%m-%d') if row.date_created else '',
+                'edit_url': url_for('outgoing.edit_outgoing', letter_id=row.id),
+                'attachments_url': url_for('outgoing.attachments', letter_id=row.id),
+            }
+            for row in page.items
+        ],
+        'next_cursor': page.next_cursor,
+    })
 
 
 # Блокировка пользователей 
@@ -0,0 +1,85 @@
+from flask import Blueprint, abort, flash, jsonify, redirect, render_template, request, send_file, url_for
+from flask_login import current_user, login_required
+
+from app.exports import EXPORT_KINDS, EXPORT_MIMETYPES
+from app.jobs import start_export
+from app.models import ExportJob
+
+
+exports_bp = Blueprint('exports', __name__, template_folder='../templates/exports')
+
+
+def get_job_or_404(job_id):
+    """Задание видит только его автор (и админ)."""
+    job = ExportJob.query.get_or_404(job_id)
+    if job.user_id != current_user.id and not current_user.is_admin:
+        abort(404)
+    return job
+
+
+@exports_bp.route('/')
+@login_required
+def list_exports():
+    jobs = (
+        ExportJob.query.filter_by(user_id=current_user.id)
+        .order_by(ExportJob.created_at.desc())
+        .limit(20)
+        .all()
+    )
+    return render_template(
+        'exports/list.html',
+        jobs=jobs,
+        has_active=any(job.is_active for job in jobs)
+    )
+
+
+@exports_bp.route('/<kind>', methods=['POST'])
+@login_required
+def start(kind):
+    if kind not in EXPORT_KINDS:
+        abort(404)
+
+    export_format = request.form.get('format')
+    if export_format not in EXPORT_MIMETYPES:
+        export_format = 'xlsx'
+
+    job = start_export(kind, export_format, request.form, current_user)
+    if job is None:
+        flash('⏳ Сейчас выполняется слишком много выгрузок. Попробуйте чуть позже.', 'warning')
+        return redirect(request.referrer or url_for('exports.list_exports'))
+
+    flash('📦 Выгрузка запущена. Файл появится здесь, когда будет готов.', 'info')
+    return redirect(url_for('exports.list_exports'))
+
+
+@exports_bp.route('/<int:job_id>/status')
+@login_required
+def status(job_id):
+    job = get_job_or_404(job_id)
+    return jsonify({
+        'id': job.id,
+        'status': job.status,
+        'progress': job.progress,
+        'processed_rows': job.processed_rows,
+        'total_rows': job.total_rows,
+        'error': job.error,
+        'download_url': url_for('exports.download', job_id=job.id) if job.status == 'done' else None,
+    })
+
+
+@exports_bp.route('/<int:job_id>/download')
+@login_required
+def download(job_id):
+    job = get_job_or_404(job_id)
+    if job.status != 'done':
+        abort(404)
+
+    try:
+        return send_file(
+            job.file_path,
+            as_attachment=True,
+            download_name=job.download_name,
+            mimetype=EXPORT_MIMETYPES[job.export_format]
+        )
+    except FileNotFoundError:
+        abort(404)
@@ -1,23 +1,25 @@
 from flask import (
     Blueprint, render_template, redirect,
-    url_for, request, flash, send_file, current_app
+    url_for, request, flash, current_app
 )
 from flask import session
 from sqlalchemy import func
-import os
 import datetime
-import uuid
 
-from werkzeug.utils import secure_filename
 from flask_login import login_required, current_user
 
 from app import db
 from app.models import LetterIncoming, Attachment
 from app.forms import IncomingForm
-from app.utils import generate_incoming_number, save_attachment, transliterate, allowed_file
+from app.utils import save_attachments, sort_uploads
 from app.decorators import admin_required
-import uuid
-from app.utils import transliterate, allowed_file
+from app.storage import release_attachment_file
+from app.downloads import send_attachment
+from app.uploads import accepts_uploads
+from app.pagination import keyset_paginate
+from app.queries import attachment_stats, filter_incoming, visible_incoming
+from app.exports import export_response
+from app.archives import attachment_rows, zip_response
 
 
 
@@ -34,12 +36,9 @@ def new_incoming():
 
     form = IncomingForm()
     if form.validate_on_submit():
-        db_number, fs_number = generate_incoming_number()
+        # 🔢 Номер, год и порядковый номер выдаются из счётчика при сохранении
         letter = LetterIncoming(
             user_id=current_user.id,
-            number=db_number,
-            sequence_num=int(db_number.split('-')[1].split('/')[0]),
-            year=int(db_number.split('/')[1]),
             organization=form.organization.data,
             subject=form.subject.data,
             forwarded_to=form.forwarded_to.data,
@@ -47,7 +46,7 @@ def new_incoming():
         )
         db.session.add(letter)
         db.session.commit()
-        flash(f'Входящее письмо {db_number} создано.', 'success')
+        flash(f'Входящее письмо {letter.number} создано.', 'success')
         return redirect(url_for('incoming.attachments', letter_id=letter.id))
 
     return render_template('incoming/new.html', form=form)
@@ -55,6 +54,7 @@ def new_incoming():
 
 
 @incoming_bp.route('/<int:letter_id>/attachments', methods=['GET', 'POST'])
+@accepts_uploads
 @login_required
 def attachments(letter_id):
     letter = LetterIncoming.query.get_or_404(letter_id)
@@ -64,114 +64,51 @@ def attachments(letter_id):
         flash('У вас нет прав для работы с этим письмом.', 'danger')
         return redirect(url_for('incoming.list_incoming'))
 
-    # Обработка загрузки файла
-    if request.method == 'POST':
-        if 'file' not in request.files:
-            flash('Файл не выбран', 'warning')
-            return redirect(url_for('incoming.attachments', letter_id=letter.id))
-
-        file = request.files['file']
-        
-        # Проверка размера файла
-        if file.content_length > current_app.config['MAX_CONTENT_LENGTH']:
-            flash('Файл слишком большой. Максимальный размер 50 МБ', 'danger')
-            return redirect(url_for('incoming.attachments', letter_id=letter.id))
-            
-        if file.filename == '':
-            flash('Файл не выбран', 'warning')
-            return redirect(url_for('incoming.attachments', letter_id=letter.id))
-
-        if not allowed_file(file.filename):
-            flash('Недопустимый формат файла', 'danger')
-            return redirect(url_for('incoming.attachments', letter_id=letter.id))
+    # 📥 Скачивание вложения
+    download_id = request.args.get('download')
+    if download_id:
+        attachment = Attachment.query.filter_by(
+            id=download_id,
+            letter_id=letter.id,
+            letter_type='incoming'
+        ).first_or_404()
 
-        # Формируем путь для сохранения
-        now = datetime.datetime.utcnow()
-        user_folder = transliterate(current_user.username)
-        letter_number = letter.number.replace('/', '_')
-        
-        upload_path = os.path.join(
-            current_app.config['UPLOAD_FOLDER'],
-            'incoming',
-            user_folder,
-            str(now.year),
-            f"{now.month:02d}",
-            letter_number
-        )
-        
-        # Создаем папки если их нет
-        os.makedirs(upload_path, exist_ok=True)
-
-        # Генерируем уникальное имя файла
-        original_name = secure_filename(file.filename)
-        unique_name = f"{uuid.uuid4().hex[:8]}_{original_name}"
-        file_path = os.path.join(upload_path, unique_name)
-        
+        # inline — открыть в браузере (PDF), иначе скачать
         try:
-            # Сохраняем файл
-            file.save(file_path)
-            
-            # Сохраняем запись в БД
-            new_attachment = Attachment(
-                letter_id=letter.id,
-                letter_type='incoming',
-                filename=original_name,
-                stored_filename=unique_name,
-                filepath=file_path,
-                uploaded_at=now
-            )
-            db.session.add(new_attachment)
-            db.session.commit()
-            
-            flash(f'Файл "{original_name}" успешно загружен', 'success')
-        except Exception as e:
-            db.session.rollback()
-            current_app.logger.error(f"Ошибка при загрузке файла: {str(e)}")
-            flash('Ошибка при сохранении файла', 'danger')
-
-        return redirect(url_for('incoming.attachments', letter_id=letter.id))
-
-    # Получаем список вложений
-    attachments = Attachment.query.filter_by(
-        letter_id=letter.id,
-        letter_type='incoming'
-    ).order_by(Attachment.uploaded_at.desc()).all()
-
-    return render_template(
-        'incoming/attachments.html',
-        letter=letter,
-        attachments=attachments,
-        allowed_extensions=current_app.config['ALLOWED_EXTENSIONS'],
-        pending_upload=False
-    )
+            return send_attachment(attachment, as_attachment=not request.args.get('inline'))
+        except FileNotFoundError:
+            flash('Файл не найден на сервере.', 'danger')
+            return redirect(url_for('incoming.attachments', letter_id=letter.id))
 
-    # 📤 Загрузка файла с проверкой на дубликаты
+    # 📤 Загрузка файлов (можно несколько за раз) с проверкой на дубликаты
     if request.method == 'POST':
-        if current_user.role.name not in upload_roles:
-            flash('У вас нет прав для загрузки вложений.', 'danger')
-            return redirect(request.url)
-
-        file = request.files.get('file')
-        if not file or file.filename.strip() == "":
+        files = [file for file in request.files.getlist('file') if file.filename.strip()]
+        if not files:
             flash('Файл не выбран.', 'warning')
             return redirect(request.url)
-
-        original_name = file.filename.strip()
-        already = Attachment.query.filter_by(
-            letter_id=letter.id,
-            letter_type='incoming',
-            filename=original_name
-        ).first()
-        
-        if not allowed_file(original_name):
-            flash('Недопустимый формат файла. Разрешены только: PDF, Word, Excel, RAR.', 'danger')
+        if len(files) > current_app.config['MAX_FILES_PER_UPLOAD']:
+            flash(f"За раз можно загрузить не больше {current_app.config['MAX_FILES_PER_UPLOAD']} файлов.", 'warning')
             return redirect(request.url)
 
-        if already and 'force' not in request.form:
+        # 📏 Размер каждого файла проверяется ещё при приёме (MAX_ATTACHMENT_SIZE)
+        accepted, rejected, duplicates = sort_uploads(files, letter, 'incoming', force='force' in request.form)
+        for file in rejected:
+            flash(f'Файл "{file.filename}": недопустимый формат. Разрешены только: PDF, Word, Excel, RAR.', 'danger')
+
+        if accepted:
+            try:
+                for original_name, _ in save_attachments(accepted, letter, 'incoming'):
+                    flash(f'Файл "{original_name}" успешно загружен', 'success')
+            except Exception as e:
+                current_app.logger.error(f"Ошибка при загрузке файлов: {str(e)}")
+                flash('Ошибка при сохранении файлов, ни один не загружен', 'danger')
+
+        if duplicates:
+            for file in duplicates:
+                flash(f'Файл "{file.filename}" уже прикреплён. Нажмите "Загрузить всё равно", чтобы подтвердить.', 'warning')
             attachments = Attachment.query.filter_by(
                 letter_id=letter.id, letter_type='incoming'
             ).all()
-            flash(f'Файл "{original_name}" уже прикреплён. Нажмите "Загрузить всё равно", чтобы подтвердить.', 'warning')
             return render_template(
                 'incoming/attachments.html',
                 letter=letter,
@@ -180,50 +117,20 @@ def attachments(letter_id):
                 allowed_extensions=current_app.config['ALLOWED_EXTENSIONS']
             )
 
-        # 🛡️ Уникализируем имя на диске
-        from app.utils import transliterate
-        safe_name = secure_filename(transliterate(original_name))
-        unique_suffix = uuid.uuid4().hex[:6]
-        name, ext = os.path.splitext(safe_name)
-        safe_name = f"{name}_{unique_suffix}{ext}"
-
-        now = datetime.datetime.utcnow()
-        prefix = "VH"
-        subfolder = f"{prefix}_{letter.id}_{now.year % 100}"
-        folder = os.path.join(
-            current_app.config['UPLOAD_FOLDER'],
-            'incoming',
-            letter.user.username,
-            str(now.year),
-            f"{now.month:02d}",
-            subfolder
-        )
-        os.makedirs(folder, exist_ok=True)
-        path = os.path.join(folder, safe_name)
-        file.save(path)
-
-        new = Attachment(
-            letter_id=letter.id,
-            letter_type='incoming',
-            filename=original_name,
-            stored_filename=safe_name,
-            filepath=path,
-            uploaded_at=now
-        )
-        db.session.add(new)
-        db.session.commit()
-        flash('Вложение добавлено.', 'success')
         return redirect(request.url)
 
-    # 📦 Получение вложений
+    # Получаем список вложений
     attachments = Attachment.query.filter_by(
-        letter_id=letter.id, letter_type='incoming'
-    ).all()
+        letter_id=letter.id,
+        letter_type='incoming'
+    ).order_by(Attachment.uploaded_at.desc()).all()
 
     return render_template(
         'incoming/attachments.html',
         letter=letter,
-        attachments=attachments
+        attachments=attachments,
+        allowed_extensions=current_app.config['ALLOWED_EXTENSIONS'],
+        pending_upload=False
     )
 
 
@@ -238,53 +145,31 @@ def list_incoming():
         per_page = session.get('per_page', 10)
 
     # 📌 Фильтрация
-    query = LetterIncoming.query
-
-    org = request.args.get('organization', '').strip()
-    if org:
-        query = query.filter(LetterIncoming.organization.ilike(f"%{org}%"))
-
-    number = request.args.get('number', '').strip()
-    if number:
-        query = query.filter(LetterIncoming.number.ilike(f"%{number}%"))
-
-    subject = request.args.get('subject', '').strip()
-    if subject:
-        query = query.filter(LetterIncoming.subject.ilike(f"%{subject}%"))
-
-    forwarded_to = request.args.get('forwarded_to', '').strip()
-    if forwarded_to:
-        query = query.filter(LetterIncoming.forwarded_to.ilike(f"%{forwarded_to}%"))
-
-
-    # 📅 Опциональная фильтрация по дате
-    date_from = request.args.get('date_from')
-    date_to = request.args.get('date_to')
-    if date_from:
-        query = query.filter(LetterIncoming.date_received >= date_from)
-    if date_to:
-        query = query.filter(LetterIncoming.date_received <= date_to)
-
-    # 📌 Сортировка по номеру (как у тебя было)
-    query = query.order_by(
-        db.text("CAST(SUBSTRING(letter_incoming.number FROM 4 FOR POSITION('/' IN letter_incoming.number) - 4) AS INTEGER) DESC")
-    )
-
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    query, search_params = filter_incoming(LetterIncoming.query, request.args, current_user)
+
+    # 📑 По умолчанию — keyset-пагинация по (year, sequence_num): без OFFSET и COUNT(*).
+    # Старая постраничная навигация остаётся доступной через ?page=N
+    keyset = 'page' not in request.args
+    if keyset:
+        pagination = keyset_paginate(
+            query,
+            (LetterIncoming.year, LetterIncoming.sequence_num),
+            cursor=request.args.get('cursor'),
+            per_page=per_page
+        )
+    else:
+        # 📌 Сортировка по номеру — через индекс (year, sequence_num)
+        query = query.order_by(LetterIncoming.year.desc(), LetterIncoming.sequence_num.desc())
+        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
 
     return render_template(
         'incoming/list.html',
         pagination=pagination,
         letters=pagination.items,
+        attachment_stats=attachment_stats('incoming', pagination.items),
         per_page=per_page,
-        search_params={
-            'organization': org,
-            'number': number,
-            'subject': subject,
-            'forwarded_to': forwarded_to,
-            'date_from': date_from,
-            'date_to': date_to
-        }
+        keyset=keyset,
+        search_params=search_params
     )
 
 @incoming_bp.route('/<int:letter_id>/edit', methods=['GET', 'POST'])
@@ -337,12 +222,8 @@ def delete_attachment(letter_id, attachment_id):
         letter_type='incoming'
     ).first_or_404()
 
-    # 🗑️ Удаляем файл с диска
-    try:
-        if os.path.exists(attachment.filepath):
-            os.remove(attachment.filepath)
-    except Exception as e:
-        flash(f'Не удалось удалить файл: {e}', 'warning')
+    # 🗑️ Освобождаем файл: с диска он уйдёт вместе с последней ссылкой
+    release_attachment_file(attachment)
 
     # ❌ Удаляем запись из БД
     db.session.delete(attachment)
@@ -367,72 +248,28 @@ def delete_incoming_letter(letter_id):
 @incoming_bp.route('/export')
 @login_required
 def export_incoming():
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, Alignment
-    from io import BytesIO
-
-    # 🔍 Фильтрация по параметрам запроса
-    query = LetterIncoming.query
+    # 🔍 Фильтрация по параметрам запроса — те же фильтры, что и у списка
+    return export_response('incoming', request.args.get('format'), request.args, current_user.id)
 
-    number = request.args.get('number', '').strip()
-    if number:
-        query = query.filter(LetterIncoming.number.ilike(f"%{number}%"))
 
-    organization = request.args.get('organization', '').strip()
-    if organization:
-        query = query.filter(LetterIncoming.organization.ilike(f"%{organization}%"))
+# 🗜️ Все вложения одного письма одним ZIP-архивом
+@incoming_bp.route('/<int:letter_id>/attachments.zip')
+@login_required
+def attachments_zip(letter_id):
+    letter = LetterIncoming.query.get_or_404(letter_id)
+    query = visible_incoming(LetterIncoming.query.filter_by(id=letter.id), current_user)
+    if query.first() is None:
+        flash('⛔ Вам не разрешён доступ к вложениям этого письма.', 'danger')
+        return redirect(url_for('incoming.list_incoming'))
 
-    date_from = request.args.get('date_from')
-    if date_from:
-        query = query.filter(LetterIncoming.date_received >= date_from)
+    download_name = f"{(letter.number or str(letter.id)).replace('/', '_')}.zip"
+    return zip_response(attachment_rows(LetterIncoming, 'incoming', query), download_name)
 
-    date_to = request.args.get('date_to')
-    if date_to:
-        query = query.filter(LetterIncoming.date_received <= date_to)
 
-    query = query.order_by(
-        db.text("CAST(SUBSTRING(letter_incoming.number FROM 4 FOR POSITION('/' IN letter_incoming.number) - 4) AS INTEGER) DESC")
-    )
-    letters = query.all()
-
-
-    # 📋 Создаём Excel-файл
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Входящие письма'
-
-    headers = ['Номер', 'Организация', 'Тема', 'Направлено', 'Дата получения']
-    ws.append(headers)
-
-    # 💎 Формат заголовков
-    for cell in ws[1]:
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal='center')
-
-    # 📦 Заполняем строки
-    for letter in letters:
-        ws.append([
-            letter.number,
-            letter.organization,
-            letter.subject,
-            letter.forwarded_to,
-            letter.date_received.strftime('%Y-%m-%d')
-        ])
-
-    # 📏 Автоширина
-    for column_cells in ws.columns:
-        max_length = max(len(str(cell.value)) if cell.value else 0 for cell in column_cells)
-        ws.column_dimensions[column_cells[0].column_letter].width = max_length + 4
-
-    # 🎯 Сохраняем файл в память
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-
-    filename = f"Входящие_{datetime.datetime.utcnow().strftime('%Y-%m-%d')}.xlsx"
-    return send_file(
-        output,
-        download_name=filename,
-        as_attachment=True,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
+# 🗜️ Вложения всех писем, подходящих под фильтры списка
+@incoming_bp.route('/attachments.zip')
+@login_required
+def filtered_attachments_zip():
+    query, _ = filter_incoming(visible_incoming(LetterIncoming.query, current_user), request.args)
+    download_name = f"Вложения_входящие_{datetime.datetime.utcnow().strftime('%Y-%m-%d')}.zip"
+    return zip_response(attachment_rows(LetterIncoming, 'incoming', query), download_name)
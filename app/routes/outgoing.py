@@ -1,14 +1,20 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash
-from flask import send_file
+from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app
 from flask import session
-import os
 import datetime
 from flask_login import login_required, current_user
+from sqlalchemy.orm import joinedload
 from app import db
 from app.models import LetterOutgoing, Attachment
 from app.forms import OutgoingForm
-from app.utils import generate_outgoing_number, save_attachment, allowed_file
+from app.utils import save_attachments, sort_uploads
 from app.decorators import admin_required
+from app.storage import release_attachment_file
+from app.downloads import send_attachment
+from app.uploads import accepts_uploads
+from app.pagination import keyset_paginate
+from app.queries import attachment_stats, filter_outgoing, visible_outgoing
+from app.exports import export_response
+from app.archives import attachment_rows, zip_response
 
 
 
@@ -20,22 +26,22 @@ outgoing_bp = Blueprint('outgoing', __name__, template_folder='../templates/outg
 def new_outgoing():
     form = OutgoingForm()
     if form.validate_on_submit():
-        number = generate_outgoing_number()
+        # 🔢 Номер, год и порядковый номер выдаются из счётчика при сохранении
         letter = LetterOutgoing(
             user_id=current_user.id,
-            number=number,
             subject=form.subject.data,
             recipient=form.recipient.data,
             is_protected=form.is_protected.data
         )
         db.session.add(letter)
         db.session.commit()
-        flash(f'Исходящее письмо {number} создано.', 'success')
+        flash(f'Исходящее письмо {letter.number} создано.', 'success')
         return redirect(url_for('outgoing.attachments', letter_id=letter.id))
     return render_template('outgoing/new.html', form=form)
 
 
 @outgoing_bp.route('/<int:letter_id>/attachments', methods=['GET', 'POST'])
+@accepts_uploads
 @login_required
 def attachments(letter_id):
     letter = LetterOutgoing.query.get_or_404(letter_id)
@@ -68,40 +74,42 @@ def attachments(letter_id):
             letter_type='outgoing'
         ).first_or_404()
 
-        if not os.path.exists(attachment.filepath):
+        # inline — открыть в браузере (PDF), иначе скачать
+        try:
+            return send_attachment(attachment, as_attachment=not request.args.get('inline'))
+        except FileNotFoundError:
             flash('Файл не найден на сервере.', 'danger')
             return redirect(url_for('outgoing.attachments', letter_id=letter.id))
 
-        return send_file(
-            attachment.filepath,
-            as_attachment=True,
-            download_name=attachment.filename,
-            mimetype='application/octet-stream'
-        )
-
-    # 📤 Загрузка нового файла с проверкой на дубликаты
+    # 📤 Загрузка файлов (можно несколько за раз) с проверкой на дубликаты
     if request.method == 'POST':
-        file = request.files.get('file')
-        if not file or file.filename.strip() == "":
+        files = [file for file in request.files.getlist('file') if file.filename.strip()]
+        if not files:
             flash('Файл не выбран.', 'warning')
             return redirect(request.url)
-
-        original_name = file.filename.strip()
-        already = Attachment.query.filter_by(
-            letter_id=letter.id,
-            letter_type='outgoing',
-            filename=original_name
-        ).first()
-
-        if not allowed_file(original_name):
-            flash('Недопустимый формат файла. Разрешены только: PDF, Word, Excel, RAR.', 'danger')
+        if len(files) > current_app.config['MAX_FILES_PER_UPLOAD']:
+            flash(f"За раз можно загрузить не больше {current_app.config['MAX_FILES_PER_UPLOAD']} файлов.", 'warning')
             return redirect(request.url)
 
-        if already and 'force' not in request.form:
+        # 📏 Размер каждого файла проверяется ещё при приёме (MAX_ATTACHMENT_SIZE)
+        accepted, rejected, duplicates = sort_uploads(files, letter, 'outgoing', force='force' in request.form)
+        for file in rejected:
+            flash(f'Файл "{file.filename}": недопустимый формат. Разрешены только: PDF, Word, Excel, RAR.', 'danger')
+
+        if accepted:
+            try:
+                for original_name, _ in save_attachments(accepted, letter, 'outgoing'):
+                    flash(f'Файл "{original_name}" успешно загружен', 'success')
+            except Exception as e:
+                current_app.logger.error(f"Ошибка при загрузке файлов: {str(e)}")
+                flash('Ошибка при сохранении файлов, ни один не загружен', 'danger')
+
+        if duplicates:
+            for file in duplicates:
+                flash(f'Файл "{file.filename}" уже прикреплён. Нажмите "Загрузить всё равно", чтобы подтвердить.', 'warning')
             attachments = Attachment.query.filter_by(
                 letter_id=letter.id, letter_type='outgoing'
             ).all()
-            flash(f'Файл "{original_name}" уже прикреплён. Нажмите "Загрузить всё равно", чтобы подтвердить.', 'warning')
             return render_template(
                 'outgoing/attachments.html',
                 letter=letter,
@@ -110,8 +118,6 @@ def attachments(letter_id):
                 allowed_extensions=current_app.config['ALLOWED_EXTENSIONS']
             )
 
-        save_attachment(file, letter, 'outgoing')
-        flash('Вложение добавлено.', 'success')
         return redirect(request.url)
 
     # 📋 Получение всех вложений
@@ -136,47 +142,33 @@ def list_outgoing():
         per_page = session.get('outgoing_per_page', 10)
 
     # 🔍 Фильтры
-    query = LetterOutgoing.query
-
-    number = request.args.get('number', '').strip()
-    if number:
-        query = query.filter(LetterOutgoing.number.ilike(f"%{number}%"))
-
-    recipient = request.args.get('recipient', '').strip()
-    if recipient:
-        query = query.filter(LetterOutgoing.recipient.ilike(f"%{recipient}%"))
-
-    date_from = request.args.get('date_from')
-    date_to = request.args.get('date_to')
-    if date_from:
-        query = query.filter(LetterOutgoing.date_created >= date_from)
-    if date_to:
-        query = query.filter(LetterOutgoing.date_created <= date_to)
-
-    subject = request.args.get('subject', '').strip()
-    if subject:
-        query = query.filter(LetterOutgoing.subject.ilike(f"%{subject}%"))
-
-
-    # 📋 Сортировка как у тебя была
-    query = query.order_by(
-        db.text("CAST(SUBSTRING(letter_outgoing.number FROM 3 FOR POSITION('/' IN letter_outgoing.number) - 3) AS INTEGER) DESC")
-    )
-
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    # 👤 Автор нужен в каждой строке — грузим его тем же запросом
+    query = LetterOutgoing.query.options(joinedload(LetterOutgoing.user))
+    query, search_params = filter_outgoing(query, request.args, current_user)
+
+    # 📑 По умолчанию — keyset-пагинация по (year, sequence_num): без OFFSET и COUNT(*).
+    # Старая постраничная навигация остаётся доступной через ?page=N
+    keyset = 'page' not in request.args
+    if keyset:
+        pagination = keyset_paginate(
+            query,
+            (LetterOutgoing.year, LetterOutgoing.sequence_num),
+            cursor=request.args.get('cursor'),
+            per_page=per_page
+        )
+    else:
+        # 📋 Сортировка по номеру — через индекс (year, sequence_num)
+        query = query.order_by(LetterOutgoing.year.desc(), LetterOutgoing.sequence_num.desc())
+        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
 
     return render_template(
         'outgoing/list.html',
         pagination=pagination,
         letters=pagination.items,
+        attachment_stats=attachment_stats('outgoing', pagination.items),
         per_page=per_page,
-        search_params={
-            'number': number,
-            'subject': subject,
-            'recipient': recipient,
-            'date_from': date_from,
-            'date_to': date_to
-        }
+        keyset=keyset,
+        search_params=search_params
     )
 
 
@@ -224,12 +216,8 @@ def delete_attachment(letter_id, attachment_id):
         letter_type='outgoing'
     ).first_or_404()
 
-    # 🧹 Удаление файла с диска
-    try:
-        if os.path.exists(attachment.filepath):
-            os.remove(attachment.filepath)
-    except Exception as e:
-        flash(f'Ошибка при удалении файла: {e}', 'warning')
+    # 🗑️ Освобождаем файл: с диска он уйдёт вместе с последней ссылкой
+    release_attachment_file(attachment)
 
     # ❌ Удаление из БД
     db.session.delete(attachment)
@@ -255,71 +243,27 @@ def delete_outgoing_letter(letter_id):
 @outgoing_bp.route('/export')
 @login_required
 def export_outgoing():
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, Alignment
-    from io import BytesIO
-
-    query = LetterOutgoing.query
-
-    number = request.args.get('number', '').strip()
-    if number:
-        query = query.filter(LetterOutgoing.number.ilike(f"%{number}%"))
-
-    recipient = request.args.get('recipient', '').strip()
-    if recipient:
-        query = query.filter(LetterOutgoing.recipient.ilike(f"%{recipient}%"))
-
-    subject = request.args.get('subject', '').strip()
-    if subject:
-        query = query.filter(LetterOutgoing.subject.ilike(f"%{subject}%"))
+    return export_response('outgoing', request.args.get('format'), request.args, current_user.id)
 
 
-    date_from = request.args.get('date_from')
-    date_to = request.args.get('date_to')
-    if date_from:
-        query = query.filter(LetterOutgoing.date_created >= date_from)
-    if date_to:
-        query = query.filter(LetterOutgoing.date_created <= date_to)
+# 🗜️ Все вложения одного письма одним ZIP-архивом
+@outgoing_bp.route('/<int:letter_id>/attachments.zip')
+@login_required
+def attachments_zip(letter_id):
+    letter = LetterOutgoing.query.get_or_404(letter_id)
+    query = visible_outgoing(LetterOutgoing.query.filter_by(id=letter.id), current_user)
+    if query.first() is None:
+        flash('⛔ Вам не разрешён доступ к вложениям этого письма.', 'danger')
+        return redirect(url_for('outgoing.list_outgoing'))
 
-    
+    download_name = f"{(letter.number or str(letter.id)).replace('/', '_')}.zip"
+    return zip_response(attachment_rows(LetterOutgoing, 'outgoing', query), download_name)
 
-    query = query.order_by(
-        db.text("CAST(SUBSTRING(letter_outgoing.number FROM 3 FOR POSITION('/' IN letter_outgoing.number) - 3) AS INTEGER) DESC")
-    )
 
-    letters = query.all()
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Исходящие'
-
-    headers = ['Номер', 'Тема', 'Получатель', 'Дата']
-    ws.append(headers)
-
-    for cell in ws[1]:
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal='center')
-
-    for letter in letters:
-        ws.append([
-            letter.number,
-            letter.subject,
-            letter.recipient,
-            letter.date_created.strftime('%Y-%m-%d') if letter.date_created else ''
-        ])
-
-    for column_cells in ws.columns:
-        max_length = max(len(str(cell.value)) if cell.value else 0 for cell in column_cells)
-        ws.column_dimensions[column_cells[0].column_letter].width = max_length + 4
-
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-
-    filename = f"Исходящие_{datetime.datetime.utcnow().strftime('%Y-%m-%d')}.xlsx"
-    return send_file(
-        output,
-        download_name=filename,
-        as_attachment=True,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
+# 🗜️ Вложения всех писем, подходящих под фильтры списка
+@outgoing_bp.route('/attachments.zip')
+@login_required
+def filtered_attachments_zip():
+    query, _ = filter_outgoing(visible_outgoing(LetterOutgoing.query, current_user), request.args)
+    download_name = f"Вложения_исходящие_{datetime.datetime.utcnow().strftime('%Y-%m-%d')}.zip"
+    return zip_response(attachment_rows(LetterOutgoing, 'outgoing', query), download_name)
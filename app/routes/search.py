@@ -0,0 +1,24 @@
+from flask import Blueprint, render_template, request
+from flask_login import login_required
+
+from app.search import search_letters
+
+
+search_bp = Blueprint('search', __name__, template_folder='../templates/search')
+
+
+@search_bp.route('/')
+@login_required
+def search():
+    q = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+
+    results = search_letters(q, page=page, per_page=per_page) if q else None
+
+    return render_template(
+        'search/results.html',
+        q=q,
+        results=results,
+        per_page=per_page
+    )
@@ -0,0 +1,101 @@
+from markupsafe import Markup, escape
+from sqlalchemy.sql import text
+
+from app import db
+
+
+# Маркеры подсветки: ts_headline вставляет их вокруг совпадений, а в HTML
+# они превращаются в <mark> уже после экранирования текста письма
+_START, _STOP = '\x02', '\x03'
+_HEADLINE_OPTIONS = f'StartSel={_START}, StopSel={_STOP}, MaxWords=30, MinWords=10, MaxFragments=2'
+
+# Ранжируем все совпадения (их отбирает GIN-индекс по search_vector),
+# а дорогой ts_headline считаем только для строк текущей страницы
+SEARCH_SQL = text(f"""
+    WITH q AS (
+        SELECT websearch_to_tsquery('russian', :q) AS query
+    ),
+    hits AS (
+        SELECT 'incoming' AS kind, l.id, ts_rank_cd(l.search_vector, q.query) AS rank,
+               l.date_received AS letter_date
+        FROM letter_incoming l, q
+        WHERE l.search_vector @@ q.query
+        UNION ALL
+        SELECT 'outgoing' AS kind, l.id, ts_rank_cd(l.search_vector, q.query) AS rank,
+               l.date_created AS letter_date
+        FROM letter_outgoing l, q
+        WHERE l.search_vector @@ q.query
+    ),
+    page AS (
+        SELECT * FROM hits
+        ORDER BY rank DESC, letter_date DESC NULLS LAST, kind, id
+        LIMIT :limit OFFSET :offset
+    )
+    SELECT page.kind, page.id, page.rank, page.letter_date,
+           coalesce(i.number, o.number) AS number,
+           ts_headline('russian', coalesce(i.subject, o.subject, ''), q.query,
+                       '{_HEADLINE_OPTIONS}') AS subject,
+           ts_headline('russian', coalesce(i.organization, o.recipient, ''), q.query,
+                       'StartSel={_START}, StopSel={_STOP}, HighlightAll=true') AS counterpart
+    FROM page
+    CROSS JOIN q
+    LEFT JOIN letter_incoming i ON page.kind = 'incoming' AND i.id = page.id
+    LEFT JOIN letter_outgoing o ON page.kind = 'outgoing' AND o.id = page.id
+    ORDER BY page.rank DESC, page.letter_date DESC NULLS LAST, page.kind, page.id
+""")
+
+
+def highlight(fragment):
+    """Экранирует фрагмент ts_headline и превращает маркеры в <mark>."""
+    html = str(escape(fragment or ''))
+    return Markup(html.replace(_START, '<mark>').replace(_STOP, '</mark>'))
+
+
+class SearchPage:
+    """Страница результатов поиска по обоим реестрам."""
+
+    def __init__(self, hits, page, per_page, has_next):
+        self.items = hits
+        self.page = page
+        self.per_page = per_page
+        self.has_next = has_next
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def prev_num(self):
+        return self.page - 1
+
+    @property
+    def next_num(self):
+        return self.page + 1
+
+
+def search_letters(q, page=1, per_page=20):
+    """
+    Полнотекстовый поиск (russian) по входящим и исходящим письмам.
+    Результаты объединены в один список по убыванию релевантности.
+    """
+    page = max(page, 1)
+    per_page = max(per_page, 1)
+    rows = db.session.execute(SEARCH_SQL, {
+        'q': q,
+        'limit': per_page + 1,
+        'offset': (page - 1) * per_page,
+    }).mappings().all()
+
+    hits = [
+        {
+            'kind': row['kind'],
+            'id': row['id'],
+            'number': row['number'],
+            'date': row['letter_date'],
+            'rank': row['rank'],
+            'subject': highlight(row['subject']),
+            'counterpart': highlight(row['counterpart']),
+        }
+        for row in rows[:per_page]
+    ]
+    return SearchPage(hits, page, per_page, has_next=len(rows) > per_page)
@@ -0,0 +1,362 @@
+import hashlib
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import event, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import db
+from app.compression import maybe_compress
+from app.downloads import attachment_mimetype
+from app.models import Attachment, StoredBlob
+from app.uploads import CHUNK_SIZE, FILE_MODE, staging_folder, store_upload
+
+
+def blob_path(sha256):
+    """uploads/blobs/ab/cd/abcd… — файл хранится один раз на каждое содержимое."""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'blobs', sha256[:2], sha256[2:4], sha256)
+
+
+def hash_file(path):
+    """(размер, sha256) файла, читаем кусками."""
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            size += len(chunk)
+            sha256.update(chunk)
+    return size, sha256.hexdigest()
+
+
+def acquire_blob(sha256, size_bytes):
+    """
+    Добавляет ссылку на содержимое. Строка блокируется (FOR UPDATE), чтобы
+    параллельное удаление последней ссылки не убрало файл из-под нас.
+    Возвращает (блоб, created); created — блоб новый и файл нужно положить на место.
+    """
+    blob = StoredBlob.query.filter_by(sha256=sha256).with_for_update().populate_existing().first()
+    if blob is None:
+        try:
+            with db.session.begin_nested():
+                blob = StoredBlob(sha256=sha256, size_bytes=size_bytes, ref_count=1)
+                db.session.add(blob)
+            return blob, True
+        except IntegrityError:
+            # Тот же файл одновременно загрузил кто-то ещё
+            blob = StoredBlob.query.filter_by(sha256=sha256).with_for_update().populate_existing().one()
+
+    blob.ref_count += 1
+    return blob, False
+
+
+def place_blob(source, sha256, created):
+    """
+    Переносит файл source в хранилище или удаляет его, если такое содержимое уже есть.
+    Положенный файл запоминается в сессии: при откате его убирает discard_placed_blobs.
+    """
+    path = blob_path(sha256)
+    if created or not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(source, FILE_MODE)
+        os.replace(source, path)
+        db.session.info.setdefault('placed_blobs', []).append(path)
+    else:
+        os.remove(source)
+    return path
+
+
+def stage_upload(file):
+    """
+    Доводит загруженный файл до черновика в .staging (и сжимает, если включено ATTACHMENT_COMPRESSION).
+    Возвращает (черновик, размер, sha256, кодек); размер и хэш — несжатого содержимого.
+    В БД не обращается — можно вызывать из рабочих потоков (нужен только контекст приложения).
+    """
+    staged = os.path.join(staging_folder(), f'{uuid.uuid4().hex}.part')
+    size_bytes, sha256 = store_upload(file, staged)
+    try:
+        codec = maybe_compress(staged, current_app.config['ATTACHMENT_COMPRESSION'])
+    except Exception:
+        discard_staged(staged)
+        raise
+    return staged, size_bytes, sha256, codec
+
+
+def store_staged(staged, size_bytes, sha256, codec=None):
+    """
+    Переносит черновик в хранилище и добавляет ссылку на блоб; коммит — за вызывающим.
+    Возвращает (путь, кодек): если такое содержимое уже лежит на диске, кодек — его.
+    """
+    try:
+        blob, created = acquire_blob(sha256, size_bytes)
+        fresh = created or not os.path.exists(blob_path(sha256))
+        if fresh:
+            adopt_codec(blob, codec)
+        return place_blob(staged, sha256, fresh), blob.codec
+    except Exception:
+        discard_staged(staged)
+        raise
+
+
+def adopt_codec(blob, codec):
+    """
+    Кладём файл заново (блоба не было или его файл пропал) — кодек блоба становится нашим.
+    Вложения, которые уже ссылаются на этот блоб, переписываем тоже: кодек один на файл.
+    """
+    if blob.codec != codec:
+        db.session.execute(
+            update(Attachment)
+            .where(Attachment.content_hash == blob.sha256, Attachment.filepath == blob_path(blob.sha256))
+            .values(codec=codec)
+        )
+    blob.codec = codec
+
+
+def discard_staged(staged):
+    if os.path.exists(staged):
+        os.remove(staged)
+
+
+def discard_placed_blobs():
+    """
+    Убирает файлы, положенные в хранилище в этой транзакции. Вызывается перед откатом,
+    пока строки блобов ещё заблокированы и параллельная загрузка не успела положить свой файл.
+    """
+    for path in db.session.info.pop('placed_blobs', []):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def remove_after_commit(path):
+    """
+    Убирает файл с места сразу, а удаляет только после коммита: до тех пор он лежит
+    в .staging. Откатилась транзакция — файл возвращается на место.
+    """
+    aside = os.path.join(staging_folder(), f'{uuid.uuid4().hex}.removed')
+    os.rename(path, aside)
+    db.session.info.setdefault('removed_files', []).append((path, aside))
+
+
+# 🗑️ Файлы удаляем по итогам транзакции, а не когда их отпустили
+@event.listens_for(Session, 'after_commit')
+def remove_released_files(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop('placed_blobs', None)
+    for path, aside in session.info.pop('removed_files', []):
+        try:
+            os.remove(aside)
+            current_app.logger.info(f"Файл удалён: {path}")
+        except FileNotFoundError:
+            pass
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def restore_released_files(session, transaction):
+    # Сюда доходит только откат: после коммита списки уже пусты
+    if transaction.parent is not None:
+        return
+    session.info.pop('placed_blobs', None)
+    for path, aside in session.info.pop('removed_files', []):
+        try:
+            # Пока мы откатывались, тот же файл могли положить заново — тогда оставляем его
+            os.link(aside, path)
+        except FileExistsError:
+            pass
+        os.remove(aside)
+
+
+def release_blob(sha256):
+    """
+    Убирает одну ссылку. Файл уходит вместе с последней — под блокировкой строки,
+    так что новая загрузка того же содержимого дождётся коммита и положит файл заново.
+    """
+    blob = StoredBlob.query.filter_by(sha256=sha256).with_for_update().populate_existing().first()
+    if blob is None:
+        return
+    blob.ref_count -= 1
+    if blob.ref_count > 0:
+        return
+
+    db.session.delete(blob)
+    try:
+        remove_after_commit(blob_path(sha256))
+    except FileNotFoundError:
+        current_app.logger.warning(f"Файл не найден при удалении: {blob_path(sha256)}")
+
+
+def release_attachment_file(attachment):
+    """Освобождает файл вложения: блоб по ссылке, старый файл (до перехода на блобы) — напрямую."""
+    if attachment.content_hash and attachment.filepath == blob_path(attachment.content_hash):
+        release_blob(attachment.content_hash)
+        return
+
+    try:
+        remove_after_commit(attachment.filepath)
+    except (FileNotFoundError, TypeError):
+        current_app.logger.warning(f"Файл не найден при удалении: {attachment.filepath}")
+
+
+def link_blob(source, sha256, created):
+    """
+    Как place_blob, но исходный файл не трогаем: в хранилище появляется жёсткая
+    ссылка на него (копия — если хранилище на другом диске). Старый путь удаляется
+    только после коммита, так что прерванная миграция ничего не теряет.
+    """
+    path = blob_path(sha256)
+    if created or not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.link(source, path)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(source, path)
+    return path
+
+
+def migrate_to_blobs(dry_run=False, batch_size=200, log=print):
+    """
+    Переводит вложения со старой раскладки uploads/{type}/{user}/… на хранилище по содержимому.
+    Повторный запуск безопасен: уже переведённые вложения пропускаются.
+    """
+    stats = {'moved': 0, 'deduplicated': 0, 'missing': 0, 'freed_bytes': 0}
+    seen = set()
+    last_id = 0
+
+    while True:
+        batch = (
+            Attachment.query.filter(Attachment.id > last_id)
+            .order_by(Attachment.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+
+        old_paths = []
+        for attachment in batch:
+            last_id = attachment.id
+            if attachment.content_hash and attachment.filepath == blob_path(attachment.content_hash):
+                continue
+            if not attachment.filepath or not os.path.isfile(attachment.filepath):
+                stats['missing'] += 1
+                log(f'⚠️ Файл вложения #{attachment.id} не найден: {attachment.filepath}')
+                continue
+
+            size_bytes, sha256 = hash_file(attachment.filepath)
+
+            if dry_run:
+                duplicate = sha256 in seen or db.session.get(StoredBlob, sha256) is not None
+                seen.add(sha256)
+            else:
+                blob, created = acquire_blob(sha256, size_bytes)
+                duplicate = not created
+                fresh = created or not os.path.exists(blob_path(sha256))
+                if fresh:
+                    adopt_codec(blob, None)
+                old_paths.append(attachment.filepath)
+                attachment.filepath = link_blob(attachment.filepath, sha256, fresh)
+                attachment.size_bytes = size_bytes
+                attachment.content_hash = sha256
+                attachment.codec = blob.codec
+
+            if duplicate:
+                stats['deduplicated'] += 1
+                stats['freed_bytes'] += size_bytes
+            else:
+                stats['moved'] += 1
+
+        if dry_run:
+            db.session.rollback()
+            continue
+
+        db.session.commit()
+        for path in old_paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    if not dry_run:
+        recount_blob_refs()
+        for letter_type in ('incoming', 'outgoing'):
+            remove_empty_dirs(os.path.join(current_app.config['UPLOAD_FOLDER'], letter_type))
+
+    return stats
+
+
+def scan_file(path):
+    """(размер, sha256) файла или None, если файла нет."""
+    try:
+        return hash_file(path)
+    except (OSError, TypeError):
+        return None
+
+
+def backfill_attachment_metadata(workers=8, batch_size=200, log=print):
+    """
+    Заполняет size_bytes, content_hash и mime_type у вложений, загруженных до появления этих колонок.
+    Файлы читаются в workers потоков: на сетевом диске упираемся в задержки, а не в CPU.
+    Повторный запуск безопасен: берутся только вложения с пустыми полями.
+    """
+    stats = {'updated': 0, 'missing': 0}
+    incomplete = or_(
+        Attachment.size_bytes.is_(None),
+        Attachment.content_hash.is_(None),
+        Attachment.mime_type.is_(None),
+    )
+    last_id = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            batch = (
+                Attachment.query.filter(incomplete, Attachment.id > last_id)
+                .order_by(Attachment.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            to_scan = [a for a in batch if a.size_bytes is None or a.content_hash is None]
+            scanned = dict(zip([a.id for a in to_scan], pool.map(scan_file, [a.filepath for a in to_scan])))
+
+            for attachment in batch:
+                if attachment.mime_type is None:
+                    attachment.mime_type = attachment_mimetype(attachment.filename or '')
+                if attachment.id in scanned:
+                    if scanned[attachment.id] is None:
+                        stats['missing'] += 1
+                        log(f'⚠️ Файл вложения #{attachment.id} не найден: {attachment.filepath}')
+                        continue
+                    attachment.size_bytes, attachment.content_hash = scanned[attachment.id]
+                stats['updated'] += 1
+
+            db.session.commit()
+
+    return stats
+
+
+def recount_blob_refs():
+    """Пересчитывает ref_count по фактическим ссылкам из вложений."""
+    refs = (
+        select(func.count(Attachment.id))
+        .where(Attachment.content_hash == StoredBlob.sha256)
+        .scalar_subquery()
+    )
+    db.session.execute(update(StoredBlob).values(ref_count=refs))
+    db.session.commit()
+
+
+def remove_empty_dirs(root):
+    """Удаляет опустевшие папки старой раскладки (снизу вверх)."""
+    if not os.path.isdir(root):
+        return
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        if not os.listdir(dirpath):
+            os.rmdir(dirpath)
@@ -0,0 +1,93 @@
+import io
+import zipfile
+from xml.etree import ElementTree
+
+from app.compression import open_stored
+
+
+# Больше текста с одного файла не храним: для поиска хватает с запасом
+MAX_TEXT_CHARS = 1_000_000
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def extract_docx(fileobj):
+    """Текст абзацев word/document.xml, потоково — без загрузки всего XML в память."""
+    parts, length = [], 0
+    with zipfile.ZipFile(fileobj) as archive, archive.open('word/document.xml') as xml:
+        paragraph = []
+        for _, element in ElementTree.iterparse(xml):
+            if element.tag == f'{WORD_NS}t' and element.text:
+                paragraph.append(element.text)
+            elif element.tag == f'{WORD_NS}p':
+                if paragraph:
+                    parts.append(''.join(paragraph))
+                    length += len(parts[-1])
+                    paragraph = []
+                element.clear()
+                if length >= MAX_TEXT_CHARS:
+                    break
+    return '\n'.join(parts)
+
+
+def extract_xlsx(fileobj):
+    """Значения ячеек всех листов, строка таблицы — строка текста."""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
+    lines, length = [], 0
+    try:
+        for ws in wb.worksheets:
+            for row in ws.iter_rows(values_only=True):
+                line = ' '.join(str(value) for value in row if value is not None)
+                if line:
+                    lines.append(line)
+                    length += len(line)
+                if length >= MAX_TEXT_CHARS:
+                    return '\n'.join(lines)
+    finally:
+        wb.close()
+    return '\n'.join(lines)
+
+
+def extract_pdf(fileobj):
+    """
+    Текстовый слой PDF постранично. У сканов его нет — получится пустая строка,
+    распознавание (OCR) здесь не делаем.
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(fileobj)
+    pages, length = [], 0
+    for page in reader.pages:
+        page_text = page.extract_text() or ''
+        if page_text:
+            pages.append(page_text)
+            length += len(page_text)
+        if length >= MAX_TEXT_CHARS:
+            break
+    return '\n'.join(pages)
+
+
+# Расширение -> функция(файл) -> текст
+EXTRACTORS = {
+    'pdf': extract_pdf,
+    'docx': extract_docx,
+    'xlsx': extract_xlsx,
+}
+
+
+def extract_text(path, codec, ext):
+    """
+    Текст файла вложения или None, если для такого формата извлечения нет.
+    Вызывается в отдельном процессе (см. pipeline.extract_in_pool), поэтому
+    получает только путь и кодек, а не объект вложения.
+    """
+    extractor = EXTRACTORS.get(ext)
+    if extractor is None:
+        return None
+    with open_stored(path, codec) as f:
+        if codec:
+            # PDF и zip читаются с перемоток по всему файлу, а поток распаковки их не умеет
+            f = io.BytesIO(f.read())
+        return extractor(f)[:MAX_TEXT_CHARS]
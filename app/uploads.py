@@ -0,0 +1,149 @@
+import hashlib
+import os
+import tempfile
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+
+CHUNK_SIZE = 64 * 1024
+
+# Права, с которыми файл создал бы обычный open(): mkstemp даёт 0600, а файлы
+# хранилища должен читать и веб-сервер (X-Accel-Redirect / X-Sendfile).
+# umask читается один раз при импорте — до запуска рабочих потоков.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
+
+def staging_folder():
+    """Черновики загрузок лежат в UPLOAD_FOLDER, чтобы перенос на место был простым rename."""
+    folder = os.path.join(current_app.config['UPLOAD_FOLDER'], '.staging')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+class HashingUpload:
+    """
+    Приёмник файла из multipart-запроса. Werkzeug пишет в него тело файла кусками
+    по мере чтения запроса: данные сразу идут в черновик рядом с конечной папкой,
+    а SHA-256 и размер считаются на лету. Превышение лимита обрывает приём сразу.
+    """
+
+    def __init__(self, folder, max_size=None):
+        fd, self.path = tempfile.mkstemp(dir=folder, suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self.max_size = max_size
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            self.close()
+            raise RequestEntityTooLarge()
+        self._hash.update(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def readline(self, *args):
+        return self._file.readline(*args)
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def move_to(self, dest):
+        """Переносит черновик на постоянное место без копирования данных."""
+        self._file.close()
+        os.replace(self.path, dest)
+        self.path = None
+
+    def close(self):
+        """Закрывает черновик; если он так и не был перенесён — удаляет."""
+        self._file.close()
+        if self.path:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+
+def accepts_uploads(view):
+    """Маршрут принимает файлы: его запросы ограничены MAX_UPLOAD_REQUEST_SIZE, а не MAX_CONTENT_LENGTH."""
+    view.accepts_uploads = True
+    return view
+
+
+class UploadRequest(Request):
+    """Request, который принимает файлы сразу в HashingUpload, минуя временные файлы Werkzeug."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._uploads = []
+
+    @property
+    def max_content_length(self):
+        # Маршрут сопоставлен до чтения тела — лимит выбирается по его view-функции
+        if not current_app:
+            return None
+        view = current_app.view_functions.get(self.endpoint) if self.url_rule else None
+        if getattr(view, 'accepts_uploads', False):
+            return current_app.config['MAX_UPLOAD_REQUEST_SIZE']
+        return current_app.config['MAX_CONTENT_LENGTH']
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        max_size = current_app.config['MAX_ATTACHMENT_SIZE']
+        if content_length is not None and content_length > max_size:
+            raise RequestEntityTooLarge()
+
+        upload = HashingUpload(staging_folder(), max_size)
+        self._uploads.append(upload)
+        return upload
+
+    def close(self):
+        super().close()
+        # Черновики, не попавшие в request.files (запрос оборвался посреди файла)
+        for upload in self._uploads:
+            upload.close()
+
+
+def store_upload(file, path):
+    """
+    Сохраняет загруженный файл по пути path. Возвращает (размер, sha256).
+    Файл, принятый через UploadRequest, просто переносится; любой другой
+    поток копируется кусками с подсчётом хэша.
+    """
+    stream = file.stream
+    if isinstance(stream, HashingUpload):
+        size, digest = stream.size, stream.sha256
+        stream.move_to(path)
+        return size, digest
+
+    max_size = current_app.config['MAX_ATTACHMENT_SIZE']
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, 'wb') as out:
+            while chunk := stream.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise RequestEntityTooLarge()
+                sha256.update(chunk)
+                out.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return size, sha256.hexdigest()
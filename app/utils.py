@@ -1,82 +1,116 @@
-import os, uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from flask import current_app
 from werkzeug.utils import secure_filename
 from app import db
-from app.models import LetterOutgoing, LetterIncoming, Attachment
-import unicodedata
-import re
-from sqlalchemy.sql import text
-
-
-def generate_outgoing_number():
-    """Генерирует следующий номер вида H-{seq}/{YY}."""
-    year = datetime.datetime.now().year % 100
-    seq = (db.session.query(db.func.max(LetterOutgoing.id)).scalar() or 0) + 1
-    return f'H-{seq}/{year}'
-
-
-def generate_incoming_number():
-    now = datetime.utcnow()
-    current_year = now.year % 100
-    
-    # Получаем следующий номер
-    next_num = db.session.execute(
-        text("SELECT nextval('incoming_number_seq')")
-    ).scalar()
-    
-    # Формируем номер (в базе - кириллический)
-    db_number = f"ВХ-{next_num}/{current_year}"
-    
-    # Для файловой системы - латинский вариант
-    fs_number = f"VH-{next_num}/{current_year}"
-    
-    return db_number, fs_number
+from app.models import Attachment
+from app.downloads import attachment_mimetype
+from app.pipeline import enqueue_attachments, new_stages
+from app.storage import discard_placed_blobs, discard_staged, stage_upload, store_staged
+
+
+def new_attachment(filename, letter, letter_type, path, size_bytes, content_hash, codec=None):
+    return Attachment(
+        letter_id=letter.id,
+        letter_type=letter_type,
+        filename=filename,      # то, что отображается пользователю
+        stored_filename=secure_filename(transliterate(filename)),  # безопасное имя (для выгрузок на диск)
+        filepath=path,
+        uploaded_at=datetime.utcnow(),
+        size_bytes=size_bytes,
+        content_hash=content_hash,
+        mime_type=attachment_mimetype(filename),
+        codec=codec,
+        stages=new_stages()
+    )
 
 
 def save_attachment(file, letter, letter_type):
     """
-    Сохраняет файл вложения с транслитерацией имени в:
-    uploads/{type}/{user}/{YYYY}/{MM}/{PREFIX}_{id}_{YY}/
+    Сохраняет файл вложения в хранилище по содержимому (uploads/blobs/…):
+    одинаковые файлы лежат на диске один раз, вложения ссылаются на них по SHA-256.
     """
-    original_filename = file.filename
-    safe_name = secure_filename(transliterate(original_filename))  # транслитерируем
-
-     # 🆎 Уникальный суффикс
-    unique_suffix = uuid.uuid4().hex[:8]
-    name, ext = os.path.splitext(safe_name)
-    safe_name = f"{name}_{unique_suffix}{ext}"
-
-    now = datetime.datetime.now()
-    prefix = 'H' if letter_type == 'outgoing' else 'VH'
-    subdir = f"{prefix}_{letter.id}_{now.year % 100}"
-
-    folder = os.path.join(
-        current_app.config['UPLOAD_FOLDER'],
-        letter_type,
-        letter.user.username,
-        str(now.year),
-        f"{now.month:02d}",
-        subdir
-    )
-    os.makedirs(folder, exist_ok=True)
+    return save_attachments([file], letter, letter_type)[0]
 
-    path = os.path.join(folder, safe_name)
-    file.save(path)
 
-    # Сохраняем запись в БД
-    attach = Attachment(
-        letter_id=letter.id,
-        letter_type=letter_type,
-        filename=original_filename,     # то, что отображается пользователю
-        stored_filename=safe_name,      # безопасное имя на диске
-        filepath=path,
-        uploaded_at=datetime.datetime.utcnow()
-    )
-    db.session.add(attach)
-    db.session.commit()
+def stage_files(files):
+    """
+    Черновики нескольких файлов параллельно, не больше UPLOAD_WORKERS потоков.
+    Если хоть один файл не удался — убираем все черновики и пробрасываем ошибку.
+    """
+    if len(files) == 1:
+        return [stage_upload(files[0])]
+
+    app = current_app._get_current_object()
+
+    def stage(file):
+        with app.app_context():
+            return stage_upload(file)
+
+    workers = min(len(files), app.config['UPLOAD_WORKERS'])
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(stage, file) for file in files]
+
+    staged, error = [], None
+    for future in futures:
+        try:
+            staged.append(future.result())
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        for path, *_ in staged:
+            discard_staged(path)
+        raise error
+    return staged
+
+
+def sort_uploads(files, letter, letter_type, force=False):
+    """
+    Разбирает файлы из формы на (к загрузке, недопустимого формата, уже прикреплённые).
+    Уже прикреплённые имена грузятся только с подтверждением (force).
+    """
+    existing = {
+        name for (name,) in db.session.query(Attachment.filename)
+        .filter_by(letter_id=letter.id, letter_type=letter_type)
+    }
+    accepted, rejected, duplicates = [], [], []
+    for file in files:
+        if not allowed_file(file.filename):
+            rejected.append(file)
+        elif file.filename in existing and not force:
+            duplicates.append(file)
+        else:
+            accepted.append(file)
+    return accepted, rejected, duplicates
+
+
+def save_attachments(files, letter, letter_type):
+    """
+    Сохраняет сразу несколько вложений: файлы пишутся на диск параллельно,
+    строки Attachment добавляются одной транзакцией — либо все, либо ни одной.
+    Возвращает [(исходное имя, путь)] в порядке files.
+    """
+    staged = stage_files(files)
+    saved, attachments = [], []
+    try:
+        for file, (staged_path, size_bytes, content_hash, codec) in zip(files, staged):
+            path, codec = store_staged(staged_path, size_bytes, content_hash, codec)
+            attachment = new_attachment(file.filename, letter, letter_type, path, size_bytes, content_hash, codec)
+            db.session.add(attachment)
+            saved.append((file.filename, path))
+            attachments.append(attachment)
+        db.session.commit()
+    except Exception:
+        # Новые блобы убираем до отката: строки ещё под нашей блокировкой
+        discard_placed_blobs()
+        db.session.rollback()
+        for staged_path, *_ in staged:
+            discard_staged(staged_path)
+        raise
 
-    return original_filename, path
+    # ⚙️ Хэш, проверка типа и извлечение текста — уже после ответа, в фоне
+    enqueue_attachments([attachment.id for attachment in attachments])
+    return saved
 
 
 def transliterate(text):
@@ -0,0 +1,170 @@
+"""
+Сжатие вложений на диске (ATTACHMENT_COMPRESSION): сколько места экономится
+и сколько CPU стоит мегабайт при записи и при распаковке на скачивании.
+
+По умолчанию — синтетические образцы типичных вложений; --dir берёт реальные файлы
+(например, копию UPLOAD_FOLDER/blobs). zstd измеряется, если установлен zstandard.
+
+    python benchmarks/bench_compression.py --size-mb 8
+    python benchmarks/bench_compression.py --dir /mnt/nas/uploads/blobs --limit 500
+"""
+import argparse
+import os
+import random
+import shutil
+import struct
+import tempfile
+import time
+
+from common import report
+
+from app.compression import COMPRESSION_CODECS, maybe_compress, open_stored, zstd
+
+
+WORDS = ('письмо', 'договор', 'поставка', 'согласно', 'приложение', 'организация', 'директор',
+         'исполнитель', 'сумма', 'рублей', 'срок', 'оплата', 'акт', 'счёт', 'уведомляем')
+
+
+RND = random.Random(1)
+
+
+def russian_text(size):
+    """Текст из случайных слов с номерами и суммами — сжимается примерно как настоящие письма."""
+    words, length = [], 0
+    while length < size:
+        word = RND.choice(WORDS) if RND.random() < 0.8 else str(RND.randint(1, 10**6))
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words).encode('cp1251')[:size]
+
+
+def sample_doc(size):
+    """Word 97-2003: OLE-контейнер, текст в cp1251 и много пустых секторов."""
+    body = bytearray(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1' + b'\x00' * 504)
+    while len(body) < size:
+        body += russian_text(3072) + b'\x00' * 1024
+    return bytes(body[:size])
+
+
+def sample_xls(size):
+    """Excel 97-2003: BIFF-записи с числами и датами."""
+    body = bytearray(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1' + b'\x00' * 504)
+    row = 0
+    while len(body) < size:
+        for col in range(8):
+            body += struct.pack('<HHHHHd', 0x0203, 14, row, col, 15, round(RND.uniform(0, 1e6), 2))
+        row += 1
+    return bytes(body[:size])
+
+
+def sample_pdf_text(size):
+    """PDF из текстового редактора с несжатыми потоками содержимого."""
+    body = bytearray(b'%PDF-1.4\n')
+    n = 1
+    while len(body) < size:
+        text = russian_text(2000).decode('cp1251').encode('utf-16-be').hex().encode()
+        body += b'%d 0 obj << /Length %d >> stream\nBT /F1 11 Tf 72 720 Td <' % (n, len(text)) + text + b'> Tj ET\nendstream endobj\n'
+        n += 1
+    return bytes(body[:size])
+
+
+def sample_pdf_scan(size):
+    """Скан: JPEG-картинки внутри PDF — почти не сжимается."""
+    return b'%PDF-1.5\n' + os.urandom(size - 9)
+
+
+def sample_docx(size):
+    """docx/xlsx — это zip: пропускается по сигнатуре."""
+    return b'PK\x03\x04' + os.urandom(size - 4)
+
+
+SAMPLES = (
+    ('doc', sample_doc),
+    ('xls', sample_xls),
+    ('pdf (текст)', sample_pdf_text),
+    ('pdf (скан)', sample_pdf_scan),
+    ('docx', sample_docx),
+)
+
+
+def available_codecs():
+    codecs = []
+    for codec in COMPRESSION_CODECS:
+        try:
+            if codec == 'zstd':
+                zstd()
+            codecs.append(codec)
+        except RuntimeError:
+            print(f'⚠️ {codec}: не установлен, пропускаем')
+    return codecs
+
+
+def measure(files, codec, workdir):
+    """(исходно байт, на диске байт, CPU-мс на МБ при сжатии, CPU-мс на МБ при распаковке)."""
+    original = stored = 0
+    pack_cpu = unpack_cpu = 0.0
+    for source in files:
+        path = os.path.join(workdir, 'blob')
+        shutil.copyfile(source, path)
+        size = os.path.getsize(path)
+
+        start = time.process_time()
+        used = maybe_compress(path, codec)
+        pack_cpu += time.process_time() - start
+
+        start = time.process_time()
+        with open_stored(path, used) as f:
+            while f.read(64 * 1024):
+                pass
+        unpack_cpu += time.process_time() - start
+
+        original += size
+        stored += os.path.getsize(path)
+
+    mb = original / 2**20
+    return original, stored, pack_cpu * 1000 / mb, unpack_cpu * 1000 / mb
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=float, default=8, help='размер каждого синтетического образца')
+    parser.add_argument('--dir', help='папка с реальными файлами вместо синтетики')
+    parser.add_argument('--limit', type=int, default=1000, help='сколько файлов взять из --dir')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_compression_')
+    try:
+        if args.dir:
+            paths = []
+            for dirpath, _, filenames in os.walk(args.dir):
+                paths += [os.path.join(dirpath, name) for name in filenames]
+            groups = [(f'{args.dir} ({len(paths[:args.limit])} файлов)', paths[:args.limit])]
+        else:
+            size = int(args.size_mb * 2**20)
+            groups = []
+            for name, make in SAMPLES:
+                path = os.path.join(workdir, f'{len(groups)}.sample')
+                with open(path, 'wb') as f:
+                    f.write(make(size))
+                groups.append((name, [path]))
+
+        for codec in available_codecs():
+            rows = []
+            total_original = total_stored = 0
+            for name, files in groups:
+                original, stored, pack, unpack = measure(files, codec, workdir)
+                total_original += original
+                total_stored += stored
+                rows.append((name, (
+                    f'{original / 2**20:8.1f} МБ -> {stored / 2**20:8.1f} МБ '
+                    f'(экономия {100 * (1 - stored / original):5.1f}%)   '
+                    f'сжатие {pack:7.1f} CPU-мс/МБ   распаковка {unpack:6.1f} CPU-мс/МБ'
+                )))
+            rows.append(('итого', f'экономия {100 * (1 - total_stored / total_original):5.1f}%'))
+            report(f'ATTACHMENT_COMPRESSION={codec}', rows)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Занятость Python-воркеров при параллельных скачиваниях вложений:
+ATTACHMENT_DOWNLOAD_MODE=python (send_file, байты гонит воркер) против
+x-accel (воркер отдаёт только заголовки, файл передаёт nginx).
+
+Клиенты читают ответ с ограниченной скоростью — как через медленный офисный канал.
+Занятость воркера — время от входа в WSGI-приложение до закрытия тела ответа.
+Сам nginx здесь не запускается: в режиме x-accel измеряется то, что остаётся на Python.
+
+    python benchmarks/bench_download_occupancy.py --size-mb 50 --clients 8 --rate-mb 10
+"""
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from common import report
+
+
+def serve(mode, upload_folder, file_path, port_queue):
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    from flask import jsonify
+    from werkzeug.serving import make_server
+    from werkzeug.wsgi import ClosingIterator
+
+    from app import create_app
+    from app.downloads import send_attachment
+
+    app = create_app()
+    app.config.update(UPLOAD_FOLDER=upload_folder, ATTACHMENT_DOWNLOAD_MODE=mode)
+    attachment = SimpleNamespace(
+        filepath=file_path, filename='Скан договора.pdf',
+        content_hash=None, uploaded_at=None, mime_type=None, codec=None
+    )
+
+    busy = []
+    active = {'now': 0, 'peak': 0}
+    lock = threading.Lock()
+
+    @app.route('/bench/download')
+    def bench_download():
+        return send_attachment(attachment)
+
+    @app.route('/bench/stats')
+    def bench_stats():
+        return jsonify(busy=busy, peak=active['peak'])
+
+    wsgi_app = app.wsgi_app
+
+    def occupancy(environ, start_response):
+        if environ['PATH_INFO'] != '/bench/download':
+            return wsgi_app(environ, start_response)
+
+        start = time.perf_counter()
+        with lock:
+            active['now'] += 1
+            active['peak'] = max(active['peak'], active['now'])
+
+        def done():
+            with lock:
+                active['now'] -= 1
+                busy.append(time.perf_counter() - start)
+
+        return ClosingIterator(wsgi_app(environ, start_response), [done])
+
+    app.wsgi_app = occupancy
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def slow_download(port, rate):
+    """Скачивает файл, читая не быстрее rate байт/с."""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+    conn.request('GET', '/bench/download')
+    response = conn.getresponse()
+    chunk = 64 * 1024
+    received = 0
+    start = time.perf_counter()
+    while data := response.read(chunk):
+        received += len(data)
+        delay = received / rate - (time.perf_counter() - start)
+        if delay > 0:
+            time.sleep(delay)
+    conn.close()
+    return received
+
+
+def run_mode(mode, file_path, upload_folder, clients, rate):
+    ctx = multiprocessing.get_context('spawn')
+    port_queue = ctx.Queue()
+    server = ctx.Process(target=serve, args=(mode, upload_folder, file_path, port_queue), daemon=True)
+    server.start()
+    port = port_queue.get()
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            list(pool.map(lambda _: slow_download(port, rate), range(clients)))
+        elapsed = time.perf_counter() - start
+
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request('GET', '/bench/stats')
+        stats = json.loads(conn.getresponse().read())
+    finally:
+        server.terminate()
+        server.join()
+
+    return elapsed, stats['busy'], stats['peak']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=50)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--rate-mb', type=float, default=10, help='скорость одного клиента, МБ/с')
+    args = parser.parse_args()
+
+    upload_folder = tempfile.mkdtemp(prefix='bench_download_')
+    file_path = os.path.join(upload_folder, 'blob.pdf')
+    with open(file_path, 'wb') as f:
+        f.write(os.urandom(args.size_mb * 2**20))
+
+    results = []
+    try:
+        for mode in ('python', 'x-accel'):
+            elapsed, busy, peak = run_mode(mode, file_path, upload_folder, args.clients, args.rate_mb * 2**20)
+            results.append((mode, (
+                f'воркер занят на скачивание: медиана {statistics.median(busy) * 1000:9.1f} мс   '
+                f'всего {sum(busy):7.2f} воркер-с   пик одновременно {peak}   стена {elapsed:6.1f} с'
+            )))
+    finally:
+        shutil.rmtree(upload_folder, ignore_errors=True)
+
+    report(f'{args.clients} клиентов качают по {args.size_mb} МБ со скоростью {args.rate_mb} МБ/с', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Память и время выгрузки в Excel: прежний способ (ORM-объекты + обычная книга
++ автоширина по всем ячейкам + BytesIO) против write_only-книги из app/exports.py.
+Каждый вариант запускается в отдельном процессе, чтобы пики не смешивались.
+
+    BENCH_DATABASE_URL=postgresql://.../mail_bench python benchmarks/bench_export_memory.py --rows 200000
+"""
+import argparse
+import multiprocessing
+import resource
+import tempfile
+import time
+
+from common import bench_app, fill_letters, report, reset_schema
+
+
+def legacy_export(db):
+    from io import BytesIO
+    from openpyxl import Workbook
+    from openpyxl.styles import Alignment, Font
+    from app.models import LetterIncoming
+
+    letters = LetterIncoming.query.order_by(
+        LetterIncoming.year.desc(), LetterIncoming.sequence_num.desc()
+    ).all()
+
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['Номер', 'Организация', 'Тема', 'Направлено', 'Дата получения'])
+    for cell in ws[1]:
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center')
+    for letter in letters:
+        ws.append([letter.number, letter.organization, letter.subject, letter.forwarded_to,
+                   letter.date_received.strftime('%Y-%m-%d')])
+    for column_cells in ws.columns:
+        max_length = max(len(str(cell.value)) if cell.value else 0 for cell in column_cells)
+        ws.column_dimensions[column_cells[0].column_letter].width = max_length + 4
+
+    output = BytesIO()
+    wb.save(output)
+    return output.tell()
+
+
+def streaming_export(db):
+    from app.exports import INCOMING_COLUMNS, export_rows, write_xlsx
+    from app.models import LetterIncoming
+
+    query = LetterIncoming.query.order_by(
+        LetterIncoming.year.desc(), LetterIncoming.sequence_num.desc()
+    )
+    with tempfile.TemporaryFile() as output:
+        write_xlsx(output, [h for h, _ in INCOMING_COLUMNS], export_rows(query, INCOMING_COLUMNS), 'bench')
+        return output.tell()
+
+
+def run_variant(name, queue):
+    app = bench_app()
+    from app import db
+
+    with app.app_context():
+        baseline_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        start = time.perf_counter()
+        size = {'legacy': legacy_export, 'streaming': streaming_export}[name](db)
+        elapsed = time.perf_counter() - start
+    maxrss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put((name, elapsed, maxrss_mb - baseline_mb, maxrss_mb, size / 2**20))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200_000)
+    args = parser.parse_args()
+
+    app = bench_app()
+    from app import db
+
+    with app.app_context():
+        user = reset_schema(db)
+        fill_letters(db, args.rows, user.id)
+
+    results = []
+    ctx = multiprocessing.get_context('spawn')
+    for name in ('streaming', 'legacy'):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run_variant, args=(name, queue))
+        proc.start()
+        name, elapsed, growth, maxrss, size = queue.get()
+        proc.join()
+        results.append((name, f'{elapsed:7.1f} с   прирост RSS {growth:8.1f} МБ   пик RSS {maxrss:8.1f} МБ   файл {size:6.1f} МБ'))
+
+    report(f'Выгрузка {args.rows} входящих писем в xlsx', results)
+
+
+if __name__ == '__main__':
+    main()
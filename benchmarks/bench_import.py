@@ -0,0 +1,75 @@
+"""
+Массовый импорт входящих из CSV (app/imports.py): проверка строк в одном процессе
+и в пуле процессов, запись через COPY. Проверяется, что все строки записаны
+и номера каждого года идут 1..N без дублей.
+
+    BENCH_DATABASE_URL=postgresql://.../mail_bench python benchmarks/bench_import.py --rows 100000 --workers 4
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+
+from common import bench_app, report, reset_schema
+
+
+def write_archive(path, rows):
+    """CSV в формате выгрузки входящих: даты за 2019–2024 годы."""
+    rng = random.Random(42)
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(['Организация', 'Тема', 'Направлено', 'Дата получения'])
+        for i in range(rows):
+            writer.writerow([
+                f'ООО «Организация {rng.randrange(5000)}»',
+                f'Письмо о поставке партии №{i} по договору {rng.randrange(10**6)}',
+                f'Отдел {rng.randrange(40)}' if i % 3 else '',
+                f'{rng.randint(2019, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            ])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    app = bench_app()
+    from app import db
+    from app.imports import import_incoming
+
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+    try:
+        write_archive(path, args.rows)
+        results = []
+        # Пул не больше числа ядер (см. validated_chunks) — на одноядерной машине прогоны совпадут
+        for workers in sorted({1, min(args.workers, os.cpu_count() or 1)}):
+            with app.app_context():
+                user = reset_schema(db)
+                start = time.perf_counter()
+                stats = import_incoming(path, user.id, workers=workers, batch_size=args.batch_size)
+                elapsed = time.perf_counter() - start
+
+                count, duplicates = db.session.execute(db.text(
+                    'SELECT count(*), count(*) - count(DISTINCT (year, sequence_num)) FROM letter_incoming'
+                )).one()
+                gaps = db.session.execute(db.text("""
+                    SELECT coalesce(sum(last - letters), 0) FROM (
+                        SELECT max(sequence_num) AS last, count(*) AS letters FROM letter_incoming GROUP BY year
+                    ) AS per_year
+                """)).scalar()
+            assert stats['imported'] == args.rows and not stats['errors'], stats['errors'][:5]
+            assert count == args.rows and duplicates == 0 and gaps == 0, (count, duplicates, gaps)
+            results.append((f'проверка в {workers} проц.', f'{elapsed:6.2f} с   {args.rows / elapsed:8.0f} строк/с'))
+    finally:
+        os.remove(path)
+
+    report(f'Импорт {args.rows} строк CSV, пачка {args.batch_size}', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Латентность первой страницы списка: старая сортировка
+CAST(SUBSTRING(number ...)) против индекса (year, sequence_num).
+
+    BENCH_DATABASE_URL=postgresql://.../mail_bench python benchmarks/bench_list_ordering.py --rows 500000
+"""
+import argparse
+
+from common import bench_app, fill_letters, report, reset_schema, timed
+
+
+OLD_ORDER = {
+    'letter_incoming': "CAST(SUBSTRING(number FROM 4 FOR POSITION('/' IN number) - 4) AS INTEGER) DESC",
+    'letter_outgoing': "CAST(SUBSTRING(number FROM 3 FOR POSITION('/' IN number) - 3) AS INTEGER) DESC",
+}
+NEW_ORDER = 'year DESC, sequence_num DESC'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500_000)
+    parser.add_argument('--per-page', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = bench_app()
+    from app import db
+
+    with app.app_context():
+        user = reset_schema(db)
+        fill_letters(db, args.rows, user.id)
+
+        results = []
+        for table in ('letter_incoming', 'letter_outgoing'):
+            for label, order in (('CAST(SUBSTRING)', OLD_ORDER[table]), ('(year, sequence_num)', NEW_ORDER)):
+                sql = db.text(f'SELECT * FROM {table} ORDER BY {order} LIMIT :limit')
+                ms = timed(lambda: db.session.execute(sql, {'limit': args.per_page}).all(), args.repeat)
+                results.append((f'{table:16} {label:22}', f'{ms:9.2f} мс'))
+
+        report(f'Первая страница ({args.per_page} строк) при {args.rows} письмах в каждом реестре', results)
+
+
+if __name__ == '__main__':
+    main()
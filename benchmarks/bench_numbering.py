@@ -0,0 +1,113 @@
+"""
+Выдача номеров писем при параллельном создании из нескольких процессов:
+прежняя схема исходящих (H-{max(id)+1}) против счётчиков number_counters.
+
+Каждый процесс создаёт --letters писем (пачками по --batch в одной транзакции)
+в обоих журналах. После прогона проверяется, что номера за год — ровно 1..N:
+без дублей и без дыр. Прежняя схема дублирует номера, и такие письма отклоняет
+уникальный индекс — они считаются как ошибки.
+
+    BENCH_DATABASE_URL=postgresql://.../mail_bench python benchmarks/bench_numbering.py --processes 16 --letters 500
+"""
+import argparse
+import multiprocessing
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from common import bench_app, report, reset_schema
+
+
+def create_letters(variant, user_id, letters, batch):
+    """Работа одного процесса: (создано, отклонено, секунд)."""
+    app = bench_app()
+    from app import db
+    from app.models import LetterIncoming, LetterOutgoing
+
+    created = rejected = 0
+    with app.app_context():
+        start = time.perf_counter()
+        for offset in range(0, letters, batch):
+            size = min(batch, letters - offset)
+            if variant == 'legacy':
+                # Как делал generate_outgoing_number: номер = max(id) + 1 до вставки
+                for _ in range(size):
+                    seq = (db.session.query(db.func.max(LetterOutgoing.id)).scalar() or 0) + 1
+                    db.session.add(LetterOutgoing(user_id=user_id, subject='Бенчмарк', recipient='Получатель',
+                                                  number=f'H-{seq}/{datetime.now().year % 100}',
+                                                  sequence_num=seq, year=datetime.now().year % 100))
+                    try:
+                        db.session.commit()
+                        created += 1
+                    except IntegrityError:
+                        db.session.rollback()
+                        rejected += 1
+                continue
+
+            for i in range(size):
+                if (offset + i) % 2:
+                    db.session.add(LetterIncoming(user_id=user_id, organization='Организация', subject='Бенчмарк'))
+                else:
+                    db.session.add(LetterOutgoing(user_id=user_id, subject='Бенчмарк', recipient='Получатель'))
+            db.session.commit()
+            created += size
+        return created, rejected, time.perf_counter() - start
+
+
+def check_numbers(db, model):
+    """(писем, дублей, дыр) среди номеров журнала за текущий год."""
+    numbers = [
+        seq for (seq,) in
+        db.session.query(model.sequence_num).filter(model.year == datetime.now().year % 100)
+    ]
+    unique = set(numbers)
+    gaps = (max(unique) - len(unique)) if unique else 0
+    return len(numbers), len(numbers) - len(unique), gaps
+
+
+def run_variant(variant, args):
+    app = bench_app()
+    from app import db
+    from app.models import LetterIncoming, LetterOutgoing
+
+    with app.app_context():
+        user_id = reset_schema(db).id
+
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(args.processes) as pool:
+        results = pool.starmap(create_letters, [(variant, user_id, args.letters, args.batch)] * args.processes)
+
+    # Время — без запуска процессов и create_app: от первого письма до последнего в самом медленном
+    elapsed = max(result[2] for result in results)
+    created = sum(result[0] for result in results)
+    rejected = sum(result[1] for result in results)
+    with app.app_context():
+        checks = {model.__tablename__: check_numbers(db, model) for model in (LetterIncoming, LetterOutgoing)}
+    return created, rejected, elapsed, checks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--letters', type=int, default=500, help='Писем на процесс.')
+    parser.add_argument('--batch', type=int, default=1, help='Писем в одной транзакции (для счётчиков).')
+    args = parser.parse_args()
+
+    rows, failures = [], []
+    for variant in ('legacy', 'counters'):
+        created, rejected, elapsed, checks = run_variant(variant, args)
+        rows.append((variant, f'{created / elapsed:8.0f} писем/с   создано {created}, отклонено {rejected}'))
+        for table, (count, duplicates, gaps) in checks.items():
+            rows.append((f'  {table}', f'{count} номеров, дублей {duplicates}, дыр {gaps}'))
+            if variant == 'counters' and (duplicates or gaps):
+                failures.append(f'{table}: дублей {duplicates}, дыр {gaps}')
+        if variant == 'counters' and created != args.processes * args.letters:
+            failures.append(f'создано {created} из {args.processes * args.letters}')
+
+    report(f'{args.processes} процессов × {args.letters} писем, пачка {args.batch}', rows)
+    assert not failures, '; '.join(failures)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Поиск подстроки по фильтрам реестра: ILIKE без индексов против
+lower(col) LIKE с GIN-индексами pg_trgm.
+
+    BENCH_DATABASE_URL=postgresql://.../mail_bench python benchmarks/bench_search.py --rows 1000000
+"""
+import argparse
+
+from common import bench_app, fill_letters, report, reset_schema, timed
+
+
+# (таблица, поле, поисковая строка — в том регистре, как её вводит пользователь)
+CASES = (
+    ('letter_incoming', 'organization', 'Организация 4217'),
+    ('letter_incoming', 'subject', 'ПОСТАВКЕ ПАРТИИ №77'),
+    ('letter_incoming', 'forwarded_to', 'отдел 3'),
+    ('letter_incoming', 'number', 'ВХ-4999'),
+    ('letter_outgoing', 'recipient', 'получатель 12'),
+    ('letter_outgoing', 'subject', 'запрос №5551'),
+    ('letter_outgoing', 'number', 'H-31337'),
+)
+
+
+def create_trigram_indexes(db):
+    db.session.execute(db.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    for table, column, _ in CASES:
+        db.session.execute(db.text(
+            f'CREATE INDEX IF NOT EXISTS ix_{table}_{column}_trgm '
+            f'ON {table} USING gin (lower({column}) gin_trgm_ops)'
+        ))
+        db.session.execute(db.text(f'ANALYZE {table}'))
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = bench_app()
+    from app import db
+    from app.queries import escape_like
+
+    with app.app_context():
+        user = reset_schema(db)
+        fill_letters(db, args.rows, user.id)
+
+        def run(sql, term):
+            return lambda: db.session.execute(db.text(sql), {'term': term}).all()
+
+        before = {}
+        for table, column, term in CASES:
+            sql = f'SELECT id FROM {table} WHERE {column} ILIKE :term ORDER BY year DESC, sequence_num DESC LIMIT 10'
+            before[(table, column)] = timed(run(sql, f'%{term}%'), args.repeat)
+
+        create_trigram_indexes(db)
+
+        results = []
+        for table, column, term in CASES:
+            sql = (f"SELECT id FROM {table} WHERE lower({column}) LIKE :term ESCAPE '\\' "
+                   f'ORDER BY year DESC, sequence_num DESC LIMIT 10')
+            after = timed(run(sql, f'%{escape_like(term.lower())}%'), args.repeat)
+            old = before[(table, column)]
+            results.append((f'{table}.{column}',
+                            f'{old:9.2f} мс -> {after:8.2f} мс  (x{old / max(after, 0.001):.1f})'))
+
+        report(f'Поиск подстроки, {args.rows} писем в каждом реестре', results)
+
+
+if __name__ == '__main__':
+    main()
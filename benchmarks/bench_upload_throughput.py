@@ -0,0 +1,123 @@
+"""
+Пропускная способность приёма вложений при параллельных загрузках:
+прежний путь (Werkzeug спулит тело во временный файл, затем file.save копирует его)
+против UploadRequest из app/uploads.py (тело сразу пишется в UPLOAD_FOLDER
+с подсчётом SHA-256, на месте — только rename).
+
+База не нужна: сервер поднимает только маршрут приёма файла.
+
+    python benchmarks/bench_upload_throughput.py --size-mb 20 --files 32 --concurrency 8
+"""
+import argparse
+import http.client
+import logging
+import multiprocessing
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from common import report
+
+BOUNDARY = 'bench-upload-boundary'
+
+
+def serve(variant, upload_folder, port_queue):
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    from flask import Request, request
+    from werkzeug.serving import make_server
+
+    from app import create_app
+    from app.uploads import store_upload
+
+    app = create_app()
+    app.config['UPLOAD_FOLDER'] = upload_folder
+    if variant == 'legacy':
+        app.request_class = Request
+
+    @app.route('/bench/upload', methods=['POST'])
+    def bench_upload():
+        file = request.files['file']
+        path = os.path.join(upload_folder, uuid.uuid4().hex)
+        if variant == 'legacy':
+            file.save(path)
+        else:
+            store_upload(file, path)
+        return 'ok'
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def multipart_body(payload):
+    head = (
+        f'--{BOUNDARY}\r\n'
+        'Content-Disposition: form-data; name="file"; filename="bench.pdf"\r\n'
+        'Content-Type: application/pdf\r\n\r\n'
+    ).encode()
+    return head + payload + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+def upload(port, body):
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    conn.request('POST', '/bench/upload', body=body, headers={
+        'Content-Type': f'multipart/form-data; boundary={BOUNDARY}',
+        'Content-Length': str(len(body)),
+    })
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    assert response.status == 200, response.status
+    return time.perf_counter() - start
+
+
+def run_variant(variant, body, files, concurrency):
+    upload_folder = tempfile.mkdtemp(prefix=f'bench_upload_{variant}_')
+    ctx = multiprocessing.get_context('spawn')
+    port_queue = ctx.Queue()
+    server = ctx.Process(target=serve, args=(variant, upload_folder, port_queue), daemon=True)
+    server.start()
+    port = port_queue.get()
+
+    try:
+        upload(port, body)  # прогрев
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(lambda _: upload(port, body), range(files)))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.join()
+        shutil.rmtree(upload_folder, ignore_errors=True)
+
+    latencies.sort()
+    return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=20)
+    parser.add_argument('--files', type=int, default=32)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    body = multipart_body(os.urandom(args.size_mb * 2**20))
+    total_mb = args.size_mb * args.files
+
+    results = []
+    for variant in ('legacy', 'streaming'):
+        elapsed, latencies = run_variant(variant, body, args.files, args.concurrency)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        results.append((variant, f'{total_mb / elapsed:7.1f} МБ/с   медиана {statistics.median(latencies):6.2f} с   p95 {p95:6.2f} с'))
+
+    report(f'{args.files} загрузок по {args.size_mb} МБ, параллельно {args.concurrency}', results)
+
+
+if __name__ == '__main__':
+    main()
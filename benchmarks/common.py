@@ -0,0 +1,92 @@
+"""
+Общие помощники для бенчмарков.
+
+Бенчмарки пересоздают таблицы, поэтому запускаются только на отдельной
+базе Postgres, адрес которой задаётся в BENCH_DATABASE_URL.
+"""
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def bench_app():
+    url = os.environ.get('BENCH_DATABASE_URL')
+    if not url:
+        sys.exit('Укажите BENCH_DATABASE_URL: бенчмарк пересоздаёт таблицы в этой базе')
+    os.environ['DATABASE_URL'] = url
+
+    from app import create_app
+    return create_app()
+
+
+def reset_schema(db):
+    """Чистая схема + один пользователь-автор."""
+    from app.models import Role, User
+
+    db.drop_all()
+    db.create_all()
+
+    role = Role(name='Admin')
+    user = User(username='bench', email='bench@example.com', display_name='Бенчмарк',
+                password_hash='-', role=role)
+    db.session.add_all([role, user])
+    db.session.commit()
+    return user
+
+
+def fill_letters(db, rows, user_id, per_year=50000):
+    """Генерирует rows входящих и исходящих писем прямо в БД (generate_series)."""
+    params = {'rows': rows, 'user_id': user_id, 'per_year': per_year}
+    db.session.execute(db.text("""
+        INSERT INTO letter_incoming (user_id, number, organization, subject, forwarded_to,
+                                     date_received, sequence_num, year)
+        SELECT :user_id,
+               'ВХ-' || ((i - 1) % :per_year + 1) || '/' || (10 + (i - 1) / :per_year),
+               'ООО «Организация ' || (i % 5000) || '»',
+               'Письмо о поставке партии №' || i || ' по договору ' || md5(i::text),
+               'Отдел ' || (i % 40),
+               now() - (i || ' minutes')::interval,
+               (i - 1) % :per_year + 1,
+               10 + (i - 1) / :per_year
+        FROM generate_series(1, :rows) AS i
+    """), params)
+    db.session.execute(db.text("""
+        INSERT INTO letter_outgoing (user_id, number, subject, recipient, date_created,
+                                     is_protected, sequence_num, year)
+        SELECT :user_id,
+               'H-' || ((i - 1) % :per_year + 1) || '/' || (10 + (i - 1) / :per_year),
+               'Ответ на запрос №' || i || ' ' || md5(i::text),
+               'АО «Получатель ' || (i % 5000) || '»',
+               now() - (i || ' minutes')::interval,
+               false,
+               (i - 1) % :per_year + 1,
+               10 + (i - 1) / :per_year
+        FROM generate_series(1, :rows) AS i
+    """), params)
+    db.session.commit()
+    db.session.execute(db.text('ANALYZE letter_incoming'))
+    db.session.execute(db.text('ANALYZE letter_outgoing'))
+    db.session.commit()
+
+
+def timed(fn, repeat=5):
+    """Медиана времени выполнения fn() в миллисекундах (после одного прогрева)."""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def report(title, rows):
+    print(f'\n{title}')
+    width = max(len(name) for name, _ in rows)
+    for name, value in rows:
+        print(f'  {name.ljust(width)}  {value}')
@@ -0,0 +1,109 @@
+"""Composite (year, sequence_num) index for list ordering, backfill from number
+
+Revision ID: 4b1d7e9c2a60
+Revises: 61130273c594
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b1d7e9c2a60'
+down_revision = '61130273c594'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+TABLES = ('letter_incoming', 'letter_outgoing')
+
+# Номер письма: ВХ-{seq}/{YY} или H-{seq}/{YY}
+NUMBER_PATTERN = r'^[^-]+-\d+/\d+$'
+SEQ_FROM_NUMBER = r"CAST(substring(number FROM '-(\d+)/') AS INTEGER)"
+YEAR_FROM_NUMBER = r"CAST(substring(number FROM '/(\d+)$') AS INTEGER)"
+
+
+def duplicate_numbers(connection, table):
+    """{(year, sequence_num): [(id, number), …]} — пары, что повторяются и не дадут создать уникальный индекс."""
+    rows = connection.execute(sa.text(f"""
+        SELECT t.year, t.sequence_num, t.id, t.number
+        FROM {table} t
+        JOIN (
+            SELECT year, sequence_num FROM {table}
+            WHERE year IS NOT NULL AND sequence_num IS NOT NULL
+            GROUP BY year, sequence_num HAVING count(*) > 1
+        ) d ON t.year = d.year AND t.sequence_num = d.sequence_num
+        ORDER BY t.year, t.sequence_num, t.id
+    """))
+    duplicates = {}
+    for year, sequence_num, letter_id, number in rows:
+        duplicates.setdefault((year, sequence_num), []).append((letter_id, number))
+    return duplicates
+
+
+def check_unique_numbers(connection, tables=TABLES, limit=50):
+    """
+    Останавливает миграцию, если в каком-то году номер повторяется (например, исходящие,
+    выданные старым max(id) + 1 одновременно). Перенумеровывать отправленные письма
+    автоматически нельзя — отчёт перечисляет письма, номера исправляются вручную.
+    """
+    lines = []
+    for table in tables:
+        for (year, sequence_num), letters in duplicate_numbers(connection, table).items():
+            listed = ', '.join(f'#{letter_id} {number}' for letter_id, number in letters)
+            lines.append(f'  {table}: год {year}, номер {sequence_num} — {listed}')
+    if lines:
+        shown = '\n'.join(lines[:limit])
+        more = f'\n  … и ещё {len(lines) - limit}' if len(lines) > limit else ''
+        raise RuntimeError(
+            f'Повторяющиеся номера (year, sequence_num): {len(lines)}. '
+            f'Уникальный индекс не создан, миграция отменена.\n{shown}{more}\n'
+            f'Исправьте номера этих писем и повторите upgrade.'
+        )
+
+
+def upgrade():
+    for table in TABLES:
+        # Номера повторяются из года в год — глобальная уникальность sequence_num
+        # мешает и бэкфиллу, и новой нумерации. Уникальна пара (year, sequence_num).
+        op.execute(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_sequence_num_key')
+
+        # Заполняем пустые и расходящиеся с number значения
+        op.execute(rf"""
+            UPDATE {table}
+            SET sequence_num = {SEQ_FROM_NUMBER},
+                year = {YEAR_FROM_NUMBER}
+            WHERE number ~ '{NUMBER_PATTERN}'
+              AND (sequence_num IS DISTINCT FROM {SEQ_FROM_NUMBER}
+                   OR year IS DISTINCT FROM {YEAR_FROM_NUMBER})
+        """)
+
+    # До создания индексов: в Postgres DDL транзакционен, ошибка откатит и бэкфилл
+    check_unique_numbers(op.get_bind())
+
+    for table in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index(f'ix_{table}_year_sequence_num', ['year', 'sequence_num'], unique=True)
+
+
+def downgrade():
+    connection = op.get_bind()
+    for table in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(f'ix_{table}_year_sequence_num')
+
+        # Старое ограничение — уникальность sequence_num без года; как только номера
+        # пошли по новой в следующем году, вернуть его нельзя
+        repeated = connection.execute(sa.text(
+            f'SELECT count(sequence_num) - count(DISTINCT sequence_num) FROM {table}'
+        )).scalar()
+        if repeated:
+            logger.warning(f'{table}: sequence_num повторяется в разных годах ({repeated}), '
+                           f'ограничение {table}_sequence_num_key не восстановлено')
+            continue
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_unique_constraint(f'{table}_sequence_num_key', ['sequence_num'])
@@ -0,0 +1,41 @@
+"""pg_trgm GIN indexes for registry substring filters
+
+Revision ID: 7e3c5a1f9b42
+Revises: 4b1d7e9c2a60
+Create Date: 2026-10-18 11:03:27.540118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e3c5a1f9b42'
+down_revision = '4b1d7e9c2a60'
+branch_labels = None
+depends_on = None
+
+
+# Поля, по которым в списках идёт поиск подстроки (app/queries.py)
+TRIGRAM_COLUMNS = {
+    'letter_incoming': ('number', 'organization', 'subject', 'forwarded_to'),
+    'letter_outgoing': ('number', 'subject', 'recipient'),
+}
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    # Индекс по выражению lower(col) — ровно то, что сравнивает app.queries.contains()
+    for table, columns in TRIGRAM_COLUMNS.items():
+        for column in columns:
+            op.execute(
+                f'CREATE INDEX IF NOT EXISTS ix_{table}_{column}_trgm '
+                f'ON {table} USING gin (lower({column}) gin_trgm_ops)'
+            )
+
+
+def downgrade():
+    for table, columns in TRIGRAM_COLUMNS.items():
+        for column in columns:
+            op.execute(f'DROP INDEX IF EXISTS ix_{table}_{column}_trgm')
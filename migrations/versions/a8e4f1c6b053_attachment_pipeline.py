@@ -0,0 +1,51 @@
+"""Attachment post-upload stages and extracted text
+
+Revision ID: a8e4f1c6b053
+Revises: f3c8d2e5a917
+Create Date: 2026-10-18 20:41:12.683350
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8e4f1c6b053'
+down_revision = 'f3c8d2e5a917'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('attachment_stages',
+    sa.Column('attachment_id', sa.Integer(), nullable=False),
+    sa.Column('stage', sa.String(length=20), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('error', sa.String(length=500), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['attachment_id'], ['attachment.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('attachment_id', 'stage')
+    )
+    with op.batch_alter_table('attachment_stages', schema=None) as batch_op:
+        batch_op.create_index('ix_attachment_stages_status', ['status'], unique=False)
+
+    op.create_table('attachment_texts',
+    sa.Column('attachment_id', sa.Integer(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('extracted_at', sa.DateTime(), nullable=True),
+    sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True),
+    sa.ForeignKeyConstraint(['attachment_id'], ['attachment.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('attachment_id')
+    )
+    op.execute('CREATE INDEX ix_attachment_texts_search_vector ON attachment_texts USING gin (search_vector)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_attachment_texts_search_vector')
+    op.drop_table('attachment_texts')
+    with op.batch_alter_table('attachment_stages', schema=None) as batch_op:
+        batch_op.drop_index('ix_attachment_stages_status')
+
+    op.drop_table('attachment_stages')
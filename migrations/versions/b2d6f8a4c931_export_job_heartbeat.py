@@ -0,0 +1,26 @@
+"""Export job heartbeat
+
+Revision ID: b2d6f8a4c931
+Revises: e5b8d3a7c120
+Create Date: 2026-10-18 21:40:12.518304
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2d6f8a4c931'
+down_revision = 'e5b8d3a7c120'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('export_jobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('export_jobs', schema=None) as batch_op:
+        batch_op.drop_column('heartbeat_at')
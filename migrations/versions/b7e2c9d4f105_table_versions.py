@@ -0,0 +1,32 @@
+"""Table change counters for the export cache
+
+Revision ID: b7e2c9d4f105
+Revises: a3d6e8f0b214
+Create Date: 2026-10-18 16:05:13.902714
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2c9d4f105'
+down_revision = 'a3d6e8f0b214'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_versions = op.create_table('table_versions',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(table_versions, [
+        {'name': 'letter_incoming', 'version': 0},
+        {'name': 'letter_outgoing', 'version': 0},
+    ])
+
+
+def downgrade():
+    op.drop_table('table_versions')
@@ -0,0 +1,40 @@
+"""Per-register, per-year letter number counters
+
+Revision ID: c4f7a2d9e816
+Revises: a8e4f1c6b053
+Create Date: 2026-10-18 22:14:37.205118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f7a2d9e816'
+down_revision = 'a8e4f1c6b053'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('number_counters',
+    sa.Column('register', sa.String(length=20), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('last_value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('register', 'year')
+    )
+    # Счётчики продолжают уже выданные номера каждого года
+    op.execute("""
+        INSERT INTO number_counters (register, year, last_value)
+        SELECT 'incoming', year, max(sequence_num) FROM letter_incoming
+        WHERE year IS NOT NULL AND sequence_num IS NOT NULL GROUP BY year
+    """)
+    op.execute("""
+        INSERT INTO number_counters (register, year, last_value)
+        SELECT 'outgoing', year, max(sequence_num) FROM letter_outgoing
+        WHERE year IS NOT NULL AND sequence_num IS NOT NULL GROUP BY year
+    """)
+
+
+def downgrade():
+    op.drop_table('number_counters')
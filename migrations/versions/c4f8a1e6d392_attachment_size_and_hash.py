@@ -0,0 +1,28 @@
+"""Attachment size and SHA-256
+
+Revision ID: c4f8a1e6d392
+Revises: b7e2c9d4f105
+Create Date: 2026-10-18 17:20:48.115630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f8a1e6d392'
+down_revision = 'b7e2c9d4f105'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('attachment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('size_bytes', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('attachment', schema=None) as batch_op:
+        batch_op.drop_column('content_hash')
+        batch_op.drop_column('size_bytes')
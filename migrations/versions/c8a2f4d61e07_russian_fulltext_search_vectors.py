@@ -0,0 +1,48 @@
+"""Russian full-text search vectors on letter_incoming / letter_outgoing
+
+Revision ID: c8a2f4d61e07
+Revises: 7e3c5a1f9b42
+Create Date: 2026-10-18 12:20:05.117392
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8a2f4d61e07'
+down_revision = '7e3c5a1f9b42'
+branch_labels = None
+depends_on = None
+
+
+# Вес A — тема, B — контрагент, C — кому направлено / номер
+SEARCH_VECTORS = {
+    'letter_incoming': """
+        setweight(to_tsvector('russian'::regconfig, coalesce(subject, '')), 'A') ||
+        setweight(to_tsvector('russian'::regconfig, coalesce(organization, '')), 'B') ||
+        setweight(to_tsvector('russian'::regconfig, coalesce(forwarded_to, '')), 'C') ||
+        setweight(to_tsvector('simple'::regconfig, coalesce(number, '')), 'C')
+    """,
+    'letter_outgoing': """
+        setweight(to_tsvector('russian'::regconfig, coalesce(subject, '')), 'A') ||
+        setweight(to_tsvector('russian'::regconfig, coalesce(recipient, '')), 'B') ||
+        setweight(to_tsvector('simple'::regconfig, coalesce(number, '')), 'C')
+    """,
+}
+
+
+def upgrade():
+    # Генерируемая колонка сама пересчитывается при INSERT/UPDATE — без триггеров
+    for table, expression in SEARCH_VECTORS.items():
+        op.execute(
+            f'ALTER TABLE {table} ADD COLUMN search_vector tsvector '
+            f'GENERATED ALWAYS AS ({expression}) STORED'
+        )
+        op.execute(f'CREATE INDEX ix_{table}_search_vector ON {table} USING gin (search_vector)')
+
+
+def downgrade():
+    for table in SEARCH_VECTORS:
+        op.execute(f'DROP INDEX IF EXISTS ix_{table}_search_vector')
+        op.execute(f'ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector')
@@ -0,0 +1,37 @@
+"""Content-addressed attachment storage
+
+Revision ID: d9b3f5a2c610
+Revises: c4f8a1e6d392
+Create Date: 2026-10-18 18:34:07.481926
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9b3f5a2c610'
+down_revision = 'c4f8a1e6d392'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stored_blobs',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('size_bytes', sa.BigInteger(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+    with op.batch_alter_table('attachment', schema=None) as batch_op:
+        batch_op.create_index('ix_attachment_content_hash', ['content_hash'], unique=False)
+
+    # Файлы переносятся отдельно: flask storage-migrate
+
+
+def downgrade():
+    with op.batch_alter_table('attachment', schema=None) as batch_op:
+        batch_op.drop_index('ix_attachment_content_hash')
+
+    op.drop_table('stored_blobs')
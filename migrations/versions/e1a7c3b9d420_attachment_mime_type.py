@@ -0,0 +1,26 @@
+"""Attachment MIME type
+
+Revision ID: e1a7c3b9d420
+Revises: d9b3f5a2c610
+Create Date: 2026-10-18 19:12:36.504218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a7c3b9d420'
+down_revision = 'd9b3f5a2c610'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('attachment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('mime_type', sa.String(length=100), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('attachment', schema=None) as batch_op:
+        batch_op.drop_column('mime_type')
@@ -0,0 +1,35 @@
+"""Drop incoming_number_seq / outgoing_number_seq replaced by number_counters
+
+Revision ID: e5b8d3a7c120
+Revises: c4f7a2d9e816
+Create Date: 2026-10-18 23:41:09.563281
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b8d3a7c120'
+down_revision = 'c4f7a2d9e816'
+branch_labels = None
+depends_on = None
+
+
+# Последовательность -> таблица, номера которой она выдавала
+SEQUENCES = {
+    'incoming_number_seq': 'letter_incoming',
+    'outgoing_number_seq': 'letter_outgoing',
+}
+
+
+def upgrade():
+    # Номера выдаёт number_counters; последовательности создавались вне миграций, поэтому IF EXISTS
+    for seq in SEQUENCES:
+        op.execute(f'DROP SEQUENCE IF EXISTS {seq}')
+
+
+def downgrade():
+    for seq, table in SEQUENCES.items():
+        op.execute(f'CREATE SEQUENCE IF NOT EXISTS {seq}')
+        op.execute(f"SELECT setval('{seq}', coalesce(max(sequence_num), 0) + 1, false) FROM {table}")
@@ -0,0 +1,26 @@
+"""Index attachment(letter_type, letter_id) for batched counts
+
+Revision ID: e5f19b3c7d28
+Revises: c8a2f4d61e07
+Create Date: 2026-10-18 13:41:52.604183
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5f19b3c7d28'
+down_revision = 'c8a2f4d61e07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('attachment', schema=None) as batch_op:
+        batch_op.create_index('ix_attachment_letter_type_letter_id', ['letter_type', 'letter_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('attachment', schema=None) as batch_op:
+        batch_op.drop_index('ix_attachment_letter_type_letter_id')
@@ -0,0 +1,32 @@
+"""Attachment storage compression codec
+
+Revision ID: f3c8d2e5a917
+Revises: e1a7c3b9d420
+Create Date: 2026-10-18 20:03:51.227604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c8d2e5a917'
+down_revision = 'e1a7c3b9d420'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('stored_blobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('codec', sa.String(length=10), nullable=True))
+
+    with op.batch_alter_table('attachment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('codec', sa.String(length=10), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('attachment', schema=None) as batch_op:
+        batch_op.drop_column('codec')
+
+    with op.batch_alter_table('stored_blobs', schema=None) as batch_op:
+        batch_op.drop_column('codec')
@@ -0,0 +1,143 @@
+import importlib.util
+import os
+
+# Тесты гоняем на SQLite в памяти — до импорта app.config
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['EXPORT_CLEANUP_MINUTES'] = '0'  # таймер очистки тесты запускают явно
+
+import pytest
+import sqlalchemy
+from datetime import datetime, timedelta
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import LetterIncoming, LetterOutgoing, Role, User
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # create_app() пишет logs/ в текущую папку
+    app = create_app()
+    app.config.update(
+        TESTING=True,
+        WTF_CSRF_ENABLED=False,
+        UPLOAD_FOLDER=str(tmp_path / 'uploads'),
+        ATTACHMENT_PIPELINE=False,  # фоновую обработку тесты запускают явно
+        PIPELINE_WORKERS=1,  # у SQLite в памяти одно соединение на все потоки
+        TEXT_EXTRACT_PROCESSES=0,
+    )
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def load_migration():
+    """Модуль миграции по имени файла — для проверки её SQL-выражений."""
+    def load(name):
+        path = os.path.join(os.path.dirname(__file__), '..', 'migrations', 'versions', f'{name}.py')
+        spec = importlib.util.spec_from_file_location(f'migration_{name}', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    return load
+
+
+@pytest.fixture
+def pg_connection():
+    """
+    Соединение с Postgres из TEST_POSTGRES_URL — для SQL, который есть только в Postgres
+    (регулярные выражения миграций). Всё делается в транзакции и откатывается.
+    """
+    url = os.environ.get('TEST_POSTGRES_URL')
+    if not url:
+        pytest.skip('Нужен Postgres: задайте TEST_POSTGRES_URL')
+    engine = sqlalchemy.create_engine(url)
+    connection = engine.connect()
+    transaction = connection.begin()
+    yield connection
+    transaction.rollback()
+    connection.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def admin(app):
+    role = Role(name='Admin')
+    user = User(
+        username='admin',
+        email='admin@example.com',
+        display_name='Администратор',
+        password_hash='-',
+        role=role,
+        # last_active_at в будущем — update_last_active не коммитит на каждом запросе
+        last_active_at=datetime.utcnow() + timedelta(days=1),
+    )
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def letters(admin):
+    incoming = LetterIncoming(
+        user_id=admin.id, number='ВХ-1/25', sequence_num=1, year=25,
+        organization='ООО «Ромашка»', subject='Договор', date_received=datetime(2025, 1, 1)
+    )
+    outgoing = LetterOutgoing(
+        user_id=admin.id, number='H-1/25', sequence_num=1, year=25,
+        subject='Ответ', recipient='АО «Лютик»', date_created=datetime(2025, 1, 1)
+    )
+    db.session.add_all([incoming, outgoing])
+    db.session.commit()
+    return incoming, outgoing
+
+
+@pytest.fixture
+def client(app, admin):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin.id)
+        session['_fresh'] = True
+    return client
+
+
+class QueryCounter:
+    """Считает SQL-запросы, выполненные внутри блока with."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@pytest.fixture
+def query_counter(app):
+    """Фабрика счётчиков: with query_counter() as queries: ...; queries.count"""
+    return lambda: QueryCounter(db.engine)
+
+
+@pytest.fixture
+def count_queries(client):
+    """Число SQL-запросов одного GET, выполненного с холодного старта (свежие g и identity map)."""
+    def count(url):
+        with client.application.app_context(), QueryCounter(db.engine) as queries:
+            response = client.get(url)
+        assert response.status_code == 200, url
+        return queries.count
+    return count
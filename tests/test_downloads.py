@@ -0,0 +1,177 @@
+import io
+import os
+import zipfile
+from datetime import datetime
+
+import pytest
+
+from app import db
+from app.models import Attachment, LetterIncoming
+
+
+@pytest.fixture(params=['incoming', 'outgoing'])
+def attachment(request, client, letters):
+    letter = letters[0] if request.param == 'incoming' else letters[1]
+    client.post(
+        f'/{request.param}/{letter.id}/attachments',
+        data={'file': (io.BytesIO(b'%PDF-1.4 scan'), 'Скан приказа.pdf')},
+        content_type='multipart/form-data'
+    )
+    return Attachment.query.one()
+
+
+def download_url(attachment):
+    return f'/{attachment.letter_type}/{attachment.letter_id}/attachments?download={attachment.id}'
+
+
+def test_python_mode_sends_file(client, attachment):
+    response = client.get(download_url(attachment))
+
+    assert response.status_code == 200
+    assert response.data == b'%PDF-1.4 scan'
+    assert "filename*=UTF-8''" in response.headers['Content-Disposition']
+
+
+def test_x_accel_mode_hands_transfer_to_nginx(app, client, attachment):
+    app.config['ATTACHMENT_DOWNLOAD_MODE'] = 'x-accel'
+
+    response = client.get(download_url(attachment))
+
+    sha = attachment.content_hash
+    assert response.headers['X-Accel-Redirect'] == f'/protected-uploads/blobs/{sha[:2]}/{sha[2:4]}/{sha}'
+    assert response.data == b''
+    assert "filename*=UTF-8''" in response.headers['Content-Disposition']
+
+
+def test_x_sendfile_mode_hands_transfer_to_apache(app, client, attachment):
+    app.config['ATTACHMENT_DOWNLOAD_MODE'] = 'x-sendfile'
+
+    response = client.get(download_url(attachment))
+
+    assert response.headers['X-Sendfile'].endswith(attachment.content_hash)
+    assert response.data == b''
+
+
+def test_download_has_strong_etag_and_content_type(client, attachment):
+    response = client.get(download_url(attachment))
+
+    assert response.headers['ETag'] == f'"{attachment.content_hash}"'
+    assert response.mimetype == attachment.mime_type == 'application/pdf'
+    assert 'private' in response.headers['Cache-Control']
+
+
+def test_range_request_returns_partial_content(client, attachment):
+    response = client.get(download_url(attachment), headers={'Range': 'bytes=0-3'})
+
+    assert response.status_code == 206
+    assert response.data == b'%PDF'
+    assert response.headers['Content-Range'] == 'bytes 0-3/13'
+
+
+def test_conditional_get_returns_not_modified(app, client, attachment):
+    first = client.get(download_url(attachment))
+
+    by_etag = client.get(download_url(attachment), headers={'If-None-Match': first.headers['ETag']})
+    by_date = client.get(download_url(attachment), headers={'If-Modified-Since': first.headers['Last-Modified']})
+
+    assert by_etag.status_code == 304
+    assert by_date.status_code == 304
+    assert by_etag.data == b''
+
+
+@pytest.mark.parametrize('mode', ['x-accel', 'x-sendfile'])
+def test_offload_mode_leaves_validators_to_web_server(app, client, attachment, mode):
+    app.config['ATTACHMENT_DOWNLOAD_MODE'] = mode
+
+    response = client.get(download_url(attachment), headers={'If-None-Match': f'"{attachment.content_hash}"'})
+
+    # Свой ETag веб-сервер всё равно поставит — не смешиваем его с нашим
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+    assert 'Last-Modified' not in response.headers
+
+
+def test_missing_file_redirects_back(client, attachment):
+    os.remove(attachment.filepath)
+
+    response = client.get(download_url(attachment))
+
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith(f'/{attachment.letter_type}/{attachment.letter_id}/attachments')
+
+
+def test_offload_mode_checks_file_only_when_enabled(app, client, attachment):
+    app.config['ATTACHMENT_DOWNLOAD_MODE'] = 'x-accel'
+    os.remove(attachment.filepath)
+
+    assert 'X-Accel-Redirect' in client.get(download_url(attachment)).headers
+
+    app.config['ATTACHMENT_CHECK_EXISTS'] = True
+    assert client.get(download_url(attachment)).status_code == 302
+
+def upload(client, letter_type, letter, name, data):
+    client.post(
+        f'/{letter_type}/{letter.id}/attachments',
+        data={'file': (io.BytesIO(data), name), 'force': '1'},
+        content_type='multipart/form-data'
+    )
+
+
+def test_letter_zip_contains_all_attachments(client, letters):
+    incoming = letters[0]
+    upload(client, 'incoming', incoming, 'Скан приказа.pdf', b'%PDF-1.4 scan')
+    upload(client, 'incoming', incoming, 'Опись.doc', b'opis ' * 1000)
+
+    response = client.get(f'/incoming/{incoming.id}/attachments.zip')
+
+    assert response.mimetype == 'application/zip'
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.testzip() is None
+    entries = {info.filename: info for info in archive.infolist()}
+    assert set(entries) == {'ВХ-1_25/Скан приказа.pdf', 'ВХ-1_25/Опись.doc'}
+    # PDF уже сжат — кладётся как есть, остальное сжимается
+    assert entries['ВХ-1_25/Скан приказа.pdf'].compress_type == zipfile.ZIP_STORED
+    assert entries['ВХ-1_25/Опись.doc'].compress_type == zipfile.ZIP_DEFLATED
+    assert archive.read('ВХ-1_25/Опись.doc') == b'opis ' * 1000
+
+
+def test_filtered_zip_follows_list_filters(client, letters):
+    incoming, _ = letters
+    other = LetterIncoming(
+        user_id=incoming.user_id, number='ВХ-2/25', sequence_num=2, year=25,
+        organization='ИП Иванов', subject='Счёт', date_received=datetime(2025, 2, 1)
+    )
+    db.session.add(other)
+    db.session.commit()
+    upload(client, 'incoming', incoming, 'Договор.pdf', b'%PDF dogovor')
+    upload(client, 'incoming', other, 'Счёт.pdf', b'%PDF schet')
+
+    response = client.get('/incoming/attachments.zip?date_to=2025-01-15')
+
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.namelist() == ['ВХ-1_25/Договор.pdf']
+
+
+def test_compressed_storage_is_transparent(app, client, letters):
+    app.config['ATTACHMENT_COMPRESSION'] = 'gzip'
+    incoming, outgoing = letters
+    doc = b'\xd0\xcf\x11\xe0 legacy word text ' * 4000
+    docx = b'PK\x03\x04' + b'already zipped ' * 4000
+    upload(client, 'incoming', incoming, 'Письмо.doc', doc)
+    upload(client, 'incoming', incoming, 'Письмо.docx', docx)
+    # То же содержимое при выключенном сжатии — ссылается на уже сжатый блоб
+    app.config['ATTACHMENT_COMPRESSION'] = None
+    upload(client, 'outgoing', outgoing, 'Копия.doc', doc)
+
+    packed, zipped, copy = Attachment.query.order_by(Attachment.id).all()
+    assert (packed.codec, zipped.codec, copy.codec) == ('gzip', None, 'gzip')
+    assert os.path.getsize(packed.filepath) < len(doc) // 10
+    assert os.path.getsize(zipped.filepath) == len(docx)
+
+    response = client.get(download_url(copy))
+    assert response.data == doc
+    assert response.content_length == len(doc)
+    assert client.get(download_url(copy), headers={'If-None-Match': f'"{copy.content_hash}"'}).status_code == 304
+
+    archive = zipfile.ZipFile(io.BytesIO(client.get(f'/incoming/{incoming.id}/attachments.zip').data))
+    assert archive.read('ВХ-1_25/Письмо.doc') == doc
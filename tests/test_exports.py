@@ -0,0 +1,248 @@
+import csv
+import io
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.jobs import cleanup_exports, start_cleanup_timer
+from app.models import ExportJob, LetterIncoming, LetterOutgoing, bump_table_version, get_table_version
+
+
+def make_export_letters(user):
+    for i, subject in enumerate(('Contract', 'Invoice', 'Contract renewal'), start=1):
+        db.session.add(LetterIncoming(
+            user_id=user.id, number=f'ВХ-{i}/25', sequence_num=i, year=25,
+            organization='ООО «Ромашка»', subject=subject, date_received=datetime(2025, 3, i)
+        ))
+        db.session.add(LetterOutgoing(
+            user_id=user.id, number=f'H-{i}/25', sequence_num=i, year=25,
+            subject=subject, recipient='АО «Лютик»', date_created=datetime(2025, 3, i)
+        ))
+    db.session.commit()
+
+
+def test_csv_export_honors_filters(client, admin):
+    make_export_letters(admin)
+
+    response = client.get('/incoming/export?format=csv&subject=contract')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert "filename*=UTF-8''" in response.headers['Content-Disposition']
+    body = response.get_data(as_text=True)
+    assert body.startswith('﻿')
+    rows = list(csv.reader(io.StringIO(body.lstrip('﻿')), delimiter=';'))
+    assert rows[0] == ['Номер', 'Организация', 'Тема', 'Направлено', 'Дата получения']
+    assert [row[2] for row in rows[1:]] == ['Contract renewal', 'Contract']
+    assert rows[1][4] == '2025-03-03'
+
+
+@pytest.mark.parametrize('url', ['/incoming/list', '/outgoing/list', '/letters/outgoing'])
+def test_excel_export_link_keeps_every_filter(client, admin, url):
+    html = client.get(f'{url}?subject=contract&content=поставка').get_data(as_text=True)
+
+    # Ссылка «Экспорт в Excel» несёт те же фильтры, что и CSV/NDJSON, включая текст вложений
+    href = re.search(r'href="([^"]+)">\s*📤 Экспорт в Excel', html).group(1)
+    assert 'subject=contract' in href
+    assert 'content=%D0%BF%D0%BE%D1%81%D1%82%D0%B0%D0%B2%D0%BA%D0%B0' in href
+
+
+def test_ndjson_export_streams_one_record_per_line(client, admin):
+    make_export_letters(admin)
+
+    response = client.get('/outgoing/export?format=ndjson&date_from=2025-03-02')
+
+    assert response.mimetype == 'application/x-ndjson'
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [r['number'] for r in records] == ['H-3/25', 'H-2/25']
+    assert records[0] == {
+        'number': 'H-3/25', 'subject': 'Contract renewal',
+        'recipient': 'АО «Лютик»', 'date_created': '2025-03-03',
+    }
+
+
+def wait_for_exports(app):
+    app.extensions['export_executor'].shutdown(wait=True)
+    del app.extensions['export_executor']
+
+
+def test_background_export_runs_outside_request(app, client, admin):
+    make_export_letters(admin)
+
+    response = client.post('/exports/incoming', data={'format': 'csv', 'subject': 'contract'})
+    assert response.status_code == 302
+
+    wait_for_exports(app)
+    job = ExportJob.query.one()
+    db.session.refresh(job)
+
+    status = client.get(f'/exports/{job.id}/status').get_json()
+    assert status['status'] == 'done'
+    assert status['progress'] == 100
+    assert status['total_rows'] == 2
+
+    body = client.get(status['download_url']).get_data(as_text=True)
+    assert 'Contract renewal' in body and 'Invoice' not in body
+
+
+def test_background_exports_are_capped_per_user(app, client, admin):
+    app.config['EXPORT_MAX_JOBS_PER_USER'] = 1
+    db.session.add(ExportJob(user_id=admin.id, kind='incoming', export_format='xlsx', status='running'))
+    db.session.commit()
+
+    response = client.post('/exports/outgoing', data={'format': 'xlsx'})
+
+    assert response.status_code == 302
+    assert ExportJob.query.count() == 1
+
+
+def test_expired_exports_are_removed_with_files(app, admin, tmp_path):
+    path = tmp_path / 'old.xlsx'
+    path.write_bytes(b'data')
+    db.session.add(ExportJob(
+        user_id=admin.id, kind='incoming', export_format='xlsx', status='done',
+        file_path=str(path), expires_at=datetime.utcnow() - timedelta(minutes=1)
+    ))
+    db.session.commit()
+
+    assert cleanup_exports() == 1
+    assert ExportJob.query.count() == 0
+    assert not path.exists()
+
+
+def test_cleanup_fails_only_silent_jobs(app, admin):
+    now = datetime.utcnow()
+    long_ago = now - timedelta(hours=3)
+    db.session.add_all([
+        ExportJob(user_id=admin.id, kind='incoming', export_format='csv', status='running',
+                  created_at=long_ago, started_at=long_ago, heartbeat_at=now - timedelta(minutes=1)),
+        ExportJob(user_id=admin.id, kind='outgoing', export_format='csv', status='running',
+                  created_at=now, started_at=now - timedelta(hours=2), heartbeat_at=long_ago),
+        ExportJob(user_id=admin.id, kind='outgoing', export_format='csv', status='pending',
+                  created_at=long_ago),
+    ])
+    db.session.commit()
+
+    cleanup_exports(now)
+
+    # Долгая выгрузка с недавним heartbeat жива, замолчавшая и застрявшая в очереди — нет
+    statuses = [job.status for job in ExportJob.query.order_by(ExportJob.id)]
+    assert statuses == ['running', 'failed', 'failed']
+
+
+def test_cleanup_timer_starts_with_first_request_not_cli(app, client, admin):
+    app.config['EXPORT_CLEANUP_MINUTES'] = 30
+
+    app.test_cli_runner().invoke(args=['storage-reconcile', '--list'])
+    assert 'export_cleanup_stop' not in app.extensions
+
+    try:
+        client.get('/incoming/list')
+        assert 'export_cleanup_stop' in app.extensions
+    finally:
+        app.extensions.pop('export_cleanup_stop').set()
+
+
+def test_cleanup_timer_removes_expired_exports_without_new_ones(app, admin, tmp_path):
+    path = tmp_path / 'old.xlsx'
+    path.write_bytes(b'data')
+    db.session.add(ExportJob(
+        user_id=admin.id, kind='incoming', export_format='xlsx', status='done',
+        file_path=str(path), expires_at=datetime.utcnow() - timedelta(minutes=1)
+    ))
+    db.session.commit()
+
+    app.config['EXPORT_CLEANUP_MINUTES'] = 0.001
+    start_cleanup_timer(app)
+    try:
+        deadline = time.monotonic() + 5
+        while path.exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        app.extensions['export_cleanup_stop'].set()
+        app.extensions.pop('export_executor').shutdown(wait=True)
+
+    assert not path.exists()
+    assert ExportJob.query.count() == 0
+
+
+def test_repeated_export_is_served_from_cache(client, admin, query_counter):
+    make_export_letters(admin)
+    first = client.get('/incoming/export?subject=contract').data
+
+    with query_counter() as queries:
+        second = client.get('/incoming/export?subject=contract').data
+
+    assert second == first
+    assert not [sql for sql in queries.statements if 'FROM letter_incoming' in sql]
+
+
+def test_letter_write_invalidates_cached_export(app, client, admin):
+    make_export_letters(admin)
+    client.get('/outgoing/export?format=csv').get_data()
+
+    db.session.add(LetterOutgoing(
+        user_id=admin.id, number='H-4/25', sequence_num=4, year=25,
+        subject='Fresh', recipient='АО «Лютик»', date_created=datetime(2025, 3, 4)
+    ))
+    db.session.commit()
+
+    assert 'Fresh' in client.get('/outgoing/export?format=csv').get_data(as_text=True)
+    cached = os.listdir(os.path.join(app.config['UPLOAD_FOLDER'], 'export_cache'))
+    assert len(cached) == 1 and cached[0].startswith('letter_outgoing.2.')
+
+
+def test_export_cache_is_bounded_by_size(app, client, admin):
+    app.config['EXPORT_CACHE_MAX_BYTES'] = 1
+    make_export_letters(admin)
+
+    response = client.get('/incoming/export')
+
+    assert response.status_code == 200 and response.data.startswith(b'PK')
+    assert os.listdir(os.path.join(app.config['UPLOAD_FOLDER'], 'export_cache')) == []
+
+
+def test_table_version_is_created_and_bumped_in_one_statement(app, query_counter):
+    assert get_table_version('attachment_texts') == 0
+
+    with query_counter() as queries:
+        bump_table_version(db.session.connection(), 'attachment_texts')
+        bump_table_version(db.session.connection(), 'attachment_texts')
+    db.session.commit()
+
+    # Без отдельного UPDATE: параллельные первые записи не столкнутся на вставке строки
+    assert queries.count == 2 and all('ON CONFLICT' in sql for sql in queries.statements)
+    assert get_table_version('attachment_texts') == 2
+
+
+def test_large_excel_export_is_sent_to_background(app, client, admin):
+    make_export_letters(admin)
+    app.config['EXPORT_XLSX_MAX_ROWS'] = 2
+
+    response = client.get('/incoming/export', headers={'Referer': '/incoming/list'})
+
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/incoming/list')
+    with client.session_transaction() as session:
+        assert 'фоновую выгрузку' in session['_flashes'][-1][1]
+
+    # CSV стримится по мере выборки — на него предел не распространяется
+    assert client.get('/incoming/export?format=csv').status_code == 200
+
+
+def test_background_excel_export_fits_on_one_sheet(app, client, admin, monkeypatch):
+    import app.jobs as jobs
+
+    make_export_letters(admin)
+    monkeypatch.setattr(jobs, 'XLSX_SHEET_MAX_ROWS', 2)
+    client.post('/exports/incoming', data={'format': 'xlsx'})
+    app.extensions['export_executor'].shutdown(wait=True)
+
+    job = ExportJob.query.one()
+    assert job.status == 'failed'
+    assert 'CSV' in job.error
@@ -0,0 +1,134 @@
+import io
+import os
+
+import pytest
+
+from app import db
+from app.imports import import_incoming
+from app.models import ImportJob, LetterIncoming, NumberCounter, get_table_version
+
+
+def write_csv(tmp_path, lines):
+    path = tmp_path / 'archive.csv'
+    path.write_text('\ufeff' + '\n'.join(lines) + '\n', encoding='utf-8')
+    return str(path)
+
+
+def test_import_command_numbers_rows_per_year_in_file_order(app, letters, tmp_path):
+    path = write_csv(tmp_path, [
+        'Организация;Тема;Направлено;Дата получения',
+        'ООО «Альфа»;Запрос цен;Отдел снабжения;2025-03-01',
+        'ООО «Бета»;Претензия;;14.02.2024',
+        ';;;',
+        'ООО «Гамма»;Счёт;Бухгалтерия;2025-03-02',
+        'ООО «Дельта»;Акт;;2024-12-30',
+    ])
+    version = get_table_version('letter_incoming')
+
+    # Пачки по 2 строки в двух процессах — порядок номеров всё равно как в файле
+    result = app.test_cli_runner().invoke(args=[
+        'incoming-import', path, '--user', 'admin', '--workers', '2', '--batch-size', '2'
+    ])
+
+    assert result.exit_code == 0, result.output
+    assert 'записано писем: 4' in result.output
+    imported = {
+        letter.organization: letter.number
+        for letter in LetterIncoming.query.filter(LetterIncoming.id != letters[0].id)
+    }
+    # За 25-й год уже есть ВХ-1/25 — нумерация продолжается после него
+    assert imported == {'ООО «Альфа»': 'ВХ-2/25', 'ООО «Гамма»': 'ВХ-3/25',
+                        'ООО «Бета»': 'ВХ-1/24', 'ООО «Дельта»': 'ВХ-2/24'}
+    assert LetterIncoming.query.filter_by(number='ВХ-1/24').one().forwarded_to is None
+    assert get_table_version('letter_incoming') > version
+
+
+def test_import_with_errors_writes_nothing_unless_skipped(app, letters, tmp_path):
+    path = write_csv(tmp_path, [
+        'Организация;Тема;Дата получения',
+        'ООО «Альфа»;Запрос цен;2025-03-01',
+        ';Без организации;2025-03-02',
+        'ООО «Бета»;Претензия;вчера',
+    ])
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=['incoming-import', path, '--user', 'admin', '--workers', '1'])
+    assert result.exit_code != 0
+    assert 'строка 3: не заполнено «Организация»' in result.output
+    assert 'строка 4: Не разобрать дату «вчера»' in result.output
+    assert LetterIncoming.query.count() == 1
+
+    result = runner.invoke(args=['incoming-import', path, '--user', 'admin', '--workers', '1', '--skip-invalid'])
+    assert result.exit_code == 0, result.output
+    db.session.expire_all()
+    assert LetterIncoming.query.filter_by(organization='ООО «Альфа»').one().number == 'ВХ-2/25'
+
+
+def test_admin_imports_xlsx_upload(client, letters):
+    from openpyxl import Workbook
+
+    wb = Workbook()
+    wb.active.append(['Организация', 'Тема', 'Дата получения'])
+    wb.active.append(['ООО «Альфа»', 'Запрос цен', '2025-03-01'])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    buffer.seek(0)
+
+    response = client.post('/admin/import/incoming', data={'file': (buffer, 'Архив.xlsx')},
+                           content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    assert 'зарегистрировано писем: 1' in response.get_data(as_text=True)
+    assert LetterIncoming.query.filter_by(organization='ООО «Альфа»').one().number == 'ВХ-2/25'
+
+
+def test_numbers_are_reserved_before_letters_are_written(app, letters, tmp_path, monkeypatch):
+    import app.imports as imports
+
+    path = write_csv(tmp_path, [
+        'Организация;Тема;Дата получения',
+        'ООО «Альфа»;Запрос цен;2025-03-01',
+        'ООО «Бета»;Претензия;2025-03-02',
+    ])
+
+    def fail(connection, records):
+        raise RuntimeError('диск заполнен')
+
+    monkeypatch.setattr(imports, 'copy_records', fail)
+    with pytest.raises(RuntimeError):
+        import_incoming(path, letters[0].user_id)
+
+    # Диапазон выделен и закоммичен до записи писем: счётчик не ждал всю запись,
+    # а сорвавшийся импорт оставил пропуск в нумерации
+    assert LetterIncoming.query.count() == 1
+    assert db.session.get(NumberCounter, ('incoming', 25)).last_value == 3
+
+
+def test_import_keeps_only_first_errors(app, letters, tmp_path):
+    app.config['IMPORT_MAX_ERRORS'] = 2
+    path = write_csv(tmp_path, ['Организация;Тема;Дата получения'] + [f';Тема {i};2025-03-01' for i in range(5)])
+
+    stats = import_incoming(path, letters[0].user_id)
+
+    assert stats['error_count'] == 5
+    assert [line for line, _ in stats['errors']] == [2, 3]
+
+
+def test_admin_runs_large_import_in_background(app, client, letters, tmp_path):
+    app.config['IMPORT_SYNC_MAX_BYTES'] = 10
+    content = '﻿Организация;Тема;Дата получения\nООО «Альфа»;Запрос цен;2025-03-01\n;Без организации;2025-03-02\n'
+
+    response = client.post('/admin/import/incoming',
+                           data={'file': (io.BytesIO(content.encode()), 'Архив.csv'), 'skip_invalid': '1'},
+                           content_type='multipart/form-data')
+    app.extensions['import_executor'].shutdown(wait=True)
+
+    job = ImportJob.query.one()
+    assert response.headers['Location'].endswith(f'/admin/import/incoming/{job.id}')
+    db.session.refresh(job)
+    assert (job.status, job.rows, job.imported, job.error_count) == ('done', 2, 1, 1)
+    assert not os.path.exists(job.file_path)
+    html = client.get(f'/admin/import/incoming/{job.id}').get_data(as_text=True)
+    assert 'зарегистрировано писем: 1' in html
+    assert 'не заполнено «Организация»' in html
+    assert LetterIncoming.query.filter_by(organization='ООО «Альфа»').one().number == 'ВХ-2/25'
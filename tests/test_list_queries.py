@@ -0,0 +1,157 @@
+from datetime import datetime
+
+import pytest
+
+from app import db
+from app.models import Attachment, LetterIncoming, LetterOutgoing, Role, User, UserBlockHistory
+from app.queries import contains, escape_like
+from app.routes.admin import get_recent_logs
+
+
+def make_authors(count, prefix='editor'):
+    role = Role.query.filter_by(name='Editor').first() or Role(name='Editor')
+    authors = [
+        User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com',
+             display_name=f'Редактор {i}', password_hash='-', role=role)
+        for i in range(count)
+    ]
+    db.session.add_all(authors)
+    db.session.commit()
+    return authors
+
+
+def make_letters(authors, count, attachments_per_letter=3):
+    for i in range(1, count + 1):
+        author = authors[i % len(authors)]
+        incoming = LetterIncoming(
+            user_id=author.id, number=f'ВХ-{i}/25', sequence_num=i, year=25,
+            organization='ООО «Ромашка»', subject=f'Письмо {i}', date_received=datetime(2025, 1, 1)
+        )
+        outgoing = LetterOutgoing(
+            user_id=author.id, number=f'H-{i}/25', sequence_num=i, year=25,
+            subject=f'Ответ {i}', recipient='АО «Лютик»', date_created=datetime(2025, 1, 1)
+        )
+        db.session.add_all([incoming, outgoing])
+        db.session.flush()
+        for letter, letter_type in ((incoming, 'incoming'), (outgoing, 'outgoing')):
+            for n in range(attachments_per_letter):
+                db.session.add(Attachment(
+                    letter_id=letter.id, letter_type=letter_type,
+                    filename=f'file_{n}.pdf', filepath=f'/nonexistent/file_{n}.pdf'
+                ))
+    db.session.commit()
+
+
+@pytest.mark.parametrize('url', [
+    '/incoming/list?per_page={n}',
+    '/outgoing/list?per_page={n}',
+    '/letters/outgoing?per_page={n}',
+])
+def test_list_page_query_count_is_constant(admin, count_queries, url):
+    make_letters([admin] + make_authors(30), 30)
+
+    assert count_queries(url.format(n=5)) == count_queries(url.format(n=25))
+
+
+def test_list_shows_batched_attachment_counts(client, admin):
+    make_letters([admin], 2, attachments_per_letter=4)
+
+    html = client.get('/incoming/list').get_data(as_text=True)
+
+    assert 'Вложений: 4' in html
+
+
+def test_admin_outgoing_data_loads_authors_in_bulk(admin, count_queries):
+    make_letters(make_authors(2, prefix='few'), 2)
+    few_authors = count_queries('/admin/outgoing/data')
+
+    db.session.query(Attachment).delete()
+    db.session.query(LetterIncoming).delete()
+    db.session.query(LetterOutgoing).delete()
+    make_letters(make_authors(20, prefix='many'), 20)
+
+    assert count_queries('/admin/outgoing/data') == few_authors
+
+
+@pytest.mark.parametrize('per_page, expected', [(0, 1), (-5, 1), (1000, 3)])
+def test_admin_outgoing_data_clamps_per_page(client, admin, per_page, expected):
+    make_letters([admin], 3, attachments_per_letter=0)
+
+    response = client.get(f'/admin/outgoing/data?per_page={per_page}')
+
+    assert response.status_code == 200
+    assert len(response.get_json()['items']) == expected
+
+
+def test_admin_outgoing_data_keeps_letters_without_author(client, admin):
+    make_letters([admin], 2, attachments_per_letter=0)
+    # Автор удалён из users, а письмо осталось — в списке «всех исходящих» оно нужно
+    LetterOutgoing.query.order_by(LetterOutgoing.id).first().user_id = admin.id + 1000
+    db.session.commit()
+
+    items = client.get('/admin/outgoing/data').get_json()['items']
+
+    assert len(items) == 2
+    assert sorted(item['author'] or '' for item in items) == ['', admin.username]
+
+
+def test_recent_logs_load_users_in_bulk(admin, query_counter):
+    admin_id = admin.id
+
+    def count_with_logs(targets):
+        for user in targets:
+            db.session.add(UserBlockHistory(
+                user_id=user.id, admin_id=admin_id, action='unblock',
+                timestamp=datetime.utcnow()
+            ))
+        db.session.commit()
+        db.session.expunge_all()
+        with query_counter() as queries:
+            logs = get_recent_logs()
+        assert len(logs) == min(UserBlockHistory.query.count(), 20)
+        return queries.count
+
+    assert count_with_logs(make_authors(2, prefix='few')) == 1
+    assert count_with_logs(make_authors(15, prefix='many')) == 1
+
+
+def test_escape_like_escapes_wildcards():
+    assert escape_like('100%_скидка\\') == '100\\%\\_скидка\\\\'
+    assert escape_like('Договор') == 'Договор'
+
+
+def test_contains_lowercases_term_in_python():
+    # Кириллица приводится к нижнему регистру в Python, а не функцией БД
+    condition = contains(LetterIncoming.subject, 'ДОГОВОР 5%')
+    compiled = condition.compile(compile_kwargs={'literal_binds': True})
+
+    assert 'lower(letter_incoming.subject) LIKE' in str(compiled)
+    assert "'%договор 5\\%%'" in str(compiled) and "ESCAPE '\\'" in str(compiled)
+
+
+def subjects_containing(term):
+    return sorted(letter.subject for letter in LetterIncoming.query.filter(contains(LetterIncoming.subject, term)))
+
+
+def test_contains_matches_wildcards_literally(admin):
+    for i, subject in enumerate(('скидка 100%', 'скидка 1000 руб.', 'счёт_1', 'счёт 1', 'договор'), start=1):
+        db.session.add(LetterIncoming(user_id=admin.id, number=f'ВХ-{i}/25', sequence_num=i, year=25,
+                                      organization='ООО «Ромашка»', subject=subject))
+    db.session.commit()
+
+    assert subjects_containing('100%') == ['скидка 100%']
+    assert subjects_containing('счёт_') == ['счёт_1']
+    assert subjects_containing('ДОГОВОР') == ['договор']
+    assert subjects_containing('%') == ['скидка 100%']
+
+
+def test_contains_folds_cyrillic_case_in_database(admin):
+    if db.engine.dialect.name != 'postgresql':
+        pytest.skip('lower() в SQLite приводит к нижнему регистру только латиницу')
+
+    db.session.add(LetterIncoming(user_id=admin.id, number='ВХ-1/25', sequence_num=1, year=25,
+                                  organization='ООО «Ромашка»', subject='ДОГОВОР Поставки'))
+    db.session.commit()
+
+    assert subjects_containing('договор поставки') == ['ДОГОВОР Поставки']
+    assert subjects_containing('ПОСТАВКИ') == ['ДОГОВОР Поставки']
@@ -0,0 +1,111 @@
+import pytest
+
+from app import db
+from app.models import LetterIncoming
+
+
+@pytest.mark.parametrize('number, parsed', [
+    ('ВХ-12/25', (12, 25)),
+    ('H-7/24', (7, 24)),
+    ('ВХ-0012/05', (12, 5)),
+    ('Б/Н', None),
+    ('ВХ-3/25-доп', None),
+    ('ВХ-/25', None),
+    ('', None),
+])
+def test_backfill_parses_letter_number(pg_connection, load_migration, number, parsed):
+    migration = load_migration('4b1d7e9c2a60_year_sequence_num_sort_index')
+    matches, seq, year = pg_connection.execute(db.text(
+        f"SELECT number ~ '{migration.NUMBER_PATTERN}', "
+        f"{migration.SEQ_FROM_NUMBER}, {migration.YEAR_FROM_NUMBER} FROM (SELECT :number AS number) AS letter"
+    ), {'number': number}).one()
+
+    # Строки, не подходящие под шаблон, бэкфилл не трогает
+    assert matches == (parsed is not None)
+    if parsed:
+        assert (seq, year) == parsed
+
+
+def make_legacy_tables(connection, outgoing_numbers):
+    """Таблицы писем в отдельной схеме, как до миграции: номер есть, sequence_num/year пустые."""
+    connection.execute(db.text('CREATE SCHEMA legacy_numbers; SET LOCAL search_path TO legacy_numbers'))
+    for table in ('letter_incoming', 'letter_outgoing'):
+        connection.execute(db.text(
+            f'CREATE TABLE {table} (id serial PRIMARY KEY, number varchar(20), '
+            f'sequence_num integer UNIQUE, year integer)'
+        ))
+    connection.execute(db.text("INSERT INTO letter_incoming (number) VALUES ('ВХ-1/24'), ('Б/Н')"))
+    connection.execute(db.text("INSERT INTO letter_outgoing (number) VALUES " +
+                               ', '.join(f"('{number}')" for number in outgoing_numbers)))
+
+
+def test_sort_index_migration_backfills_and_indexes(pg_connection, load_migration):
+    migration = load_migration('4b1d7e9c2a60_year_sequence_num_sort_index')
+    make_legacy_tables(pg_connection, ['H-1/24', 'H-1/25', 'H-2/25'])
+
+    run_migration(migration.upgrade, pg_connection)
+
+    rows = pg_connection.execute(db.text('SELECT number, sequence_num, year FROM letter_outgoing ORDER BY id')).all()
+    assert rows == [('H-1/24', 1, 24), ('H-1/25', 1, 25), ('H-2/25', 2, 25)]
+    assert pg_connection.execute(db.text(
+        "SELECT sequence_num FROM letter_incoming WHERE number = 'Б/Н'"
+    )).scalar() is None
+    indexes = {index['name'] for index in db.inspect(pg_connection).get_indexes('letter_outgoing')}
+    assert 'ix_letter_outgoing_year_sequence_num' in indexes
+
+
+def test_sort_index_migration_stops_on_duplicates_in_postgres(pg_connection, load_migration):
+    migration = load_migration('4b1d7e9c2a60_year_sequence_num_sort_index')
+    make_legacy_tables(pg_connection, ['H-7/25', 'H-07/25'])
+
+    with pytest.raises(RuntimeError, match='год 25, номер 7 — #1 H-7/25, #2 H-07/25'):
+        run_migration(migration.upgrade, pg_connection)
+
+
+def run_migration(step, connection=None):
+    from alembic.migration import MigrationContext
+    from alembic.operations import Operations
+
+    with Operations.context(MigrationContext.configure(connection or db.session.connection())):
+        step()
+
+
+def test_sort_index_migration_reports_duplicate_numbers(app, letters, load_migration):
+    migration = load_migration('4b1d7e9c2a60_year_sequence_num_sort_index')
+    incoming, outgoing = letters
+    db.session.execute(db.text('DROP INDEX ix_letter_outgoing_year_sequence_num'))
+    # Как выдавал старый max(id) + 1: тот же номер дважды, но под другой записью
+    db.session.execute(db.text(
+        "INSERT INTO letter_outgoing (user_id, number, subject, recipient, sequence_num, year) "
+        "VALUES (:user_id, 'H-01/25', 'Ответ', 'АО «Лютик»', 1, 25)"
+    ), {'user_id': outgoing.user_id})
+
+    assert migration.check_unique_numbers(db.session.connection(), tables=('letter_incoming',)) is None
+    with pytest.raises(RuntimeError) as error:
+        migration.check_unique_numbers(db.session.connection())
+
+    report = str(error.value)
+    assert 'Повторяющиеся номера (year, sequence_num): 1' in report
+    assert f'letter_outgoing: год 25, номер 1 — #{outgoing.id} H-1/25, #' in report and 'H-01/25' in report
+
+
+def test_sort_index_downgrade_skips_constraint_when_numbers_repeat_across_years(app, letters, load_migration):
+    migration = load_migration('4b1d7e9c2a60_year_sequence_num_sort_index')
+    db.session.add(LetterIncoming(user_id=letters[0].user_id, number='ВХ-1/24', sequence_num=1, year=24,
+                                  organization='ООО «Ромашка»', subject='Прошлогоднее'))
+    db.session.commit()
+
+    run_migration(migration.downgrade)
+
+    indexes = {
+        table: {index['name'] for index in db.inspect(db.session.connection()).get_indexes(table)}
+        for table in migration.TABLES
+    }
+    constraints = {
+        table: {c['name'] for c in db.inspect(db.session.connection()).get_unique_constraints(table)}
+        for table in migration.TABLES
+    }
+    assert 'ix_letter_incoming_year_sequence_num' not in indexes['letter_incoming']
+    # Во входящих 1 повторяется в 24 и 25 году — ограничение не вернуть; в исходящих — можно
+    assert 'letter_incoming_sequence_num_key' not in constraints['letter_incoming']
+    assert 'letter_outgoing_sequence_num_key' in constraints['letter_outgoing']
@@ -0,0 +1,118 @@
+from datetime import datetime
+
+import pytest
+
+from app import db
+from app.models import LetterIncoming, LetterOutgoing, NumberCounter
+from app.numbering import current_year, next_numbers_preview, reserve_numbers
+
+
+def new_incoming(user_id, **fields):
+    return LetterIncoming(user_id=user_id, organization='ООО «Ромашка»', subject='Запрос',
+                          date_received=datetime(2025, 1, 2), **fields)
+
+
+def test_dashboard_does_not_consume_numbers(client, letters, query_counter):
+    urls = ('/admin/admin/', '/admin/admin/dashboard', '/admin/admin/')
+    with query_counter() as queries:
+        pages = [client.get(url).get_data(as_text=True) for url in urls]
+
+    sql = ' '.join(queries.statements).lower()
+    assert 'nextval' not in sql and 'setval' not in sql
+    assert 'insert' not in sql and 'update' not in sql
+    for html in pages:
+        assert f'H-1/{current_year()}' in html and f'ВХ-1/{current_year()}' in html
+
+
+def test_preview_is_cached_until_letter_created(app, letters):
+    year = current_year()
+    assert next_numbers_preview()['next_incoming'] == f'ВХ-1/{year}'
+
+    # Запись мимо ORM кэш не сбрасывает — превью живёт до TTL
+    db.session.add(NumberCounter(register='incoming', year=year, last_value=5))
+    db.session.commit()
+    assert next_numbers_preview()['next_incoming'] == f'ВХ-1/{year}'
+
+    db.session.add(new_incoming(letters[0].user_id))
+    db.session.commit()
+    assert next_numbers_preview()['next_incoming'] == f'ВХ-7/{year}'
+
+
+def test_numbers_follow_existing_letters_and_come_in_batches(app, letters):
+    user_id = letters[0].user_id
+    batch = [new_incoming(user_id, year=25) for _ in range(3)]
+    db.session.add_all(batch)
+    db.session.add(LetterOutgoing(user_id=user_id, subject='Ответ', recipient='АО «Лютик»'))
+    db.session.commit()
+
+    # За 25-й год уже есть ВХ-1/25 — счётчик продолжает после него, по порядку add()
+    assert [letter.number for letter in batch] == ['ВХ-2/25', 'ВХ-3/25', 'ВХ-4/25']
+    assert LetterOutgoing.query.filter_by(year=current_year()).one().number == f'H-1/{current_year()}'
+
+    assert [number for _, number in reserve_numbers('incoming', 2, year=25)] == ['ВХ-5/25', 'ВХ-6/25']
+    db.session.commit()
+
+
+def test_rolled_back_letter_returns_its_number(app, letters):
+    user_id = letters[0].user_id
+    db.session.add(new_incoming(user_id))
+    db.session.flush()
+    db.session.rollback()
+
+    letter = new_incoming(user_id)
+    db.session.add(letter)
+    db.session.commit()
+    assert letter.sequence_num == 1
+
+
+@pytest.mark.parametrize('fields', [
+    {'number': 'ВХ-7/25'},
+    {'number': 'ВХ-7/25', 'sequence_num': 8, 'year': 25},
+    {'number': 'ВХ-7/25', 'sequence_num': 7, 'year': 24},
+    {'sequence_num': 7, 'year': 25},
+])
+def test_inconsistent_manual_number_is_rejected(app, letters, fields):
+    db.session.add(new_incoming(letters[0].user_id, **fields))
+
+    with pytest.raises(ValueError, match='не совпадает'):
+        db.session.flush()
+    db.session.rollback()
+    assert LetterIncoming.query.count() == 1
+
+
+def test_consistent_manual_number_is_kept(app, letters):
+    letter = new_incoming(letters[0].user_id, number='ВХ-7/25', sequence_num=7, year=25)
+    db.session.add(letter)
+    db.session.commit()
+
+    assert (letter.number, letter.sequence_num, letter.year) == ('ВХ-7/25', 7, 25)
+
+
+def test_manual_number_above_counter_is_skipped_by_counter(app, letters):
+    user_id = letters[0].user_id
+    db.session.add_all([new_incoming(user_id, year=25) for _ in range(2)])
+    db.session.commit()
+    assert db.session.get(NumberCounter, ('incoming', 25)).last_value == 3
+
+    db.session.add(new_incoming(user_id, number='ВХ-7/25', sequence_num=7, year=25))
+    db.session.commit()
+    assert db.session.get(NumberCounter, ('incoming', 25)).last_value == 7
+
+    # Счётчик доходит до ручного номера и перешагивает его, а не упирается в уникальный индекс
+    batch = [new_incoming(user_id, year=25) for _ in range(2)]
+    db.session.add_all(batch)
+    db.session.commit()
+    assert [letter.number for letter in batch] == ['ВХ-8/25', 'ВХ-9/25']
+
+
+def test_manual_and_counter_numbers_in_one_flush(app, letters):
+    user_id = letters[0].user_id
+    auto = new_incoming(user_id, year=25)
+    db.session.add_all([auto, new_incoming(user_id, number='ВХ-5/25', sequence_num=5, year=25)])
+    db.session.commit()
+
+    assert auto.number == 'ВХ-6/25'
+    # Ручной номер ниже счётчика счётчик не опускает
+    db.session.add(new_incoming(user_id, number='ВХ-2/25', sequence_num=2, year=25))
+    db.session.commit()
+    assert db.session.get(NumberCounter, ('incoming', 25)).last_value == 6
@@ -0,0 +1,113 @@
+import base64
+import json
+import re
+
+import pytest
+
+from app import db
+from app.models import LetterIncoming
+from app.pagination import decode_cursor, encode_cursor, keyset_paginate
+
+
+COLUMNS = (LetterIncoming.year, LetterIncoming.sequence_num)
+
+
+@pytest.fixture
+def numbered(admin):
+    """ВХ-1..3/25 и ВХ-1..4/24: страница по 3 обрывается посреди 24-го года."""
+    for year, count in ((25, 3), (24, 4)):
+        for seq in range(1, count + 1):
+            db.session.add(LetterIncoming(user_id=admin.id, number=f'ВХ-{seq}/{year}',
+                                          sequence_num=seq, year=year, organization='ООО «Ромашка»',
+                                          subject='Письмо'))
+    db.session.commit()
+
+
+def numbers(page):
+    return [letter.number for letter in page.items]
+
+
+def raw_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def test_cursor_round_trip():
+    token = encode_cursor((24, 4), 'prev')
+
+    assert '=' not in token
+    assert decode_cursor(token) == ((24, 4), 'prev')
+    assert decode_cursor(None) == (None, 'next')
+
+
+@pytest.mark.parametrize('token', [
+    'не base64',
+    'Zm9v',  # «foo» — не JSON
+    raw_cursor(['k', 'd']),
+    raw_cursor({'k': ['x', 1]}),
+    raw_cursor({'d': 'next'}),
+])
+def test_malformed_cursor_means_first_page(token):
+    assert decode_cursor(token) == (None, 'next')
+
+
+def test_unknown_direction_falls_back_to_next():
+    assert decode_cursor(raw_cursor({'k': [25, 1], 'd': 'sideways'})) == ((25, 1), 'next')
+
+
+def test_pages_forward_and_back_across_year(app, numbered):
+    first = keyset_paginate(LetterIncoming.query, COLUMNS, per_page=3)
+    assert numbers(first) == ['ВХ-3/25', 'ВХ-2/25', 'ВХ-1/25']
+    assert not first.has_prev and first.has_next
+
+    # Граница внутри года: сравнивается пара (year, sequence_num), а не один номер
+    second = keyset_paginate(LetterIncoming.query, COLUMNS, cursor=first.next_cursor, per_page=3)
+    assert numbers(second) == ['ВХ-4/24', 'ВХ-3/24', 'ВХ-2/24']
+    assert second.has_prev and second.has_next
+
+    last = keyset_paginate(LetterIncoming.query, COLUMNS, cursor=second.next_cursor, per_page=3)
+    assert numbers(last) == ['ВХ-1/24']
+    assert last.has_prev and not last.has_next
+
+    # Назад — выборка в обратном порядке, но строки страницы снова по убыванию
+    back = keyset_paginate(LetterIncoming.query, COLUMNS, cursor=last.prev_cursor, per_page=3)
+    assert numbers(back) == numbers(second)
+    assert back.has_prev and back.has_next
+
+    start = keyset_paginate(LetterIncoming.query, COLUMNS, cursor=back.prev_cursor, per_page=3)
+    assert numbers(start) == numbers(first)
+    assert not start.has_prev and start.has_next
+
+
+@pytest.mark.parametrize('cursor', ['мусор', raw_cursor({'k': [25], 'd': 'next'}), raw_cursor({'k': [1, 2, 3]})])
+def test_list_with_malformed_cursor_shows_first_page(client, numbered, cursor):
+    response = client.get('/incoming/list', query_string={'cursor': cursor, 'per_page': 3})
+
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert 'ВХ-3/25' in html and 'ВХ-4/24' not in html
+
+
+@pytest.mark.parametrize('letter_type', ['incoming', 'outgoing'])
+def test_list_follows_next_cursor_with_same_page_size(client, admin, letter_type):
+    from app.models import LetterOutgoing
+
+    model, prefix = (LetterIncoming, 'ВХ') if letter_type == 'incoming' else (LetterOutgoing, 'H')
+    for seq in range(1, 8):
+        db.session.add(model(user_id=admin.id, number=f'{prefix}-{seq}/25', sequence_num=seq, year=25,
+                             subject='Письмо'))
+    db.session.commit()
+
+    url, pages = f'/{letter_type}/list?per_page=3', []
+    while url and len(pages) < 5:
+        # Размер страницы должен ехать в ссылке, а не только в сессии
+        with client.session_transaction() as session:
+            session.pop('per_page', None)
+        html = client.get(url).get_data(as_text=True)
+        pages.append(list(dict.fromkeys(re.findall(rf'{prefix}-(\d+)/25', html))))
+        next_item = re.search(r'page-item ?(disabled)?\s*">\s*<a class="page-link" href="([^"]+)">Старее', html)
+        url = None if next_item.group(1) else next_item.group(2).replace('&amp;', '&')
+        if url:
+            assert 'per_page=3' in url
+
+    assert pages == [['7', '6', '5'], ['4', '3', '2'], ['1']]
+    assert 'per_page=3' in re.search(r'href="([^"]+)">Постраничная', html).group(1)
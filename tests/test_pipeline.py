@@ -0,0 +1,176 @@
+import io
+import os
+import time
+import zipfile
+from concurrent.futures import TimeoutError
+
+import pytest
+
+from app import db
+from app.models import Attachment, AttachmentStage, AttachmentText, LetterOutgoing, Role, User
+from app.queries import filter_outgoing
+
+
+def make_docx(*paragraphs):
+    ns = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+    body = ''.join(f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>' for text in paragraphs)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('[Content_Types].xml', '<Types/>')
+        archive.writestr('word/document.xml', f'<w:document xmlns:w="{ns}"><w:body>{body}</w:body></w:document>')
+    return buffer.getvalue()
+
+
+def make_pdf(text):
+    """Одностраничный PDF с текстовым слоем (латиница, шрифт Helvetica)."""
+    stream = f'BT /F1 12 Tf 72 720 Td ({text}) Tj ET'.encode()
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+        b'/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+        b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream),
+    ]
+    pdf, offsets = bytearray(b'%PDF-1.4\n'), []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(pdf)
+    pdf += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    pdf += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    pdf += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+
+def hanging_extract(path, codec, ext):
+    """Извлекатель для пула процессов: на «битом» файле зависает, как pypdf на кривом PDF."""
+    if path.endswith('broken.pdf'):
+        time.sleep(600)
+    return 'текст'
+
+
+def wait_for_pipeline(app):
+    app.extensions['pipeline_executor'].shutdown(wait=True)
+    del app.extensions['pipeline_executor']
+
+
+def stage_statuses(attachment):
+    rows = AttachmentStage.query.filter_by(attachment_id=attachment.id)
+    return {row.stage: row.status for row in rows}
+
+
+def test_upload_is_processed_in_background(app, client, letters):
+    app.config['ATTACHMENT_PIPELINE'] = True
+    incoming = letters[0]
+
+    client.post(
+        f'/incoming/{incoming.id}/attachments',
+        data={'file': [(io.BytesIO(make_docx('Договор поставки', 'Срок — 10 дней')), 'Договор.docx'),
+                       (io.BytesIO(b'MZ not a pdf'), 'Скан.pdf')]},
+        content_type='multipart/form-data'
+    )
+    wait_for_pipeline(app)
+    db.session.expire_all()
+
+    docx, fake = Attachment.query.order_by(Attachment.id).all()
+    assert stage_statuses(docx) == {'hash': 'skipped', 'mime': 'done', 'text': 'done', 'index': 'skipped'}
+    assert docx.text.content == 'Договор поставки\nСрок — 10 дней'
+
+    # Не PDF — дальше проверки типа не идёт и отдаётся как поток байтов
+    assert stage_statuses(fake) == {'hash': 'skipped', 'mime': 'failed', 'text': 'pending', 'index': 'pending'}
+    assert fake.mime_type == 'application/octet-stream'
+
+
+def test_backlog_command_processes_legacy_and_retries(app, letters):
+    incoming = letters[0]
+    path = os.path.join(app.config['UPLOAD_FOLDER'], 'old', 'Опись.docx')
+    db.session.add(Attachment(letter_id=incoming.id, letter_type='incoming', filename='Опись.docx', filepath=path))
+    db.session.commit()
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=['attachments-process', '--workers', '1'])
+    assert 'с ошибкой: 1' in result.output
+    attachment = Attachment.query.one()
+    assert stage_statuses(attachment)['hash'] == 'failed'
+
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(make_docx('Опись документов'))
+
+    assert 'Обработано: 0' in runner.invoke(args=['attachments-process']).output
+    result = runner.invoke(args=['attachments-process', '--retry-failed', '--workers', '1'])
+    assert 'полностью: 1' in result.output
+    db.session.expire_all()
+    assert Attachment.query.one().text.content == 'Опись документов'
+    assert AttachmentStage.query.filter_by(stage='hash').one().attempts == 2
+
+
+def test_extract_text_command_fills_content_search(app, client, letters):
+    incoming = letters[0]
+    folder = os.path.join(app.config['UPLOAD_FOLDER'], 'old')
+    os.makedirs(folder)
+    for name, content in (('Счёт.pdf', make_pdf('Invoice for steel pipes')), ('Акт.docx', make_docx('Акт сверки'))):
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(content)
+        db.session.add(Attachment(letter_id=incoming.id, letter_type='incoming', filename=name,
+                                  filepath=os.path.join(folder, name)))
+    db.session.commit()
+
+    # Разбор идёт в настоящем пуле процессов
+    result = app.test_cli_runner().invoke(args=['attachments-extract-text', '--processes', '1'])
+    assert 'полностью: 2' in result.output
+    assert 'text_extract_pool' not in app.extensions
+    db.session.expire_all()
+    texts = {attachment.filename: attachment.text.content for attachment in Attachment.query}
+    assert 'steel pipes' in texts['Счёт.pdf']
+    assert texts['Акт.docx'] == 'Акт сверки'
+
+    assert incoming.number in client.get('/incoming/list?content=STEEL').get_data(as_text=True)
+    assert incoming.number not in client.get('/incoming/list?content=copper').get_data(as_text=True)
+
+    # Повторный запуск продолжает с места остановки — делать уже нечего
+    assert 'Обработано: 0' in app.test_cli_runner().invoke(args=['attachments-extract-text']).output
+
+
+def test_content_search_skips_protected_attachments(app, letters):
+    _, outgoing = letters
+    outgoing.is_protected = True
+    db.session.add(Attachment(letter_id=outgoing.id, letter_type='outgoing', filename='Приказ.docx',
+                              filepath='/nonexistent/Приказ.docx', text=AttachmentText(content='О премировании')))
+    viewer = User(username='viewer', email='viewer@example.com', display_name='Читатель',
+                  password_hash='-', role=Role(name='Viewer'))
+    db.session.add(viewer)
+    db.session.commit()
+
+    args = {'content': 'премировании'}
+    assert filter_outgoing(LetterOutgoing.query, args)[0].all() == [outgoing]
+    assert filter_outgoing(LetterOutgoing.query, args, viewer)[0].all() == []
+
+
+def test_hung_extraction_replaces_pool(app, monkeypatch):
+    import app.pipeline as pipeline
+
+    monkeypatch.setattr(pipeline, 'extract_text', hanging_extract)
+    app.config.update(TEXT_EXTRACT_PROCESSES=1, TEXT_EXTRACT_TIMEOUT=60)
+    try:
+        # Первый вызов ждёт и запуск процесса пула, поэтому таймаут сокращаем уже после него
+        assert pipeline.extract_in_pool('ok.pdf', None, 'pdf') == 'текст'
+        pool = app.extensions['text_extract_pool']
+        [process] = pool._processes.values()
+        app.config['TEXT_EXTRACT_TIMEOUT'] = 1
+
+        with pytest.raises(TimeoutError):
+            pipeline.extract_in_pool('broken.pdf', None, 'pdf')
+
+        process.join(timeout=5)
+        assert not process.is_alive()
+        assert 'text_extract_pool' not in app.extensions
+
+        # Зависший процесс не занимает место — следующий файл разбирается в новом пуле
+        app.config['TEXT_EXTRACT_TIMEOUT'] = 60
+        assert pipeline.extract_in_pool('ok.pdf', None, 'pdf') == 'текст'
+        assert app.extensions['text_extract_pool'] is not pool
+    finally:
+        if 'text_extract_pool' in app.extensions:
+            app.extensions.pop('text_extract_pool').shutdown()
@@ -0,0 +1,102 @@
+import pytest
+
+from app import db
+from app.models import LetterIncoming, LetterOutgoing
+from app.search import SearchPage, highlight, search_letters
+
+
+def test_highlight_escapes_text_and_marks_matches():
+    html = highlight('Счёт <b>&</b> \x02договор\x03 поставки \x02договора\x03')
+
+    assert str(html) == 'Счёт &lt;b&gt;&amp;&lt;/b&gt; <mark>договор</mark> поставки <mark>договора</mark>'
+    assert highlight(None) == ''
+
+
+def test_search_page_navigation():
+    first = SearchPage([], page=1, per_page=20, has_next=True)
+    assert not first.has_prev and first.has_next and first.next_num == 2
+
+    last = SearchPage([], page=3, per_page=20, has_next=False)
+    assert last.has_prev and last.prev_num == 2 and not last.has_next
+
+
+def test_search_letters_pages_with_one_extra_row(app, monkeypatch):
+    calls = []
+
+    class Rows:
+        def __init__(self, rows):
+            self.rows = rows
+
+        def mappings(self):
+            return self
+
+        def all(self):
+            return self.rows
+
+    def execute(statement, params):
+        calls.append(params)
+        return Rows([
+            {'kind': 'incoming', 'id': i, 'number': f'ВХ-{i}/25', 'letter_date': None, 'rank': 1.0,
+             'subject': '\x02Договор\x03', 'counterpart': 'ООО «Ромашка»'}
+            for i in range(params['limit'])
+        ])
+
+    monkeypatch.setattr(db.session, 'execute', execute)
+
+    page = search_letters('договор', page=3, per_page=2)
+    assert calls[-1] == {'q': 'договор', 'limit': 3, 'offset': 4}
+    assert len(page.items) == 2 and page.has_next and page.has_prev
+    assert str(page.items[0]['subject']) == '<mark>Договор</mark>'
+
+    # Нулевые и отрицательные значения не превращаются в LIMIT 0 / OFFSET < 0
+    search_letters('договор', page=-5, per_page=0)
+    assert calls[-1] == {'q': 'договор', 'limit': 2, 'offset': 0}
+
+
+@pytest.mark.parametrize('args, expected', [
+    ('per_page=0&page=0', (1, 1)),
+    ('per_page=-10&page=-3', (1, 1)),
+    ('per_page=1000&page=2', (2, 100)),
+])
+def test_search_route_clamps_paging(client, monkeypatch, args, expected):
+    import app.routes.search as search_routes
+
+    calls = []
+    monkeypatch.setattr(search_routes, 'search_letters', lambda q, page, per_page: calls.append((page, per_page))
+                        or SearchPage([], page, per_page, has_next=False))
+
+    response = client.get(f'/search/?q=договор&{args}')
+
+    assert response.status_code == 200
+    assert calls == [expected]
+
+
+def add_search_vectors(migration):
+    """Колонки search_vector из миграции — в тестовой схеме их создаёт не create_all."""
+    for table, expression in migration.SEARCH_VECTORS.items():
+        db.session.execute(db.text(
+            f'ALTER TABLE {table} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ({expression}) STORED'
+        ))
+
+
+def test_full_text_search_ranks_both_registers(app, admin, load_migration):
+    if db.engine.dialect.name != 'postgresql':
+        pytest.skip('Полнотекстовый поиск есть только в Postgres')
+
+    add_search_vectors(load_migration('c8a2f4d61e07_russian_fulltext_search_vectors'))
+    db.session.add_all([
+        LetterIncoming(user_id=admin.id, number='ВХ-1/25', sequence_num=1, year=25,
+                       organization='ООО «Договоры»', subject='Счёт'),
+        LetterIncoming(user_id=admin.id, number='ВХ-2/25', sequence_num=2, year=25,
+                       organization='ООО «Ромашка»', subject='Договор поставки'),
+        LetterOutgoing(user_id=admin.id, number='H-1/25', sequence_num=1, year=25,
+                       subject='Ответ на письмо', recipient='АО «Лютик»'),
+    ])
+    db.session.commit()
+
+    page = search_letters('договоры', per_page=1)
+
+    # Совпадение в теме (вес A) выше, чем в названии организации (вес B)
+    assert [hit['number'] for hit in page.items] == ['ВХ-2/25'] and page.has_next
+    assert '<mark>' in str(page.items[0]['subject'])
+    assert [hit['number'] for hit in search_letters('договоры', page=2, per_page=1).items] == ['ВХ-1/25']
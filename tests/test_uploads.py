@@ -0,0 +1,382 @@
+import hashlib
+import io
+import os
+import time
+
+import pytest
+
+from app import db
+from app.models import Attachment, StoredBlob
+
+
+def staging_files(app):
+    folder = os.path.join(app.config['UPLOAD_FOLDER'], '.staging')
+    return os.listdir(folder) if os.path.isdir(folder) else []
+
+
+@pytest.mark.parametrize('letter_type', ['incoming', 'outgoing'])
+def test_upload_stores_size_and_hash(app, client, letters, letter_type):
+    letter = letters[0] if letter_type == 'incoming' else letters[1]
+    content = os.urandom(300 * 1024)
+
+    response = client.post(
+        f'/{letter_type}/{letter.id}/attachments',
+        data={'file': (io.BytesIO(content), 'Договор поставки.pdf')},
+        content_type='multipart/form-data'
+    )
+
+    assert response.status_code == 302
+    attachment = Attachment.query.filter_by(letter_id=letter.id, letter_type=letter_type).one()
+    assert attachment.filename == 'Договор поставки.pdf'
+    assert attachment.size_bytes == len(content)
+    assert attachment.content_hash == hashlib.sha256(content).hexdigest()
+    with open(attachment.filepath, 'rb') as f:
+        assert f.read() == content
+    assert staging_files(app) == []
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_stored_blob_is_readable_by_web_server(app, client, letters, compression):
+    from app.uploads import FILE_MODE
+
+    app.config['ATTACHMENT_COMPRESSION'] = compression
+    upload(client, 'incoming', letters[0], b'%PDF-1.4 plain text ' * 1000, name='scan.pdf')
+
+    attachment = Attachment.query.one()
+    assert attachment.codec == compression
+    # Права не зависят от того, сжимался ли файл: как у файла, созданного open()
+    assert os.stat(attachment.filepath).st_mode & 0o777 == FILE_MODE
+
+
+def test_oversized_upload_is_rejected_while_streaming(app, client, letters):
+    app.config['MAX_ATTACHMENT_SIZE'] = 100 * 1024
+
+    response = client.post(
+        f'/outgoing/{letters[1].id}/attachments',
+        data={'file': (io.BytesIO(b'x' * 300 * 1024), 'big.pdf')},
+        content_type='multipart/form-data'
+    )
+
+    assert response.status_code == 302
+    assert Attachment.query.count() == 0
+    assert staging_files(app) == []
+
+
+def upload(client, letter_type, letter, content, name='Шаблон договора.pdf'):
+    return client.post(
+        f'/{letter_type}/{letter.id}/attachments',
+        data={'file': (io.BytesIO(content), name)},
+        content_type='multipart/form-data'
+    )
+
+
+def test_identical_files_are_stored_once(app, client, letters):
+    incoming, outgoing = letters
+    content = b'%PDF-1.4 contract template'
+    upload(client, 'incoming', incoming, content)
+    upload(client, 'outgoing', outgoing, content)
+
+    first, second = Attachment.query.order_by(Attachment.id).all()
+    assert first.filepath == second.filepath
+    blob = db.session.get(StoredBlob, first.content_hash)
+    assert blob.ref_count == 2
+
+    client.post(f'/incoming/{incoming.id}/attachments/{first.id}/delete')
+    db.session.refresh(blob)
+    assert blob.ref_count == 1
+    assert os.path.exists(second.filepath)
+
+    client.post(f'/outgoing/outgoing/delete/{outgoing.id}')
+    assert db.session.get(StoredBlob, second.content_hash) is None
+    assert not os.path.exists(second.filepath)
+
+
+@pytest.mark.parametrize('letter_type', ['incoming', 'outgoing'])
+def test_many_files_in_one_request(app, client, letters, letter_type):
+    letter = letters[0] if letter_type == 'incoming' else letters[1]
+    pages = [os.urandom(100 * 1024) for _ in range(5)]
+
+    response = client.post(
+        f'/{letter_type}/{letter.id}/attachments',
+        data={'file': [(io.BytesIO(page), f'Скан {i}.pdf') for i, page in enumerate(pages, 1)]
+              + [(io.BytesIO(b'MZ'), 'setup.exe')]},
+        content_type='multipart/form-data'
+    )
+
+    assert response.status_code == 302
+    attachments = Attachment.query.filter_by(letter_id=letter.id).order_by(Attachment.id).all()
+    assert [a.filename for a in attachments] == [f'Скан {i}.pdf' for i in range(1, 6)]
+    assert [a.content_hash for a in attachments] == [hashlib.sha256(page).hexdigest() for page in pages]
+    assert staging_files(app) == []
+    with client.session_transaction() as session:
+        messages = [message for _, message in session['_flashes']]
+    assert sum('успешно загружен' in message for message in messages) == 5
+    assert any('setup.exe' in message for message in messages)
+
+
+@pytest.mark.parametrize('letter_type', ['incoming', 'outgoing'])
+def test_duplicate_name_waits_for_confirmation(client, letters, letter_type):
+    letter = letters[0] if letter_type == 'incoming' else letters[1]
+    upload(client, letter_type, letter, b'v1', name='Приказ.pdf')
+
+    response = client.post(
+        f'/{letter_type}/{letter.id}/attachments',
+        data={'file': [(io.BytesIO(b'v2'), 'Приказ.pdf'), (io.BytesIO(b'new'), 'Опись.pdf')]},
+        content_type='multipart/form-data'
+    )
+
+    # Новый файл сохранён сразу, повтор — ждёт «Загрузить всё равно»
+    assert response.status_code == 200
+    assert 'Загрузить всё равно' in response.get_data(as_text=True)
+    assert sorted(a.filename for a in Attachment.query) == ['Опись.pdf', 'Приказ.pdf']
+
+    client.post(
+        f'/{letter_type}/{letter.id}/attachments',
+        data={'file': (io.BytesIO(b'v2'), 'Приказ.pdf'), 'force': '1'},
+        content_type='multipart/form-data'
+    )
+    assert Attachment.query.filter_by(filename='Приказ.pdf').count() == 2
+
+
+def test_storage_migrate_converts_legacy_tree(app, letters):
+    incoming, outgoing = letters
+    legacy = [
+        ('incoming', incoming, 'VH_1_25/prikaz_1a2b.pdf', b'order'),
+        ('outgoing', outgoing, 'H_1_25/prikaz_3c4d.pdf', b'order'),
+        ('outgoing', outgoing, 'H_1_25/otvet_5e6f.pdf', b'reply'),
+    ]
+    for letter_type, letter, relpath, content in legacy:
+        path = os.path.join(app.config['UPLOAD_FOLDER'], letter_type, 'admin', '2025', '01', relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        db.session.add(Attachment(letter_id=letter.id, letter_type=letter_type,
+                                  filename=os.path.basename(path), filepath=path))
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['storage-migrate'])
+
+    assert 'Перенесено: 2, дубликатов: 1' in result.output
+    attachments = Attachment.query.order_by(Attachment.id).all()
+    assert attachments[0].filepath == attachments[1].filepath != attachments[2].filepath
+    assert [db.session.get(StoredBlob, a.content_hash).ref_count for a in attachments] == [2, 2, 1]
+    with open(attachments[2].filepath, 'rb') as f:
+        assert f.read() == b'reply'
+    assert not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], 'incoming'))
+
+
+def test_attachments_backfill_fills_metadata(app, letters):
+    incoming, _ = letters
+    path = os.path.join(app.config['UPLOAD_FOLDER'], 'old', 'Акт.pdf')
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(b'%PDF-1.3 act')
+    db.session.add_all([
+        Attachment(letter_id=incoming.id, letter_type='incoming', filename='Акт.pdf', filepath=path),
+        Attachment(letter_id=incoming.id, letter_type='incoming', filename='Пропал.doc',
+                   filepath=os.path.join(app.config['UPLOAD_FOLDER'], 'old', 'gone.doc')),
+    ])
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['attachments-backfill', '--workers', '2'])
+
+    assert 'Обновлено: 1, не найдено: 1' in result.output
+    act, gone = Attachment.query.order_by(Attachment.id).all()
+    assert (act.size_bytes, act.content_hash, act.mime_type) == (
+        12, hashlib.sha256(b'%PDF-1.3 act').hexdigest(), 'application/pdf'
+    )
+    assert gone.size_bytes is None and gone.mime_type == 'application/msword'
+
+
+@pytest.mark.parametrize('mode', ['report', 'quarantine', 'delete'])
+def test_storage_reconcile_finds_orphans_and_missing(app, client, letters, mode):
+    incoming, outgoing = letters
+    upload(client, 'incoming', incoming, b'%PDF kept')
+    upload(client, 'outgoing', outgoing, b'%PDF lost', name='Пропавший.pdf')
+    kept, lost = Attachment.query.order_by(Attachment.id).all()
+    os.remove(lost.filepath)
+
+    root = app.config['UPLOAD_FOLDER']
+    orphans = [os.path.join(root, 'blobs', 'ff', 'ff', 'f' * 64), os.path.join(root, 'incoming', 'old', 'x.pdf')]
+    for path in orphans:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'orphan')
+    fresh = os.path.join(root, 'blobs', 'ee', 'ee', 'e' * 64)
+    os.makedirs(os.path.dirname(fresh))
+    with open(fresh, 'wb') as f:
+        f.write(b'uncommitted upload')
+    old = time.time() - 2 * 3600
+    for path in orphans + [kept.filepath]:
+        os.utime(path, (old, old))
+
+    result = app.test_cli_runner().invoke(args=['storage-reconcile', '--mode', mode, '--workers', '2'])
+
+    assert 'Сирот' in result.output and ': 2 (0.0 МБ)' in result.output
+    assert 'свежих пропущено: 1' in result.output
+    assert 'без файла: 1' in result.output
+    assert os.path.exists(kept.filepath) and os.path.exists(fresh)
+    assert all(os.path.exists(path) == (mode == 'report') for path in orphans)
+    quarantined = os.path.join(root, '.quarantine', 'incoming', 'old', 'x.pdf')
+    assert os.path.exists(quarantined) == (mode == 'quarantine')
+
+
+def test_storage_reconcile_rechecks_orphan_before_delete(app, client, letters, monkeypatch):
+    import app.reconcile as reconcile
+
+    root = app.config['UPLOAD_FOLDER']
+    content = b'%PDF late reference'
+    sha256 = hashlib.sha256(content).hexdigest()
+    path = os.path.join(root, 'blobs', sha256[:2], sha256[2:4], sha256)
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(content)
+    old = time.time() - 2 * 3600
+    os.utime(path, (old, old))
+
+    # Пачку уже сверили, а до удаления загрузка того же содержимого сослалась на блоб
+    find_orphans = reconcile.find_orphans
+
+    def find_then_upload(batch, blobs_root):
+        orphans = find_orphans(batch, blobs_root)
+        if any(candidate == path for candidate, _ in orphans):
+            upload(client, 'incoming', letters[0], content)
+        return orphans
+
+    monkeypatch.setattr(reconcile, 'find_orphans', find_then_upload)
+    result = app.test_cli_runner().invoke(
+        args=['storage-reconcile', '--mode', 'delete', '--workers', '2', '--list']
+    )
+
+    assert 'Уже не сирота' in result.output and 'Сирот удалено: 0' in result.output
+    attachment = Attachment.query.one()
+    assert attachment.filepath == path and os.path.exists(path)
+    assert db.session.get(StoredBlob, sha256).ref_count == 1
+
+
+def test_storage_reconcile_keeps_blob_with_stored_blob_row(app, letters):
+    root = app.config['UPLOAD_FOLDER']
+    sha256 = 'a' * 64
+    path = os.path.join(root, 'blobs', 'aa', 'aa', sha256)
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(b'referenced, attachment not committed yet')
+    old = time.time() - 2 * 3600
+    os.utime(path, (old, old))
+    db.session.add(StoredBlob(sha256=sha256, size_bytes=40, ref_count=1))
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(
+        args=['storage-reconcile', '--mode', 'delete', '--workers', '2', '--list']
+    )
+
+    assert 'Сирота' not in result.output
+    assert os.path.exists(path)
+
+
+def test_released_file_survives_rollback(app, client, letters):
+    from app.storage import release_attachment_file
+
+    upload(client, 'incoming', letters[0], b'%PDF-1.4 draft')
+    attachment = Attachment.query.one()
+
+    release_attachment_file(attachment)
+    db.session.delete(attachment)
+    assert not os.path.exists(attachment.filepath)
+    db.session.rollback()
+    assert os.path.exists(attachment.filepath)
+
+    release_attachment_file(attachment)
+    db.session.delete(attachment)
+    db.session.commit()
+    assert not os.path.exists(attachment.filepath)
+    assert staging_files(app) == []
+
+
+def test_failed_upload_removes_new_blobs(app, client, letters, monkeypatch):
+    import app.utils as utils
+
+    new_attachment = utils.new_attachment
+    calls = []
+
+    def fail_on_second(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 2:
+            raise RuntimeError('диск отвалился')
+        return new_attachment(*args, **kwargs)
+
+    monkeypatch.setattr(utils, 'new_attachment', fail_on_second)
+    blobs = os.path.join(app.config['UPLOAD_FOLDER'], 'blobs')
+    client.post(
+        f'/incoming/{letters[0].id}/attachments',
+        data={'file': [(io.BytesIO(b'%PDF one'), 'one.pdf'), (io.BytesIO(b'%PDF two'), 'two.pdf')]},
+        content_type='multipart/form-data'
+    )
+
+    assert Attachment.query.count() == 0
+    assert [files for _, _, files in os.walk(blobs) if files] == []
+    assert staging_files(app) == []
+
+
+def test_refilled_blob_rewrites_codec_of_existing_attachments(app, client, letters):
+    content = b'%PDF-1.4 plain text ' * 1000
+    app.config['ATTACHMENT_COMPRESSION'] = 'gzip'
+    upload(client, 'incoming', letters[0], content, name='scan.pdf')
+    first = Attachment.query.one()
+    assert first.codec == 'gzip'
+
+    # Файл блоба пропал — следующая загрузка кладёт его заново, уже без сжатия
+    os.remove(first.filepath)
+    app.config['ATTACHMENT_COMPRESSION'] = None
+    upload(client, 'outgoing', letters[1], content, name='scan.pdf')
+
+    db.session.expire_all()
+    assert {a.codec for a in Attachment.query} == {None}
+    assert db.session.get(StoredBlob, first.content_hash).codec is None
+    with open(first.filepath, 'rb') as f:
+        assert f.read() == content
+
+
+def test_orphan_blobs_are_matched_by_indexed_hash(app, client, letters, query_counter):
+    from app.reconcile import find_orphans
+
+    upload(client, 'incoming', letters[0], b'%PDF-1.4 kept')
+    attachment = Attachment.query.one()
+    blobs_root = os.path.join(app.config['UPLOAD_FOLDER'], 'blobs')
+    orphan = os.path.join(blobs_root, 'bb', 'bb', 'b' * 64)
+    batch = [(attachment.filepath, None), (orphan, None)]
+
+    with query_counter() as queries:
+        assert find_orphans(batch, blobs_root) == [(orphan, None)]
+
+    # Блобы сверяются по content_hash и stored_blobs — без поиска по filepath
+    assert not any('attachment.filepath IN' in statement for statement in queries.statements)
+
+
+def test_compression_codec_is_checked_at_startup(monkeypatch):
+    import sys
+    from app.compression import check_codec
+
+    check_codec(None)
+    check_codec('gzip')
+    with pytest.raises(ValueError, match='brotli'):
+        check_codec('brotli')
+
+    # Без пакета zstandard zstd отклоняется сразу, а не на первой загрузке
+    monkeypatch.setitem(sys.modules, 'zstandard', None)
+    with pytest.raises(RuntimeError, match='zstandard'):
+        check_codec('zstd')
+
+
+def test_large_requests_are_accepted_only_by_upload_routes(app, client, letters):
+    app.config['MAX_CONTENT_LENGTH'] = 64 * 1024
+    content = os.urandom(200 * 1024)
+
+    upload(client, 'incoming', letters[0], content, name='scan.pdf')
+    assert Attachment.query.one().size_bytes == len(content)
+
+    # Остальные маршруты живут с маленьким общим лимитом
+    response = client.post('/incoming/new', data={'subject': 'x' * 100 * 1024})
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert 'слишком большой' in session['_flashes'][-1][1]